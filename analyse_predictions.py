@@ -3,24 +3,48 @@ import re
 import requests
 from bs4 import BeautifulSoup
 import time
-from typing import List, Dict, Union
+from typing import List, Dict, Iterator, Optional, Tuple, Union
 import os
+import unicodedata
 from collections import OrderedDict
+from dataclasses import replace
 import numpy as np
 import hdbscan
-from sentence_transformers import SentenceTransformer
 from prompts import (
     FILTER_NOISY_COMMENTS_PROMPT,
     EVALUATE_PREDICTIONS_PROMPT,
     IDENTIFY_THEMES_PROMPT,
+    MERGE_THEMES_PROMPT,
+    PARENT_CONTEXT_PROMPT,
+    FILTER_AND_EXTRACT_PROMPT,
+    OTHER_SUMMARY,
+    OTHER_THEME,
 )
 from schemas import (
     CommentClassification,
     PredictionEvaluation,
+    CommentAnalysisList,
+    Theme,
     ThemesList,
+    ThemeSummary,
 )
 from cache_manager import CacheManager  # Import CacheManager
 from models import BaseAIModel
+from records import (
+    CommentRecord,
+    PredictionRecord,
+    predictions_from_cache,
+    predictions_to_cache,
+)
+from embeddings import embed_texts
+from incremental_clustering import ClusterModel
+from vector_ops import (
+    complete_linkage_labels,
+    group_members,
+    leader_labels,
+    normalize_rows,
+    similar_pairs,
+)
 
 
 def fetch_hacker_news_comments(item_id):
@@ -32,7 +56,8 @@ def fetch_hacker_news_comments(item_id):
 
     Returns:
       A list of dictionaries, where each dictionary represents a comment
-      and contains keys: 'text', 'level', 'author', 'time'.
+      and contains keys: 'id', 'parent', 'text', 'level', 'author', 'time'.
+      'parent' is the id of the comment replied to (None for top-level ones).
       Returns an empty list if the item_id is invalid or an error occurs.
     """
     url = f"https://news.ycombinator.com/item?id={item_id}"
@@ -44,7 +69,10 @@ def fetch_hacker_news_comments(item_id):
         comment_sections = soup.find_all("tr", class_="athing comtr")
 
         comments_data = []
+        # ids of the most recent comment at each reply level
+        ancestors = []
         for comment_section in comment_sections:
+            comment_id = comment_section.get("id")
             level = 0
             # Find the comment indentation, the image for the comment level is an "img" tag with a "width" attribute
             indent_img = comment_section.find("img", attrs={"width": True})
@@ -69,9 +97,23 @@ def fetch_hacker_news_comments(item_id):
                     text += text_element
                     text = re.sub(r"\s+", " ", text)
             text = text.strip()
+
+            # Comments are listed depth-first, so the parent is the latest
+            # comment one level up
+            del ancestors[level:]
+            parent = ancestors[-1] if ancestors else None
+            ancestors.append(comment_id)
+
             # Append to the list
             comments_data.append(
-                {"text": text, "level": level, "author": author, "time": time}
+                {
+                    "id": comment_id,
+                    "parent": parent,
+                    "text": text,
+                    "level": level,
+                    "author": author,
+                    "time": time,
+                }
             )
 
         return comments_data
@@ -84,14 +126,258 @@ def fetch_hacker_news_comments(item_id):
         return []
 
 
+def prepare_comments(comments: List[Union[Dict, str]]) -> List[CommentRecord]:
+    """Standardize raw comments (strings or dicts) into the CommentRecords
+    used by all pipeline steps, dropping entries without text. The reply
+    structure (id, parent, level) is kept for thread-aware batching.
+    Comments without an id (e.g. plain strings) get their position as id, so
+    noise flags and predictions can always be keyed on comment ids."""
+    records = (CommentRecord.from_raw(comment) for comment in comments)
+    records = [record for record in records if record is not None]
+    return [
+        record if record.id is not None else replace(record, id=str(i))
+        for i, record in enumerate(records)
+    ]
+
+
+def batch_comments_by_thread(
+    comments: List[CommentRecord],
+    batch_size: int,
+    lookup: List[CommentRecord] = None,
+) -> List[Tuple[List[CommentRecord], List[CommentRecord]]]:
+    """
+    Groups comments into batches that keep reply subtrees together.
+
+    Comments are expected in page (depth-first) order. A comment joins the
+    current subtree when its parent is part of it (or is the parent of the
+    subtree's root); subtrees are packed into
+    batches of at most batch_size, and subtrees larger than a batch are split
+    in order. For every reply whose parent is not in its batch, the parent is
+    returned once as context for the batch.
+
+    Args:
+        comments: The comments to batch, e.g. the non-noisy ones
+        batch_size: Maximum number of comments per batch
+        lookup: All comments of the thread, used to resolve parents that are
+            not part of `comments` (defaults to `comments`)
+
+    Returns:
+        A list of (batch, context) tuples
+    """
+    by_id = {c.id: c for c in (lookup or comments) if c.id}
+
+    subtrees = []
+    subtree_ids = set()
+    for comment in comments:
+        if subtrees and comment.parent in subtree_ids:
+            subtrees[-1].append(comment)
+        else:
+            subtrees.append([comment])
+            # siblings replying to a comment outside the list stay together
+            subtree_ids = {comment.parent} if comment.parent else set()
+        if comment.id:
+            subtree_ids.add(comment.id)
+
+    batches = []
+    current = []
+    for subtree in subtrees:
+        if len(current) + len(subtree) > batch_size:
+            if current:
+                batches.append(current)
+            current = []
+            while len(subtree) > batch_size:
+                batches.append(subtree[:batch_size])
+                subtree = subtree[batch_size:]
+        current.extend(subtree)
+    if current:
+        batches.append(current)
+
+    result = []
+    for batch in batches:
+        batch_ids = {c.id for c in batch}
+        context = []
+        context_ids = set()
+        for comment in batch:
+            parent = comment.parent
+            if (
+                parent in by_id
+                and parent not in batch_ids
+                and parent not in context_ids
+            ):
+                context.append(by_id[parent])
+                context_ids.add(parent)
+        result.append((batch, context))
+    return result
+
+
+def make_comment_batches(
+    comments: List[CommentRecord],
+    batch_size: int,
+    batching: str = "page",
+    lookup: List[CommentRecord] = None,
+) -> List[Tuple[List[CommentRecord], List[CommentRecord]]]:
+    """
+    Splits comments into (batch, context) tuples using the given strategy:
+    "page" keeps page order without context (context is None), "thread" uses
+    batch_comments_by_thread (context is a possibly empty list).
+    """
+    if batching == "thread":
+        return batch_comments_by_thread(comments, batch_size, lookup)
+    if batching != "page":
+        raise ValueError(f"Unknown batching strategy: {batching}")
+    return [
+        (comments[i : i + batch_size], None)
+        for i in range(0, len(comments), batch_size)
+    ]
+
+
+def format_comment_batch(
+    batch: List[CommentRecord], context: List[CommentRecord] = None
+) -> Tuple[str, str]:
+    """
+    Renders a batch for the filter/extract prompts.
+
+    Returns:
+        The context section (empty without context) and the comment lines.
+        Replies to a context comment are tagged with its reference, so each
+        parent's text is sent once per batch rather than once per reply.
+    """
+    if not context:
+        return "", "\n".join(comment.text for comment in batch)
+
+    refs = {comment.id: f"c{i + 1}" for i, comment in enumerate(context)}
+    context_lines = "\n".join(
+        f"[{refs[comment.id]}] {comment.text}" for comment in context
+    )
+    comment_lines = "\n".join(
+        (
+            f"[reply to {refs[comment.parent]}] {comment.text}"
+            if comment.parent in refs
+            else comment.text
+        )
+        for comment in batch
+    )
+    return PARENT_CONTEXT_PROMPT.format(context=context_lines), comment_lines
+
+
+def comment_cache_key(
+    batch: List[CommentRecord], context: List[CommentRecord] = None
+) -> List:
+    """Cache key for a comment batch; context changes the prompt, so it is
+    part of the key (batches without context keep their existing keys)."""
+    if not context:
+        return batch
+    context_section, comment_lines = format_comment_batch(batch, context)
+    return [context_section] + comment_lines.split("\n")
+
+
+def single_comment_keys(
+    batch: List[CommentRecord], context: List[CommentRecord] = None
+) -> List:
+    """Per-comment cache keys of a batch. Single-pass filter-and-extract runs
+    cache predictions under these so the two-stage path can reassemble any
+    extraction batch from them. With thread batching (context is a list) each
+    key includes the comment's parent, whether or not it shares the batch."""
+    if context is None:
+        return [comment_cache_key([comment]) for comment in batch]
+    by_id = {c.id: c for c in batch + context if c.id}
+    return [
+        comment_cache_key(
+            [comment],
+            [by_id[comment.parent]] if comment.parent in by_id else [],
+        )
+        for comment in batch
+    ]
+
+
+def _fallback_responder(model: BaseAIModel) -> Optional[str]:
+    """The model that answered the last call when it is not `model` itself,
+    i.e. a fallback of a FailoverModel; None otherwise."""
+    return None if model.responder == model.model_name else model.responder
+
+
+def _load_cached_predictions(
+    key: List, model: BaseAIModel, cache_manager: CacheManager
+) -> Tuple[Optional[str], Optional[List[PredictionRecord]]]:
+    """Cached predictions of `key` and the model whose entry they came from.
+    Predictions of another model's entry that don't name who answered (e.g.
+    from a run with that model as the primary) are credited to it."""
+    name, cached = cache_manager.find_cache(model.cache_names, "predictions", key)
+    if cached is None:
+        return None, None
+    predictions = predictions_from_cache(cached)
+    if name != model.model_name:
+        for p in predictions:
+            if p.answered_by is None:
+                p.answered_by = name
+    return name, predictions
+
+
+def load_batch_predictions(
+    batch: List[CommentRecord],
+    context: List[CommentRecord],
+    model: BaseAIModel,
+    cache_manager: CacheManager,
+) -> Optional[List[PredictionRecord]]:
+    """Load a batch's predictions from its own cache entry, or reassemble them
+    from per-comment entries. Returns None on a cache miss."""
+    cache_key = comment_cache_key(batch, context)
+    _, predictions = _load_cached_predictions(cache_key, model, cache_manager)
+    if predictions is not None:
+        return predictions
+
+    per_comment = [
+        _load_cached_predictions(key, model, cache_manager)
+        for key in single_comment_keys(batch, context)
+    ]
+    if any(predictions is None for _, predictions in per_comment):
+        return None
+    predictions = []
+    for comment, (_, comment_predictions) in zip(batch, per_comment):
+        for p in comment_predictions:
+            p.comment_id = comment.id
+            predictions.append(p)
+    # the primary's entries must only hold its own answers
+    if all(name == model.model_name for name, _ in per_comment):
+        cache_manager.save_cache(
+            model.model_name,
+            "predictions",
+            cache_key,
+            predictions_to_cache(predictions),
+        )
+    return predictions
+
+
+def attribute_predictions(
+    predictions: List[PredictionRecord], batch: List[CommentRecord]
+) -> List[PredictionRecord]:
+    """Set the comment_id of predictions extracted from a batch. Predictions
+    are quoted verbatim, so each goes to the comment sharing most of its
+    words; predictions that share none keep comment_id unset."""
+    words = [set(normalize_prediction_text(c.text).split()) for c in batch]
+    for p in predictions:
+        if p.comment_id is not None:
+            continue
+        if len(batch) == 1:
+            p.comment_id = batch[0].id
+            continue
+        tokens = set(normalize_prediction_text(p.prediction).split())
+        overlaps = [len(tokens & comment_words) for comment_words in words]
+        best = overlaps.index(max(overlaps))
+        if overlaps[best]:
+            p.comment_id = batch[best].id
+    return predictions
+
+
 def is_comment_noisy(
-    comments: List[Dict],
+    comments: List[CommentRecord],
     model: BaseAIModel,
     cache_manager: CacheManager,
     batch_size: int = 10,
     retry_count: int = 3,
     retry_delay: int = 1,
     retry_backoff_factor: int = 2,
+    context: List[CommentRecord] = None,
 ) -> List[bool]:
     """
     Checks if comments are noisy using the provided model.
@@ -105,6 +391,8 @@ def is_comment_noisy(
         retry_count: Number of retries on failure
         retry_delay: Initial delay between retries
         retry_backoff_factor: Factor to increase delay between retries
+        context: Parent comments the replies respond to (see
+            batch_comments_by_thread), sent once per batch
 
     Returns:
         A list of booleans indicating if each comment is noisy
@@ -113,16 +401,29 @@ def is_comment_noisy(
     results = []
 
     # Function to process a single batch
-    def process_batch(batch_comments: List[Dict]):
-        batch_texts = [comment["text"] for comment in batch_comments]
+    def process_batch(batch_comments: List[CommentRecord]):
+        batch_texts = [comment.text for comment in batch_comments]
+        parents = {comment.parent for comment in batch_comments}
+        batch_context = [c for c in context or [] if c.id in parents]
+        cache_key = comment_cache_key(batch_comments, batch_context)
         cached_results = cache_manager.load_cache(
-            model.model_name, "noisy_comments", batch_comments
+            model.cache_names, "noisy_comments", cache_key
         )
         if cached_results:
             return cached_results
+        flags = (
+            load_comment_flags(batch_comments, batch_context, model, cache_manager)
+            if len(batch_comments) > 1
+            else None
+        )
+        if flags is not None:
+            return flags
         else:
+            context_section, comment_lines = format_comment_batch(
+                batch_comments, batch_context
+            )
             prompt = FILTER_NOISY_COMMENTS_PROMPT.format(
-                comments="\n".join(batch_texts)
+                context=context_section, comments=comment_lines
             )
             for attempt in range(retry_count):
                 try:
@@ -130,13 +431,17 @@ def is_comment_noisy(
                         prompt, response_format=CommentClassification
                     )
                     if response:
+                        # a truncated response keeps its leading flags; treat
+                        # the missing tail as not noisy, like a failed batch
+                        is_noisy = response.is_noisy[: len(batch_texts)]
+                        is_noisy += [False] * (len(batch_texts) - len(is_noisy))
                         cache_manager.save_cache(
-                            model.model_name,
+                            model.responder,
                             "noisy_comments",
-                            batch_comments,
-                            response.is_noisy,
+                            cache_key,
+                            is_noisy,
                         )
-                        return response.is_noisy
+                        return is_noisy
                     else:
                         if attempt == retry_count - 1:
                             print(
@@ -164,43 +469,171 @@ def is_comment_noisy(
     return results
 
 
+def load_comment_flags(
+    batch: List[CommentRecord],
+    context: Optional[List[CommentRecord]],
+    model: BaseAIModel,
+    cache_manager: CacheManager,
+    classify_missing: bool = True,
+) -> Optional[List[bool]]:
+    """Reassemble a batch's noise flags from per-comment entries (e.g. of a
+    preview or fused run); only the comments without one are classified.
+    None when no comment of the batch has an entry.
+
+    With classify_missing=False nothing is sent: the other comments must be
+    cached as a sub-batch (as is_comment_noisy sends them), else None.
+    """
+    known = [
+        cache_manager.find_cache(model.cache_names, "noisy_comments", key)
+        for key in single_comment_keys(batch, context)
+    ]
+    missing = [i for i, (_, flags) in enumerate(known) if not flags]
+    if len(missing) == len(batch):
+        return None
+    result = [bool(flags and flags[0]) for _, flags in known]
+    if missing:
+        sub_batch, sub_context = comment_sub_batch(batch, context, missing)
+        if classify_missing:
+            sub_flags = is_comment_noisy(
+                sub_batch,
+                model,
+                cache_manager,
+                batch_size=len(sub_batch),
+                context=sub_context,
+            )
+        else:
+            sub_flags = cache_manager.load_cache(
+                model.cache_names,
+                "noisy_comments",
+                comment_cache_key(sub_batch, sub_context),
+            )
+            if sub_flags is None:
+                return None
+        for i, is_noisy in zip(missing, sub_flags):
+            result[i] = is_noisy
+    elif all(name == model.model_name for name, _ in known):
+        # the primary's entries must only hold its own answers
+        cache_manager.save_cache(
+            model.model_name,
+            "noisy_comments",
+            comment_cache_key(batch, context),
+            result,
+        )
+    return result
+
+
+def load_batch_flags(
+    batch: List[CommentRecord],
+    context: Optional[List[CommentRecord]],
+    model: BaseAIModel,
+    cache_manager: CacheManager,
+) -> Optional[List[bool]]:
+    """A batch's cached noise flags, from its own entry or from per-comment
+    entries; None if a comment misses. Sends nothing."""
+    flags = cache_manager.load_cache(
+        model.cache_names, "noisy_comments", comment_cache_key(batch, context)
+    )
+    if flags is None and len(batch) > 1:
+        flags = load_comment_flags(
+            batch, context, model, cache_manager, classify_missing=False
+        )
+    return flags
+
+
+def stream_predictions(
+    batch: List[CommentRecord],
+    model: BaseAIModel,
+    cache_manager: CacheManager,
+    max_retries: int = 3,
+    retry_delay: int = 1,
+    context: List[CommentRecord] = None,
+) -> Iterator[PredictionRecord]:
+    """
+    Extracts predictions from a batch of comments, yielding each prediction as
+    soon as it is complete in the model's streamed response. A response that
+    breaks off keeps (and caches) the predictions completed before the cut.
+    """
+    cache_key = comment_cache_key(batch, context)
+    cached_predictions = load_batch_predictions(batch, context, model, cache_manager)
+    if cached_predictions is not None:
+        yield from cached_predictions
+        return
+
+    context_section, comment_lines = format_comment_batch(batch, context)
+    prompt = EVALUATE_PREDICTIONS_PROMPT.format(
+        context=context_section, comments=comment_lines
+    )
+    predictions = []
+    for prediction in model.call_streaming(
+        prompt,
+        PredictionEvaluation,
+        retry_count=max_retries,
+        retry_delay=retry_delay,
+    ):
+        prediction = PredictionRecord.from_model(prediction, _fallback_responder(model))
+        predictions.append(prediction)
+        yield prediction
+
+    if predictions:
+        cache_manager.save_cache(
+            model.responder,
+            "predictions",
+            cache_key,
+            predictions_to_cache(predictions),
+        )
+
+
 def extract_predictions_with_retry(
-    batch: List[Dict],
+    batch: List[CommentRecord],
     model: BaseAIModel,
     cache_manager: CacheManager,
     max_retries: int = 3,
     retry_delay: int = 1,
-) -> List[Dict]:
+    stream: bool = False,
+    context: List[CommentRecord] = None,
+) -> List[PredictionRecord]:
     """
     Attempts to extract predictions from a batch of comments with retry logic.
+    With stream=True the response is parsed incrementally (see stream_predictions).
+    `context` holds parent comments the replies respond to, sent once per batch.
     """
+    if stream:
+        return list(
+            stream_predictions(
+                batch, model, cache_manager, max_retries, retry_delay, context
+            )
+        )
 
     # Check cache first
-    cached_predictions = cache_manager.load_cache(
-        model.model_name, "predictions", batch
-    )
-    if cached_predictions:
+    cache_key = comment_cache_key(batch, context)
+    cached_predictions = load_batch_predictions(batch, context, model, cache_manager)
+    if cached_predictions is not None:
         return cached_predictions
 
-    batch_texts = [item["text"] for item in batch]
+    context_section, comment_lines = format_comment_batch(batch, context)
 
     for attempt in range(max_retries):
         try:
-            prompt = EVALUATE_PREDICTIONS_PROMPT.format(comments="\n".join(batch_texts))
+            prompt = EVALUATE_PREDICTIONS_PROMPT.format(
+                context=context_section, comments=comment_lines
+            )
             response = model.call_with_retry(
                 prompt, response_format=PredictionEvaluation
             )
             if response:
+                answered_by = _fallback_responder(model)
+                predictions = [
+                    PredictionRecord.from_model(prediction, answered_by)
+                    for prediction in response.predictions
+                ]
                 # Cache the results
                 cache_manager.save_cache(
-                    model.model_name,
+                    model.responder,
                     "predictions",
-                    batch,
-                    [prediction.model_dump() for prediction in response.predictions],
+                    cache_key,
+                    predictions_to_cache(predictions),
                 )
-                return [
-                    prediction.model_dump() for prediction in response.predictions
-                ]  # Ensure return is a dict for easier use
+                return predictions
             else:
                 if attempt == max_retries - 1:  # Last attempt
                     print(
@@ -219,18 +652,223 @@ def extract_predictions_with_retry(
     return []
 
 
+def comment_sub_batch(
+    batch: List[CommentRecord], context: Optional[List[CommentRecord]], indices
+) -> Tuple[List[CommentRecord], Optional[List[CommentRecord]]]:
+    """The comments at `indices` of a batch with their own context: parents
+    outside the sub-batch, so the per-comment keys stay the same."""
+    sub_batch = [batch[i] for i in indices]
+    if context is None:
+        return sub_batch, None
+    by_id = {c.id: c for c in batch + context if c.id}
+    sub_ids = {c.id for c in sub_batch}
+    parent_ids = OrderedDict.fromkeys(
+        c.parent for c in sub_batch if c.parent in by_id and c.parent not in sub_ids
+    )
+    return sub_batch, [by_id[parent] for parent in parent_ids]
+
+
+def load_comment_results(
+    comment_keys: List, model: BaseAIModel, cache_manager: CacheManager
+) -> List[Optional[Tuple[bool, List[PredictionRecord], str]]]:
+    """Per-comment noise flag, predictions and the model whose entries they
+    came from (a fallback's name if either entry is not the primary's),
+    cached under single-comment keys. None where either entry is missing."""
+    results = []
+    for key in comment_keys:
+        name, flags = cache_manager.find_cache(model.cache_names, "noisy_comments", key)
+        if not flags:
+            results.append(None)
+        elif flags[0]:
+            results.append((True, [], name))
+        else:
+            predictions_name, predictions = _load_cached_predictions(
+                key, model, cache_manager
+            )
+            if name == model.model_name:
+                name = predictions_name
+            results.append(None if predictions is None else (False, predictions, name))
+    return results
+
+
+def filter_and_extract(
+    batch: List[CommentRecord],
+    model: BaseAIModel,
+    cache_manager: CacheManager,
+    context: List[CommentRecord] = None,
+    max_retries: int = 3,
+    retry_delay: int = 1,
+) -> Optional[Tuple[List[bool], List[List[PredictionRecord]]]]:
+    """
+    Classifies a batch of comments and extracts their predictions in a single
+    structured response (FILTER_AND_EXTRACT_PROMPT).
+
+    The noise flags are cached under the batch's "noisy_comments" key and,
+    like the predictions, under per-comment keys, so later two-stage runs
+    reuse them. When per-comment entries (e.g. of a preview run) cover part
+    of the batch, only the other comments are sent to the model.
+
+    Returns:
+        The noise flags and the predictions of each comment, or None if the
+        model's answer could not be aligned with the batch (callers should
+        then fall back to is_comment_noisy + extract_predictions_with_retry).
+    """
+    cache_key = comment_cache_key(batch, context)
+    comment_keys = single_comment_keys(batch, context)
+
+    cached_flags = cache_manager.load_cache(
+        model.cache_names, "noisy_comments", cache_key
+    )
+    if cached_flags:
+        cached_predictions = [
+            ([] if is_noisy else _load_cached_predictions(key, model, cache_manager)[1])
+            for is_noisy, key in zip(cached_flags, comment_keys)
+        ]
+        if all(predictions is not None for predictions in cached_predictions):
+            return cached_flags, cached_predictions
+
+    if len(batch) > 1:
+        known = load_comment_results(comment_keys, model, cache_manager)
+        missing = [i for i, result in enumerate(known) if result is None]
+        if len(missing) < len(batch):
+            if missing:
+                sub_batch, sub_context = comment_sub_batch(batch, context, missing)
+                result = filter_and_extract(
+                    sub_batch,
+                    model,
+                    cache_manager,
+                    sub_context,
+                    max_retries,
+                    retry_delay,
+                )
+                if result is None:
+                    return None
+                for i, flag, comment_predictions in zip(missing, *result):
+                    known[i] = (flag, comment_predictions, None)
+                # the sub-batch call cached its comments; re-read them to
+                # learn which model answered
+                sources = load_comment_results(comment_keys, model, cache_manager)
+            else:
+                sources = known
+            flags = [flag for flag, _, _ in known]
+            # the primary's entries must only hold its own answers
+            if all(r is not None and r[2] == model.model_name for r in sources):
+                cache_manager.save_cache(
+                    model.model_name, "noisy_comments", cache_key, flags
+                )
+            return flags, [predictions for _, predictions, _ in known]
+
+    context_section, comment_lines = format_comment_batch(batch, context)
+    prompt = FILTER_AND_EXTRACT_PROMPT.format(
+        context=context_section, comments=comment_lines
+    )
+    for attempt in range(max_retries):
+        response = model.call_with_retry(prompt, response_format=CommentAnalysisList)
+        if response and len(response.comments) == len(batch):
+            break
+        if attempt == max_retries - 1:
+            print(f"Failed to classify and extract batch after {max_retries} attempts")
+            return None
+        time.sleep(retry_delay * (2**attempt))
+
+    flags = [analysis.is_noisy for analysis in response.comments]
+    answered_by = _fallback_responder(model)
+    predictions = [
+        (
+            []
+            if analysis.is_noisy
+            else [
+                PredictionRecord.from_model(p, answered_by)
+                for p in analysis.predictions
+            ]
+        )
+        for analysis in response.comments
+    ]
+    cache_manager.save_cache(model.responder, "noisy_comments", cache_key, flags)
+    for is_noisy, key, comment_predictions in zip(flags, comment_keys, predictions):
+        if len(batch) > 1:
+            cache_manager.save_cache(model.responder, "noisy_comments", key, [is_noisy])
+        if not is_noisy:
+            cache_manager.save_cache(
+                model.responder,
+                "predictions",
+                key,
+                predictions_to_cache(comment_predictions),
+            )
+    return flags, predictions
+
+
+def normalize_prediction_text(text: str) -> str:
+    """Canonical form used to detect exact duplicates (case, punctuation and
+    whitespace insensitive)."""
+    text = unicodedata.normalize("NFKC", text).lower()
+    return " ".join(re.sub(r"[^\w\s]", " ", text).split())
+
+
+def deduplicate_predictions(
+    predictions: List[PredictionRecord], threshold: float = 0.92
+) -> Tuple[List[PredictionRecord], np.ndarray]:
+    """Collapse exact and near-duplicate predictions.
+
+    Predictions with the same normalized text are merged first; the remaining
+    ones are embedded once and merged into the most common wording they
+    reach `threshold` cosine similarity with. Each merged prediction keeps
+    that wording, the mean probability and a `sources` list with the
+    original predictions.
+
+    Returns:
+        The deduplicated predictions and their normalized embeddings.
+    """
+    exact = OrderedDict()
+    for prediction in predictions:
+        key = normalize_prediction_text(prediction.prediction)
+        exact.setdefault(key, []).append(prediction)
+    copies = list(exact.values())
+    if not copies:
+        return [], np.empty((0, 0), dtype=np.float32)
+
+    # stored rows stay compact for the search, only the kept ones are unpacked
+    embeddings = embed_texts([group[0].prediction for group in copies], compact=True)
+    rows, cols, _ = similar_pairs(embeddings, threshold=threshold)
+    # the wording with the most copies leads its group and every other
+    # wording must be a near-duplicate of it, so groups don't chain
+    order = sorted(range(len(copies)), key=lambda i: (-len(copies[i]), i))
+    labels = leader_labels(len(copies), rows, cols, order)
+
+    deduplicated = []
+    keep = []
+    for members in group_members(labels):
+        main = max(members, key=lambda i: (len(copies[i]), -i))
+        sources = [p for i in members for p in copies[i]]
+        merged = copies[main][0]
+        if len(sources) > 1:
+            merged = replace(
+                merged,
+                probability=round(
+                    sum(float(p.probability) for p in sources) / len(sources), 3
+                ),
+                sources=sources,
+            )
+        deduplicated.append(merged)
+        keep.append(main)
+
+    print(f"Collapsed {len(predictions)} predictions into {len(deduplicated)}")
+    return deduplicated, normalize_rows(embeddings[keep])
+
+
 def cluster_predictions(
-    predictions: List[Dict],
+    predictions: List[PredictionRecord],
     min_cluster_size: int = 2,
     max_iterations=3,
     level=0,
     unique_id_prefix="",
-) -> Dict[str, List[Dict]]:
-    """Clusters predictions using HDBSCAN with sentence transformers, recursively clustering subclusters."""
+    embeddings: Optional[np.ndarray] = None,
+) -> Dict[str, List[PredictionRecord]]:
+    """Clusters predictions using HDBSCAN with sentence transformer embeddings (see embeddings.py), recursively clustering subclusters.
+    Precomputed `embeddings` (one row per prediction) skip the encoding step."""
 
-    model = SentenceTransformer("all-MiniLM-L6-v2")
-    prediction_texts = [p["prediction"] for p in predictions]
-    embeddings = model.encode(prediction_texts)
+    if embeddings is None:
+        embeddings = embed_texts([p.prediction for p in predictions])
 
     clusterer = hdbscan.HDBSCAN(
         min_cluster_size=min_cluster_size, gen_min_span_tree=True
@@ -238,11 +876,14 @@ def cluster_predictions(
     cluster_labels = clusterer.fit_predict(embeddings)
 
     clustered_predictions = {}
+    clustered_indices = {}
     for i, label in enumerate(cluster_labels):
         unique_cluster_id = f"{unique_id_prefix}{label}"  # Use a unique identifier for each cluster (including subclusters)
         if unique_cluster_id not in clustered_predictions:
             clustered_predictions[unique_cluster_id] = []
+            clustered_indices[unique_cluster_id] = []
         clustered_predictions[unique_cluster_id].append(predictions[i])
+        clustered_indices[unique_cluster_id].append(i)
 
     # check sizes of cluster if over min_cluster_size then run it again
     if level < max_iterations:
@@ -256,6 +897,7 @@ def cluster_predictions(
                     max_iterations,
                     level + 1,
                     unique_id_prefix=f"{key}-",
+                    embeddings=embeddings[clustered_indices[key]],
                 )
                 new_clustered_predictions.update(subclusters)
             else:
@@ -265,19 +907,210 @@ def cluster_predictions(
     return clustered_predictions
 
 
+def chunk_prompt_data(
+    prompt_data: List[str], max_predictions: int = 100, max_chars: int = 12000
+) -> List[List[str]]:
+    """Split a cluster's predictions into map chunks of bounded size."""
+    chunks = [[]]
+    size = 0
+    for text in prompt_data:
+        if chunks[-1] and (
+            len(chunks[-1]) >= max_predictions or size + len(text) > max_chars
+        ):
+            chunks.append([])
+            size = 0
+        chunks[-1].append(text)
+        size += len(text) + 1
+    return chunks if chunks[0] else []
+
+
+def _themes_for_chunk(
+    prompt_data: List[str],
+    model: BaseAIModel,
+    cache_manager: CacheManager,
+    stream: bool = False,
+) -> Optional[ThemesList]:
+    """Map step: identify the themes of one chunk of a cluster."""
+    cached_themes = cache_manager.load_cache(
+        model.cache_names, "cluster_themes", prompt_data
+    )
+    if cached_themes:
+        return ThemesList.model_validate(cached_themes)
+
+    prompt = IDENTIFY_THEMES_PROMPT.format(
+        predictions_and_evaluations="\n".join(prompt_data)
+    )
+    if stream:
+        response = ThemesList(themes=list(model.call_streaming(prompt, ThemesList)))
+    else:
+        response = model.call_with_retry(prompt, response_format=ThemesList)
+    if response and response.themes:
+        cache_manager.save_cache(
+            model.responder,
+            "cluster_themes",
+            prompt_data,
+            response.model_dump(),
+        )
+    return response
+
+
+def _merged_theme(
+    name: str, summary: str, predictions: List, themes: List[Theme]
+) -> Theme:
+    """A theme covering `themes`: `cluster_ids` lists all their clusters and
+    `cluster_id` is only set when that is a single one."""
+    cluster_ids = list(
+        OrderedDict.fromkeys(
+            cid
+            for theme in themes
+            for cid in theme.cluster_ids or [theme.cluster_id]
+            if cid is not None
+        )
+    )
+    return Theme(
+        theme=name,
+        summary=summary,
+        predictions=predictions,
+        cluster_id=cluster_ids[0] if len(cluster_ids) == 1 else None,
+        cluster_ids=cluster_ids or None,
+    )
+
+
+def _merge_theme_group(
+    group: List[Theme],
+    model: BaseAIModel,
+    cache_manager: CacheManager,
+    max_themes: int = 20,
+) -> Theme:
+    """Merge similar themes into one, naming it with the model.
+
+    At most `max_themes` themes go into one prompt; larger groups are merged
+    in rounds. Falls back to the name of the largest theme.
+    """
+    while len(group) > 1:
+        merged_group = []
+        for start in range(0, len(group), max_themes):
+            chunk = group[start : start + max_themes]
+            if len(chunk) == 1:
+                merged_group.append(chunk[0])
+                continue
+            lines = [f"{theme.theme}: {theme.summary}" for theme in chunk]
+            cached = cache_manager.load_cache(model.cache_names, "merged_themes", lines)
+            if cached:
+                summary = ThemeSummary.model_validate(cached)
+            else:
+                summary = model.call_with_retry(
+                    MERGE_THEMES_PROMPT.format(themes="\n".join(lines)),
+                    response_format=ThemeSummary,
+                )
+                if summary:
+                    cache_manager.save_cache(
+                        model.responder, "merged_themes", lines, summary.model_dump()
+                    )
+            if not summary:
+                largest = max(chunk, key=lambda theme: len(theme.predictions))
+                summary = ThemeSummary(theme=largest.theme, summary=largest.summary)
+            predictions = list(
+                OrderedDict.fromkeys(p for theme in chunk for p in theme.predictions)
+            )
+            merged_group.append(
+                _merged_theme(summary.theme, summary.summary, predictions, chunk)
+            )
+        group = merged_group
+    return group[0]
+
+
+def reduce_themes(
+    themes: List[Theme],
+    model: BaseAIModel,
+    cache_manager: CacheManager,
+    merge_threshold: float = 0.8,
+) -> List[Theme]:
+    """Reduce step: merge themes whose name and summary embeddings are all
+    pairwise at least `merge_threshold` similar (complete linkage, so groups
+    can't chain), and fold every "Other" theme into one. Themes of HDBSCAN's
+    noise cluster take part like any other: it is often the largest cluster
+    and is split across several prompts, so its themes overlap the most."""
+    others = [theme for theme in themes if theme.theme.strip().lower() == "other"]
+    named = [theme for theme in themes if theme.theme.strip().lower() != "other"]
+
+    reduced = []
+    if named:
+        embeddings = embed_texts([f"{theme.theme}: {theme.summary}" for theme in named])
+        labels = complete_linkage_labels(embeddings, merge_threshold)
+        for members in group_members(labels):
+            group = [named[i] for i in members]
+            reduced.append(
+                group[0]
+                if len(group) == 1
+                else _merge_theme_group(group, model, cache_manager)
+            )
+        print(f"Merged {len(named)} themes into {len(reduced)}")
+
+    if others:
+        reduced.append(
+            _merged_theme(
+                OTHER_THEME,
+                OTHER_SUMMARY,
+                list(
+                    OrderedDict.fromkeys(
+                        p for theme in others for p in theme.predictions
+                    )
+                ),
+                others,
+            )
+        )
+    return reduced
+
+
 def identify_themes(
-    predictions: List[Dict],
-    evaluated_predictions: List[Dict],
+    predictions: List[PredictionRecord],
+    evaluated_predictions: List[PredictionRecord],
     model: BaseAIModel,
     cache_manager: CacheManager,
     batch_size: int = 10,
+    stream: bool = False,
+    dedup_threshold: Optional[float] = 0.92,
+    incremental: bool = False,
+    merge_threshold: Optional[float] = 0.8,
+    max_chunk_predictions: int = 100,
+    max_chunk_chars: int = 12000,
+    thread_id: Optional[str] = None,
 ) -> ThemesList:
     """
     Identifies themes in a list of predictions using the provided model.
-    Processes predictions in batches to avoid token limits.
+
+    Map-reduce: every cluster is split into chunks of at most
+    `max_chunk_predictions` predictions / `max_chunk_chars` characters and
+    each chunk is themed on its own (map); themes with similar name and
+    summary embeddings are then merged and all "Other" themes folded into one
+    (reduce, see reduce_themes; merge_threshold=None skips it). With
+    stream=True the themes of each chunk are parsed incrementally from the
+    response.
+    Duplicate predictions are collapsed before clustering (see
+    deduplicate_predictions); pass dedup_threshold=None to keep every copy.
+    With incremental=True new predictions are assigned to the clusters of the
+    model's persisted ClusterModel for `thread_id` instead of refitting, so
+    unchanged clusters reuse their cached themes.
     """
-    # First cluster the predictions
-    clustered_predictions = cluster_predictions(predictions)
+    cache_key = [str(p.to_dict()) for p in predictions] + [
+        str(ep.to_dict()) for ep in evaluated_predictions
+    ]
+    # First collapse duplicates and cluster the predictions
+    embeddings = None
+    if dedup_threshold is not None:
+        predictions, embeddings = deduplicate_predictions(predictions, dedup_threshold)
+    if incremental:
+        clustered_predictions = ClusterModel.for_model(
+            cache_manager.cache_dir, model.model_name, thread_id
+        ).cluster(
+            predictions,
+            embed_texts,
+            lambda preds, emb: cluster_predictions(preds, embeddings=emb),
+            embeddings=embeddings,
+        )
+    else:
+        clustered_predictions = cluster_predictions(predictions, embeddings=embeddings)
 
     all_themes = []
 
@@ -286,40 +1119,57 @@ def identify_themes(
         prompt_data = []
         for prediction in predictions_in_cluster:
             # we will add the predictions here, instead of creating a combined string
-            prompt_data.append(prediction["prediction"])
+            prompt_data.append(prediction.prediction)
 
         print(
             f"Processing cluster id: {cluster_id} with {len(prompt_data)} predictions"
         )
-        prompt = IDENTIFY_THEMES_PROMPT.format(
-            predictions_and_evaluations="\n".join(prompt_data)
-        )
-        response = model.call_with_retry(prompt, response_format=ThemesList)
-        if response:
-            # create a map of the returned themes to the original data from step 2.
-            # We cannot directly send evaluated_predictions since hdbscan returns a different number of clusters.
-            for theme in response.themes:
-                theme_predictions = []
-                for theme_prediction in theme.predictions:
-                    for prediction, eval_prediction in zip(
-                        predictions, evaluated_predictions
-                    ):
-                        if theme_prediction == prediction["prediction"]:
-                            theme_predictions.append(
-                                {
-                                    "prediction": prediction["prediction"],
-                                    "probability": prediction["probability"],
-                                    "justification": prediction["justification"],
-                                }
-                            )
-                theme.predictions = theme_predictions
-            all_themes.extend(response.themes)
+        for chunk in chunk_prompt_data(
+            prompt_data, max_chunk_predictions, max_chunk_chars
+        ):
+            response = _themes_for_chunk(chunk, model, cache_manager, stream)
+            if response:
+                for theme in response.themes:
+                    theme.cluster_id = cluster_id
+                    theme.cluster_ids = [cluster_id]
+                all_themes.extend(response.themes)
+
+    if merge_threshold is not None:
+        all_themes = reduce_themes(all_themes, model, cache_manager, merge_threshold)
+
+    # create a map of the returned themes to the original data from step 2.
+    # We cannot directly send evaluated_predictions since hdbscan returns a different number of clusters.
+    predictions_by_text = {}
+    for prediction in predictions:
+        predictions_by_text.setdefault(prediction.prediction, []).append(prediction)
+    # a merged theme spans clusters, so each prediction records its own
+    cluster_by_text = {
+        p.prediction: cluster_id
+        for cluster_id, cluster in clustered_predictions.items()
+        for p in cluster
+    }
+    for theme in all_themes:
+        theme_predictions = []
+        for theme_prediction in theme.predictions:
+            for prediction in predictions_by_text.get(theme_prediction, []):
+                # themes are serialized, so they hold plain dicts
+                theme_prediction_data = {
+                    "prediction": prediction.prediction,
+                    "probability": prediction.probability,
+                    "justification": prediction.justification,
+                    "cluster_id": cluster_by_text.get(prediction.prediction),
+                }
+                if prediction.sources:
+                    theme_prediction_data["sources"] = predictions_to_cache(
+                        prediction.sources
+                    )
+                if prediction.answered_by:
+                    theme_prediction_data["answered_by"] = prediction.answered_by
+                theme_predictions.append(theme_prediction_data)
+        theme.predictions = theme_predictions
 
     result = ThemesList(themes=all_themes)
     # Cache the results
-    cache_key = [str(p) for p in predictions] + [
-        str(ep) for ep in evaluated_predictions
-    ]
     cache_manager.save_cache(model.model_name, "themes", cache_key, result.model_dump())
     return result
 
@@ -334,6 +1184,8 @@ def serialize_data(themes: ThemesList, filename, model):
             "theme": theme.theme,
             "summary": theme.summary,
             "predictions": theme.predictions,
+            "cluster_id": theme.cluster_id,
+            "cluster_ids": theme.cluster_ids,
         }
         themes_data.append(theme_data)
 
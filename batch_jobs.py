@@ -0,0 +1,558 @@
+"""Offline batch-job mode for bulk filter/extract/theme runs.
+
+Cache-miss prompts of one pipeline step are written to a JSONL job file (in the
+OpenAI batch input format), submitted through a pluggable batch backend, and
+the results are ingested back into the CacheManager. A normal run_analysis.py
+pass afterwards reuses them; only the theme merge prompts (the reduce step,
+which depends on the map results) are still sent directly. Steps depend on
+each other, so run them in order:
+
+    python batch_jobs.py run --model openai --backend openai --step filter
+    python batch_jobs.py run --model openai --backend openai --step extract
+    python batch_jobs.py run --model openai --backend openai --step theme
+
+``submit`` / ``status`` / ``ingest`` split ``run`` for jobs that take hours.
+"""
+
+import argparse
+import json
+import shutil
+import time
+import uuid
+from abc import ABC, abstractmethod
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Tuple, Type
+import litellm
+from dotenv import load_dotenv
+from pydantic import BaseModel
+from analyse_predictions import (
+    fetch_hacker_news_comments,
+    prepare_comments,
+    make_comment_batches,
+    format_comment_batch,
+    comment_cache_key,
+    comment_sub_batch,
+    single_comment_keys,
+    chunk_prompt_data,
+    cluster_predictions,
+    deduplicate_predictions,
+    attribute_predictions,
+    load_batch_flags,
+    load_batch_predictions,
+)
+from cache_manager import CacheManager
+from fallbacks import parse_response
+from models import BaseAIModel
+from records import CommentRecord, PredictionRecord, predictions_to_cache
+from run_analysis import get_model_by_name
+from prompts import (
+    FILTER_NOISY_COMMENTS_PROMPT,
+    EVALUATE_PREDICTIONS_PROMPT,
+    IDENTIFY_THEMES_PROMPT,
+)
+from schemas import CommentClassification, PredictionEvaluation, ThemesList
+
+STEPS = ["filter", "extract", "theme"]
+SCHEMAS: Dict[str, Type[BaseModel]] = {
+    "filter": CommentClassification,
+    "extract": PredictionEvaluation,
+    "theme": ThemesList,
+}
+PROMPTS = {
+    "filter": FILTER_NOISY_COMMENTS_PROMPT,
+    "extract": EVALUATE_PREDICTIONS_PROMPT,
+}
+CACHE_STEPS = {
+    "filter": "noisy_comments",
+    "extract": "predictions",
+    "theme": "cluster_themes",
+}
+
+
+class BatchBackend(ABC):
+    """A provider batch endpoint: submit a job file, poll, fetch results."""
+
+    @abstractmethod
+    def submit(self, job_path: Path) -> str:
+        """Submit a JSONL job file and return the backend's batch id."""
+        pass
+
+    @abstractmethod
+    def status(self, batch_id: str) -> str:
+        """Return one of "running", "completed" or "failed"."""
+        pass
+
+    @abstractmethod
+    def results(self, batch_id: str) -> Iterator[Tuple[str, Optional[str]]]:
+        """Yield (custom_id, response content or None) for a completed batch."""
+        pass
+
+
+def _parse_output_line(line: str) -> Tuple[str, Optional[str]]:
+    """Extract the custom id and message content of a batch output line."""
+    record = json.loads(line)
+    response = record.get("response") or {}
+    if record.get("error") or response.get("status_code", 200) != 200:
+        return record["custom_id"], None
+    choices = (response.get("body") or {}).get("choices") or []
+    content = choices[0]["message"].get("content") if choices else None
+    return record["custom_id"], content
+
+
+class LocalBatchBackend(BatchBackend):
+    """Filesystem stand-in for a provider batch endpoint.
+
+    Jobs are copied to ``<root>/<batch_id>/input.jsonl`` and are completed once
+    ``output.jsonl`` appears next to them. With a ``model``, pending jobs are
+    processed on the next poll by calling the model for every request, e.g.
+    against stub_server.py; without one, an external process writes the output.
+    """
+
+    def __init__(self, root: str = "batch_jobs/local", model: BaseAIModel = None):
+        self.root = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.model = model
+
+    def submit(self, job_path: Path) -> str:
+        batch_id = f"local-{uuid.uuid4().hex[:12]}"
+        batch_dir = self.root / batch_id
+        batch_dir.mkdir()
+        shutil.copy(job_path, batch_dir / "input.jsonl")
+        return batch_id
+
+    def _process(self, batch_dir: Path):
+        lines = []
+        with open(batch_dir / "input.jsonl", "r") as f:
+            for line in f:
+                request = json.loads(line)
+                prompt = request["body"]["messages"][0]["content"]
+                content = self.model.generate_text(prompt)
+                lines.append(
+                    {
+                        "custom_id": request["custom_id"],
+                        "response": {
+                            "status_code": 200 if content else 500,
+                            "body": {
+                                "choices": [
+                                    {
+                                        "message": {
+                                            "role": "assistant",
+                                            "content": content,
+                                        }
+                                    }
+                                ]
+                            },
+                        },
+                        "error": None,
+                    }
+                )
+        tmp_path = batch_dir / "output.jsonl.tmp"
+        with open(tmp_path, "w") as f:
+            for line in lines:
+                f.write(json.dumps(line) + "\n")
+        tmp_path.rename(batch_dir / "output.jsonl")
+
+    def status(self, batch_id: str) -> str:
+        batch_dir = self.root / batch_id
+        if not (batch_dir / "input.jsonl").exists():
+            return "failed"
+        if not (batch_dir / "output.jsonl").exists() and self.model:
+            self._process(batch_dir)
+        return "completed" if (batch_dir / "output.jsonl").exists() else "running"
+
+    def results(self, batch_id: str) -> Iterator[Tuple[str, Optional[str]]]:
+        with open(self.root / batch_id / "output.jsonl", "r") as f:
+            for line in f:
+                if line.strip():
+                    yield _parse_output_line(line)
+
+
+class OpenAIBatchBackend(BatchBackend):
+    """OpenAI-compatible batch endpoint accessed through litellm."""
+
+    def __init__(self, custom_llm_provider: str = "openai"):
+        self.custom_llm_provider = custom_llm_provider
+
+    def submit(self, job_path: Path) -> str:
+        with open(job_path, "rb") as f:
+            file_obj = litellm.create_file(
+                file=f, purpose="batch", custom_llm_provider=self.custom_llm_provider
+            )
+        batch = litellm.create_batch(
+            completion_window="24h",
+            endpoint="/v1/chat/completions",
+            input_file_id=file_obj.id,
+            custom_llm_provider=self.custom_llm_provider,
+        )
+        return batch.id
+
+    def _retrieve(self, batch_id: str):
+        return litellm.retrieve_batch(
+            batch_id=batch_id, custom_llm_provider=self.custom_llm_provider
+        )
+
+    def status(self, batch_id: str) -> str:
+        batch = self._retrieve(batch_id)
+        if batch.status == "completed":
+            return "completed"
+        if batch.status in ("failed", "expired", "cancelled", "cancelling"):
+            return "failed"
+        return "running"
+
+    def results(self, batch_id: str) -> Iterator[Tuple[str, Optional[str]]]:
+        batch = self._retrieve(batch_id)
+        if not batch.output_file_id:
+            return
+        content = litellm.file_content(
+            file_id=batch.output_file_id,
+            custom_llm_provider=self.custom_llm_provider,
+        )
+        for line in content.text.splitlines():
+            if line.strip():
+                yield _parse_output_line(line)
+
+
+def _cached_filtered_comments(
+    model: BaseAIModel,
+    comment_objs: List[CommentRecord],
+    cache_manager: CacheManager,
+    batch_size: int,
+    batching: str,
+) -> Optional[List[CommentRecord]]:
+    """Replay the filter step from cache; None if any batch misses."""
+    filtered = []
+    for batch, context in make_comment_batches(comment_objs, batch_size, batching):
+        flags = load_batch_flags(batch, context, model, cache_manager)
+        if flags is None:
+            return None
+        filtered.extend(c for c, noisy in zip(batch, flags) if not noisy)
+    return filtered
+
+
+def _cached_predictions(
+    model: BaseAIModel,
+    comment_objs: List[CommentRecord],
+    cache_manager: CacheManager,
+    batch_size: int,
+    batching: str,
+) -> Optional[List[PredictionRecord]]:
+    """Replay the filter and extract steps from cache; None if anything misses."""
+    filtered = _cached_filtered_comments(
+        model, comment_objs, cache_manager, batch_size, batching
+    )
+    if filtered is None:
+        return None
+
+    predictions = []
+    for batch, context in make_comment_batches(
+        filtered, batch_size, batching, lookup=comment_objs
+    ):
+        cached = load_batch_predictions(batch, context, model, cache_manager)
+        if cached is None:
+            return None
+        predictions.extend(cached)
+    return predictions
+
+
+def _comment_request(step: str, batch, context):
+    """(cache input, prompt, comments) of one comment batch."""
+    context_section, comment_lines = format_comment_batch(batch, context)
+    prompt = PROMPTS[step].format(context=context_section, comments=comment_lines)
+    return comment_cache_key(batch, context), prompt, batch
+
+
+def pending_requests(
+    step: str,
+    model: BaseAIModel,
+    comments: List[Dict],
+    cache_manager: CacheManager,
+    batch_size: int = 5,
+    batching: str = "page",
+) -> List[Tuple[object, str, Optional[List[CommentRecord]]]]:
+    """Return (cache input, prompt, comments) for every cache miss of a
+    pipeline step, batched exactly like run_analysis_for_model so the cache
+    keys match. `comments` is None for theme requests."""
+    comment_objs = prepare_comments(comments)
+    requests = []
+
+    if step == "filter":
+        for batch, context in make_comment_batches(comment_objs, batch_size, batching):
+            if load_batch_flags(batch, context, model, cache_manager) is not None:
+                continue
+            # comments with per-comment flags are left out, as is_comment_noisy
+            # would leave them out
+            missing = [
+                i
+                for i, key in enumerate(single_comment_keys(batch, context))
+                if len(batch) > 1
+                and not cache_manager.load_cache(
+                    model.cache_names, "noisy_comments", key
+                )
+            ]
+            if 0 < len(missing) < len(batch):
+                batch, context = comment_sub_batch(batch, context, missing)
+            requests.append(_comment_request(step, batch, context))
+
+    elif step == "extract":
+        filtered = _cached_filtered_comments(
+            model, comment_objs, cache_manager, batch_size, batching
+        )
+        if filtered is None:
+            raise RuntimeError("The filter step is not complete; run it before extract")
+        for batch, context in make_comment_batches(
+            filtered, batch_size, batching, lookup=comment_objs
+        ):
+            if load_batch_predictions(batch, context, model, cache_manager) is None:
+                requests.append(_comment_request(step, batch, context))
+
+    elif step == "theme":
+        predictions = _cached_predictions(
+            model, comment_objs, cache_manager, batch_size, batching
+        )
+        if predictions is None:
+            raise RuntimeError(
+                "The filter and extract steps are not complete; run them before theme"
+            )
+        # same collapsing as identify_themes, so the cluster keys match
+        predictions, embeddings = deduplicate_predictions(predictions)
+        clusters = cluster_predictions(predictions, embeddings=embeddings)
+        for predictions_in_cluster in clusters.values():
+            # map chunks only: the reduce step's merge prompts depend on the
+            # map results, so identify_themes still sends those directly
+            for prompt_data in chunk_prompt_data(
+                [p.prediction for p in predictions_in_cluster]
+            ):
+                if cache_manager.load_cache(
+                    model.cache_names, "cluster_themes", prompt_data
+                ):
+                    continue
+                prompt = IDENTIFY_THEMES_PROMPT.format(
+                    predictions_and_evaluations="\n".join(prompt_data)
+                )
+                requests.append((prompt_data, prompt, None))
+
+    else:
+        raise ValueError(f"Unknown step: {step}. Available steps: {', '.join(STEPS)}")
+
+    return requests
+
+
+def write_job(
+    step: str,
+    model_name: str,
+    requests: List[Tuple[object, str, Optional[List[CommentRecord]]]],
+    job_dir: str = "batch_jobs",
+) -> Path:
+    """Write a JSONL job file plus a manifest mapping custom ids to cache inputs.
+
+    Returns:
+        The path of the manifest, which tracks the job through submit/ingest.
+    """
+    job_dir = Path(job_dir)
+    job_dir.mkdir(parents=True, exist_ok=True)
+    safe_model_name = model_name.replace("/", "_").replace("-", "_")
+    job_name = f"{safe_model_name}_{step}_{time.strftime('%Y%m%d_%H%M%S')}"
+    job_path = job_dir / f"{job_name}.jsonl"
+    # provider batch endpoints expect the bare model name
+    body_model = model_name.split("/", 1)[1] if "/" in model_name else model_name
+
+    entries = {}
+    with open(job_path, "w") as f:
+        for index, (cache_input, prompt, batch) in enumerate(requests):
+            custom_id = f"{step}-{index}"
+            # comment batches are keyed by CommentRecords; store them as dicts,
+            # which hash the same when the manifest is ingested
+            entries[custom_id] = {
+                "cache_input": [
+                    item.to_dict() if isinstance(item, CommentRecord) else item
+                    for item in cache_input
+                ],
+                # the batch's comments: the answer's length and attribution
+                # go by them, not by the cache input
+                "comments": (
+                    None if batch is None else [comment.to_dict() for comment in batch]
+                ),
+            }
+            f.write(
+                json.dumps(
+                    {
+                        "custom_id": custom_id,
+                        "method": "POST",
+                        "url": "/v1/chat/completions",
+                        "body": {
+                            "model": body_model,
+                            "messages": [{"role": "user", "content": prompt}],
+                            "response_format": {"type": "json_object"},
+                        },
+                    }
+                )
+                + "\n"
+            )
+
+    manifest_path = job_dir / f"{job_name}.manifest.json"
+    with open(manifest_path, "w") as f:
+        json.dump(
+            {
+                "step": step,
+                "model_name": model_name,
+                "job_file": str(job_path),
+                "batch_id": None,
+                "entries": entries,
+            },
+            f,
+            indent=2,
+        )
+    return manifest_path
+
+
+def _load_manifest(manifest_path: Path) -> Dict:
+    with open(manifest_path, "r") as f:
+        return json.load(f)
+
+
+def submit_job(manifest_path: Path, backend: BatchBackend) -> str:
+    """Submit the job file of a manifest and record the batch id in it."""
+    manifest = _load_manifest(manifest_path)
+    manifest["batch_id"] = backend.submit(Path(manifest["job_file"]))
+    with open(manifest_path, "w") as f:
+        json.dump(manifest, f, indent=2)
+    return manifest["batch_id"]
+
+
+def ingest_results(
+    manifest_path: Path, backend: BatchBackend, cache_manager: CacheManager
+) -> Tuple[int, int]:
+    """Parse the results of a completed job into the cache.
+
+    Returns:
+        The number of ingested and failed requests.
+    """
+    manifest = _load_manifest(manifest_path)
+    step = manifest["step"]
+    schema = SCHEMAS[step]
+    ingested, failed = 0, 0
+    for custom_id, content in backend.results(manifest["batch_id"]):
+        entry = manifest["entries"].get(custom_id)
+        response = parse_response(content, schema) if content else None
+        if entry is None or response is None:
+            failed += 1
+            continue
+        cache_input = entry["cache_input"]
+        comments = [CommentRecord.from_raw(c) for c in entry["comments"] or []]
+        if step == "filter":
+            result = response.is_noisy[: len(comments)]
+            result += [False] * (len(comments) - len(result))
+        elif step == "extract":
+            result = predictions_to_cache(
+                attribute_predictions(
+                    [PredictionRecord.from_model(p) for p in response.predictions],
+                    comments,
+                )
+            )
+        else:
+            if not response.themes:
+                failed += 1
+                continue
+            result = response.model_dump()
+        cache_manager.save_cache(
+            manifest["model_name"], CACHE_STEPS[step], cache_input, result
+        )
+        ingested += 1
+    return ingested, failed
+
+
+def wait_for_job(
+    batch_id: str, backend: BatchBackend, poll_interval: float = 60
+) -> str:
+    """Poll the backend until the batch is no longer running."""
+    status = backend.status(batch_id)
+    while status == "running":
+        print(f"Batch {batch_id} still running, polling again in {poll_interval}s")
+        time.sleep(poll_interval)
+        status = backend.status(batch_id)
+    return status
+
+
+def get_backend(name: str, model: BaseAIModel = None) -> BatchBackend:
+    """Get a batch backend by name."""
+    backends = {
+        "local": lambda: LocalBatchBackend(model=model),
+        "openai": lambda: OpenAIBatchBackend(),
+    }
+    if name not in backends:
+        raise ValueError(
+            f"Unknown backend: {name}. Available backends: {', '.join(backends.keys())}"
+        )
+    return backends[name]()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Batch-job mode for bulk analysis")
+    parser.add_argument("command", choices=["run", "submit", "status", "ingest"])
+    parser.add_argument(
+        "manifest", nargs="?", help="Job manifest (for status and ingest)"
+    )
+    parser.add_argument("--step", type=str, choices=STEPS, default="filter")
+    parser.add_argument(
+        "--model",
+        type=str,
+        default="gemini",
+        choices=["gemini", "openai", "anthropic", "ollama", "groq", "local"],
+    )
+    parser.add_argument("--api-base", type=str, default=None)
+    parser.add_argument(
+        "--backend", type=str, choices=["local", "openai"], default="local"
+    )
+    parser.add_argument("--thread-id", type=str, default="42490343")
+    parser.add_argument("--batch-size", type=int, default=5)
+    parser.add_argument(
+        "--batching", type=str, choices=["page", "thread"], default="page"
+    )
+    parser.add_argument("--poll-interval", type=float, default=60)
+    args = parser.parse_args()
+
+    model = get_model_by_name(args.model, api_base=args.api_base)
+    backend = get_backend(args.backend, model)
+    cache_manager = CacheManager()
+
+    if args.command in ("run", "submit"):
+        print("Fetching comments from Hacker News...")
+        comments = fetch_hacker_news_comments(args.thread_id)
+        requests = pending_requests(
+            args.step,
+            model,
+            comments,
+            cache_manager,
+            args.batch_size,
+            args.batching,
+        )
+        if not requests:
+            print(f"Nothing to do, the {args.step} step is fully cached")
+            return
+        manifest_path = write_job(args.step, model.model_name, requests)
+        batch_id = submit_job(manifest_path, backend)
+        print(f"Submitted {len(requests)} requests as batch {batch_id}")
+        print(f"Manifest: {manifest_path}")
+        if args.command == "submit":
+            return
+    else:
+        if not args.manifest:
+            parser.error(f"{args.command} needs a job manifest")
+        manifest_path = Path(args.manifest)
+        batch_id = _load_manifest(manifest_path)["batch_id"]
+
+    if args.command == "status":
+        print(f"Batch {batch_id}: {backend.status(batch_id)}")
+        return
+
+    status = wait_for_job(batch_id, backend, args.poll_interval)
+    if status != "completed":
+        print(f"Batch {batch_id} {status}")
+        return
+    ingested, failed = ingest_results(manifest_path, backend, cache_manager)
+    print(f"Ingested {ingested} results into the cache ({failed} failed)")
+
+
+if __name__ == "__main__":
+    load_dotenv()
+    main()
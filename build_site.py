@@ -0,0 +1,185 @@
+"""Build step turning serialized predictions into lazily loaded viewer data.
+
+Reads every ``outputs/predictions_data_*.json`` written by serialize_data and
+emits ``outputs/site/manifest.json`` (models, theme names, counts, probability
+histograms) plus one compact shard per theme that the viewer fetches when the
+theme is opened. First paint only needs the manifest. A search index
+segment per model (see search_index.py) is written next to the shards.
+
+Models whose output file is unchanged since the last build are reused from the
+existing manifest, so adding a model only indexes that model.
+"""
+
+import argparse
+import hashlib
+import json
+import shutil
+from pathlib import Path
+from typing import Dict, List
+
+from prompts import OTHER_SUMMARY, OTHER_THEME
+from search_index import remove_stale_segments, update_search_index
+
+HISTOGRAM_BINS = 10
+
+
+def probability_category(probability: float) -> str:
+    """Bucket a probability the way the viewer labels it."""
+    if probability >= 0.7:
+        return "likely"
+    if probability >= 0.3:
+        return "maybe"
+    return "unlikely"
+
+
+def probability_stats(predictions: List[Dict]) -> Dict:
+    """Count likely/maybe/unlikely predictions and build a histogram."""
+    stats = {"count": len(predictions), "likely": 0, "maybe": 0, "unlikely": 0}
+    histogram = [0] * HISTOGRAM_BINS
+    for prediction in predictions:
+        probability = float(prediction["probability"])
+        stats[probability_category(probability)] += 1
+        histogram[min(int(probability * HISTOGRAM_BINS), HISTOGRAM_BINS - 1)] += 1
+    stats["histogram"] = histogram
+    return stats
+
+
+def merge_themes(themes: List[Dict]) -> List[Dict]:
+    """Combine all "Other" themes into one and sort the rest by size."""
+    other_predictions = [
+        p
+        for theme in themes
+        if theme["theme"] == OTHER_THEME
+        for p in theme["predictions"]
+    ]
+    merged = sorted(
+        (theme for theme in themes if theme["theme"] != OTHER_THEME),
+        key=lambda theme: len(theme["predictions"]),
+        reverse=True,
+    )
+    if other_predictions:
+        merged.append(
+            {
+                "theme": OTHER_THEME,
+                "summary": OTHER_SUMMARY,
+                "predictions": other_predictions,
+            }
+        )
+    return merged
+
+
+def model_id_from_file(path: Path) -> str:
+    """Derive the model id from an output file name."""
+    return path.stem[len("predictions_data_") :]
+
+
+def build_model(data: Dict, model_id: str, site_dir: Path, source_hash: str) -> Dict:
+    """Write the theme shards of one model and return its manifest entry."""
+    model_dir = site_dir / model_id
+    if model_dir.exists():
+        shutil.rmtree(model_dir)
+    model_dir.mkdir(parents=True)
+
+    themes = merge_themes(data["themes"])
+    theme_entries = []
+    search_rows = []
+    for index, theme in enumerate(themes):
+        shard_path = f"{model_id}/{index}.json"
+        shard = {
+            "theme": theme["theme"],
+            "summary": theme["summary"],
+            # [prediction, probability, justification] rows keep shards small
+            "predictions": [
+                [p["prediction"], p["probability"], p["justification"]]
+                for p in theme["predictions"]
+            ],
+        }
+        with open(site_dir / shard_path, "w") as f:
+            json.dump(shard, f, separators=(",", ":"))
+        search_rows.extend(
+            (
+                index,
+                row,
+                theme["theme"],
+                p["prediction"],
+                probability_category(float(p["probability"])),
+            )
+            for row, p in enumerate(theme["predictions"])
+        )
+        theme_entries.append(
+            {
+                "theme": theme["theme"],
+                "shard": shard_path,
+                **probability_stats(theme["predictions"]),
+            }
+        )
+
+    all_predictions = [p for theme in themes for p in theme["predictions"]]
+    return {
+        "id": model_id,
+        "model": data["model"],
+        "source_hash": source_hash,
+        "search": update_search_index(site_dir, model_id, search_rows),
+        "theme_count": sum(1 for t in themes if t["theme"] != OTHER_THEME),
+        **probability_stats(all_predictions),
+        "themes": theme_entries,
+    }
+
+
+def build_site(outputs_dir: str = "outputs", site_dir: str = None) -> Path:
+    """Build the manifest and theme shards for every serialized model output.
+
+    Returns:
+        The path of the written manifest.
+    """
+    outputs_dir = Path(outputs_dir)
+    site_dir = Path(site_dir) if site_dir else outputs_dir / "site"
+    site_dir.mkdir(parents=True, exist_ok=True)
+
+    manifest_path = site_dir / "manifest.json"
+    previous = {}
+    if manifest_path.exists():
+        with open(manifest_path, "r") as f:
+            previous = {m["id"]: m for m in json.load(f).get("models", [])}
+
+    models = []
+    for path in sorted(outputs_dir.glob("predictions_data_*.json")):
+        model_id = model_id_from_file(path)
+        raw = path.read_bytes()
+        source_hash = hashlib.md5(raw).hexdigest()
+        entry = previous.get(model_id)
+        if (
+            entry
+            and entry.get("source_hash") == source_hash
+            and (site_dir / entry.get("search", "")).is_file()
+            and (site_dir / model_id).is_dir()
+        ):
+            models.append(entry)
+            continue
+        print(f"Building viewer data for {model_id}")
+        models.append(build_model(json.loads(raw), model_id, site_dir, source_hash))
+
+    model_ids = {model["id"] for model in models}
+    for model_id in previous.keys() - model_ids:
+        shutil.rmtree(site_dir / model_id, ignore_errors=True)
+    remove_stale_segments(site_dir, model_ids)
+
+    with open(manifest_path, "w") as f:
+        json.dump({"models": models}, f, separators=(",", ":"))
+    return manifest_path
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Build the manifest and theme shards for the web viewer"
+    )
+    parser.add_argument("--outputs-dir", type=str, default="outputs")
+    parser.add_argument("--site-dir", type=str, default=None)
+    args = parser.parse_args()
+
+    manifest_path = build_site(args.outputs_dir, args.site_dir)
+    print(f"Wrote {manifest_path}")
+
+
+if __name__ == "__main__":
+    main()
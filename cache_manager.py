@@ -1,8 +1,32 @@
 import json
 import os
 import hashlib
+import tempfile
+from contextlib import contextmanager
 from pathlib import Path
-from typing import List, Dict, Union
+from typing import List, Dict, Optional, Tuple, Union
+from records import CommentRecord
+
+try:
+    import fcntl
+except ImportError:  # Windows: single-process use only
+    fcntl = None
+
+
+@contextmanager
+def file_lock(path: Union[str, Path]):
+    """Hold an exclusive lock on `path` (created if missing) across processes,
+    e.g. workers sharing a cache directory."""
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, "a") as f:
+        if fcntl:
+            fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl:
+                fcntl.flock(f, fcntl.LOCK_UN)
 
 
 class CacheManager:
@@ -16,6 +40,9 @@ class CacheManager:
             if all(isinstance(item, dict) for item in data):
                 # For lists of dicts (comments), hash their text content
                 data_str = "".join(str(item.get("text", "")) for item in data)
+            elif all(isinstance(item, CommentRecord) for item in data):
+                # Comment records hash like the comment dicts they replaced
+                data_str = "".join(item.text for item in data)
             else:
                 data_str = "".join(str(item) for item in data)
         else:
@@ -28,18 +55,37 @@ class CacheManager:
         return self.cache_dir / f"{safe_model_name}_{step}_{data_hash}.json"
 
     def load_cache(
-        self, model_name: str, step: str, input_data: Union[List[Dict], List[str]]
+        self,
+        model_name: Union[str, List[str]],
+        step: str,
+        input_data: Union[List[Dict], List[str]],
     ) -> dict:
-        """Load cached data for a specific model, step, and input data."""
+        """Load cached data for a specific model, step, and input data.
+
+        `model_name` may list several models (e.g. a failover chain, see
+        BaseAIModel.cache_names); the first model with an entry wins.
+        """
+        return self.find_cache(model_name, step, input_data)[1]
+
+    def find_cache(
+        self,
+        model_name: Union[str, List[str]],
+        step: str,
+        input_data: Union[List[Dict], List[str]],
+    ) -> Tuple[Optional[str], Optional[dict]]:
+        """Like load_cache, but also return the model whose entry was found
+        ((None, None) on a miss)."""
         data_hash = self.compute_data_hash(input_data)
-        cache_path = self.get_cache_path(model_name, step, data_hash)
-        if cache_path.exists():
-            try:
-                with open(cache_path, "r") as f:
-                    return json.load(f)
-            except json.JSONDecodeError:
-                print(f"Warning: Cache file {cache_path} is corrupted")
-        return None
+        model_names = [model_name] if isinstance(model_name, str) else model_name
+        for name in model_names:
+            cache_path = self.get_cache_path(name, step, data_hash)
+            if cache_path.exists():
+                try:
+                    with open(cache_path, "r") as f:
+                        return name, json.load(f)
+                except json.JSONDecodeError:
+                    print(f"Warning: Cache file {cache_path} is corrupted")
+        return None, None
 
     def save_cache(
         self,
@@ -51,15 +97,24 @@ class CacheManager:
         """Save data to cache for a specific model, step, and input data."""
         data_hash = self.compute_data_hash(input_data)
         cache_path = self.get_cache_path(model_name, step, data_hash)
-        with open(cache_path, "w") as f:
+        # write then rename, so processes sharing the cache never read a
+        # half-written entry
+        with tempfile.NamedTemporaryFile(
+            "w", dir=self.cache_dir, suffix=".tmp", delete=False
+        ) as f:
             json.dump(result_data, f, indent=2)
+        os.replace(f.name, cache_path)
 
     def clear_cache(self, model_name: str = None):
         """Clear cache for a specific model or all models."""
         if model_name:
             safe_model_name = model_name.replace("/", "_").replace("-", "_")
-            for cache_file in self.cache_dir.glob(f"{safe_model_name}_*.json"):
-                cache_file.unlink()
+            for extension in ("json", "npz"):
+                for cache_file in self.cache_dir.glob(
+                    f"{safe_model_name}_*.{extension}"
+                ):
+                    cache_file.unlink()
         else:
-            for cache_file in self.cache_dir.glob("*.json"):
-                cache_file.unlink()
+            for extension in ("json", "npz"):
+                for cache_file in self.cache_dir.glob(f"*.{extension}"):
+                    cache_file.unlink()
@@ -0,0 +1,194 @@
+"""Cross-model consensus over the serialized predictions of every model.
+
+All models' predictions are embedded once and aligned with vectorized
+similarity search (see vector_ops.py): two predictions of different models are
+linked when each is the other's most similar prediction in that model and
+their similarity clears the threshold. Linked predictions form agreement
+groups that report each model's probability, the spread between models and
+the models that disagree with the rest.
+
+    python consensus.py --threshold 0.75
+"""
+
+import argparse
+import json
+from pathlib import Path
+from typing import Dict, List
+
+import numpy as np
+from build_site import model_id_from_file
+from embeddings import configure_encoder, embed_texts
+from vector_ops import best_matches, component_labels, group_members, normalize_rows
+
+
+def load_model_predictions(outputs_dir: str = "outputs") -> Dict[str, List[Dict]]:
+    """Load the unique predictions of every predictions_data_*.json file."""
+    model_predictions = {}
+    for path in sorted(Path(outputs_dir).glob("predictions_data_*.json")):
+        with open(path, "r") as f:
+            data = json.load(f)
+        unique = {}
+        for theme in data["themes"]:
+            for prediction in theme["predictions"]:
+                unique.setdefault(prediction["prediction"], prediction)
+        model_predictions[model_id_from_file(path)] = list(unique.values())
+    return model_predictions
+
+
+def align_predictions(
+    embeddings: np.ndarray, model_index: np.ndarray, threshold: float = 0.75
+) -> np.ndarray:
+    """Label predictions so that aligned predictions share a label.
+
+    Args:
+        embeddings: Normalized (or compact stored) embeddings of all models'
+            predictions
+        model_index: Model number of every row
+        threshold: Minimum cosine similarity of an alignment
+    """
+    best_index, best_sim = best_matches(
+        embeddings, embeddings, model_index, exclude_groups=model_index
+    )
+    rows, other_models = np.nonzero(best_sim >= threshold)
+    cols = best_index[rows, other_models]
+    # keep mutual best matches only, so chains of loose matches don't merge
+    mutual = best_index[cols, model_index[rows]] == rows
+    return component_labels(len(embeddings), rows[mutual], cols[mutual])
+
+
+def find_outliers(per_model: Dict[str, Dict], outlier_threshold: float) -> List[str]:
+    """Models whose probability is far from the median of the other models."""
+    if len(per_model) < 3:
+        return []
+    outliers = []
+    for name, value in per_model.items():
+        others = [v["probability"] for n, v in per_model.items() if n != name]
+        if abs(value["probability"] - np.median(others)) >= outlier_threshold:
+            outliers.append(name)
+    return outliers
+
+
+def build_consensus(
+    model_predictions: Dict[str, List[Dict]],
+    embeddings: np.ndarray,
+    threshold: float = 0.75,
+    outlier_threshold: float = 0.3,
+) -> Dict:
+    """Group aligned predictions and summarize the models' agreement.
+
+    A model is an outlier in a group when its probability differs from the
+    median of the other models by at least ``outlier_threshold``.
+    """
+    models = list(model_predictions)
+    predictions = [p for m in models for p in model_predictions[m]]
+    model_index = np.repeat(
+        np.arange(len(models)), [len(model_predictions[m]) for m in models]
+    )
+    probabilities = np.array([float(p["probability"]) for p in predictions])
+    labels = align_predictions(embeddings, model_index, threshold)
+
+    groups = []
+    grouped = 0
+    for members in group_members(labels):
+        if len(members) < 2:
+            continue
+        grouped += len(members)
+        per_model = {}
+        for m in np.unique(model_index[members]):
+            own = members[model_index[members] == m]
+            per_model[models[m]] = {
+                "probability": round(float(probabilities[own].mean()), 3),
+                "predictions": [predictions[i]["prediction"] for i in own],
+            }
+        model_probabilities = np.array([v["probability"] for v in per_model.values()])
+        # the member closest to the group centroid names the group
+        vectors = normalize_rows(embeddings[members])
+        centroid = vectors.mean(axis=0)
+        representative = members[int(np.argmax(vectors @ centroid))]
+        groups.append(
+            {
+                "prediction": predictions[representative]["prediction"],
+                "model_count": len(per_model),
+                "mean_probability": round(float(model_probabilities.mean()), 3),
+                "spread": round(float(np.ptp(model_probabilities)), 3),
+                "models": per_model,
+                "outliers": find_outliers(per_model, outlier_threshold),
+            }
+        )
+
+    groups.sort(key=lambda g: (-g["model_count"], -g["spread"]))
+    return {
+        "models": models,
+        "threshold": threshold,
+        "predictions": len(predictions),
+        "grouped_predictions": grouped,
+        "groups": groups,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Align predictions across models and report their agreement"
+    )
+    parser.add_argument("--outputs-dir", type=str, default="outputs")
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=0.75,
+        help="Minimum cosine similarity for two predictions to be aligned",
+    )
+    parser.add_argument(
+        "--outlier-threshold",
+        type=float,
+        default=0.3,
+        help="Probability gap to the other models that marks an outlier",
+    )
+    parser.add_argument("--output", type=str, default="outputs/consensus.json")
+    parser.add_argument(
+        "--embedding-backend", type=str, default="torch", choices=["torch", "onnx"]
+    )
+    parser.add_argument(
+        "--embedding-processes",
+        type=int,
+        default=1,
+        help="CPU worker processes for encoding",
+    )
+    parser.add_argument(
+        "--embedding-store-dtype",
+        type=str,
+        default="float16",
+        choices=["float32", "float16", "int8"],
+    )
+    args = parser.parse_args()
+
+    configure_encoder(
+        backend=args.embedding_backend,
+        processes=args.embedding_processes,
+        store_dir="cache/embeddings",
+        store_dtype=args.embedding_store_dtype,
+    )
+
+    model_predictions = load_model_predictions(args.outputs_dir)
+    texts = [p["prediction"] for m in model_predictions.values() for p in m]
+    print(f"Embedding {len(texts)} predictions from {len(model_predictions)} models")
+    embeddings = embed_texts(texts, compact=True)
+
+    consensus = build_consensus(
+        model_predictions, embeddings, args.threshold, args.outlier_threshold
+    )
+    with open(args.output, "w") as f:
+        json.dump(consensus, f, indent=4)
+
+    groups = consensus["groups"]
+    everyone = sum(1 for g in groups if g["model_count"] == len(consensus["models"]))
+    print(f"Found {len(groups)} agreement groups, {everyone} shared by all models")
+    for group in [g for g in groups if g["outliers"]][:10]:
+        print(
+            f"  spread {group['spread']:.2f} outliers {', '.join(group['outliers'])}:"
+            f" {group['prediction']}"
+        )
+    print(f"Wrote {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,278 @@
+"""Embedding backend shared by deduplication, clustering, theming and consensus.
+
+EmbeddingEncoder wraps the sentence-transformers MiniLM model with:
+
+- a CPU process pool (``processes > 1``) that shards large encode calls across
+  workers, each running the tuned ``batch_size``
+- an optional ONNX backend with the int8 quantized MiniLM export
+  (``backend="onnx"``, needs ``pip install "optimum[onnxruntime]"``)
+- an EmbeddingStore that keeps vectors on disk as float16 or int8 rows in a
+  memory-mapped file, so each text is encoded once and the stored vectors
+  take a half or a quarter of the float32 memory
+
+The model is only loaded when a text is missing from the store, and
+``encode(texts, compact=True)`` hands back the stored rows themselves (a view
+of the memmap when they are contiguous) for the vector_ops searches, which
+normalize such rows block by block.
+"""
+
+import atexit
+import hashlib
+import json
+import os
+from pathlib import Path
+from typing import List, Optional
+
+import numpy as np
+from sentence_transformers import SentenceTransformer
+
+from cache_manager import file_lock
+from vector_ops import normalize_rows
+
+DEFAULT_MODEL = "all-MiniLM-L6-v2"
+# int8 export that runs on any AVX2 CPU; other exports live next to it
+ONNX_QUANTIZED_FILE = "onnx/model_quint8_avx2.onnx"
+STORE_DTYPES = ("float32", "float16", "int8")
+INT8_SCALE = 127.0
+
+
+def _text_key(text: str) -> str:
+    return hashlib.md5(text.encode()).hexdigest()
+
+
+class EmbeddingStore:
+    """Append-only on-disk embedding table keyed by text hash.
+
+    Rows live in ``<name>.<dtype>.bin`` and are memory-mapped on read; the
+    text hashes of the rows are appended to ``<name>.<dtype>.keys``. Vectors
+    are unit length, so int8 rows use a fixed scale of 127.
+
+    Several processes can share a store: appends hold a file lock and take
+    their row numbers from the file length, reloading the keys other
+    processes added in the meantime.
+    """
+
+    def __init__(self, directory, name: str, dim: int, dtype: str = "float16"):
+        if dtype not in STORE_DTYPES:
+            raise ValueError(f"Unknown store dtype: {dtype}. Use one of {STORE_DTYPES}")
+        directory = Path(directory)
+        directory.mkdir(parents=True, exist_ok=True)
+        self.dim = dim
+        self.dtype = np.dtype(dtype)
+        self.data_path = directory / f"{name}.{dtype}.bin"
+        self.keys_path = directory / f"{name}.{dtype}.keys"
+        self.meta_path = directory / f"{name}.{dtype}.json"
+        self.lock_path = directory / f"{name}.{dtype}.lock"
+        self.row_bytes = dim * self.dtype.itemsize
+        self.rows = {}
+        self._load()
+        if self.stored_dim(directory, name, dtype) != dim:
+            with open(self.meta_path, "w") as f:
+                json.dump({"dim": dim, "dtype": dtype, "int8_scale": INT8_SCALE}, f)
+
+    @staticmethod
+    def stored_dim(directory, name: str, dtype: str) -> Optional[int]:
+        """Vector size recorded by an existing store, None if there is none."""
+        meta_path = Path(directory) / f"{name}.{dtype}.json"
+        if not meta_path.exists():
+            return None
+        with open(meta_path, "r") as f:
+            return json.load(f)["dim"]
+
+    def _data_bytes(self) -> int:
+        return self.data_path.stat().st_size if self.data_path.exists() else 0
+
+    def _load(self, repair: bool = False):
+        """Read the keys of all fully written rows. With `repair` (and the
+        lock held), also cut off a row or key that a crashed append left
+        without its counterpart, so the next append lines up again."""
+        keys = []
+        if self.keys_path.exists():
+            with open(self.keys_path, "r") as f:
+                keys = f.read().split()
+        count = min(len(keys), self._data_bytes() // self.row_bytes)
+        self.rows = {key: i for i, key in enumerate(keys[:count])}
+        if repair:
+            if self._data_bytes() > count * self.row_bytes:
+                os.truncate(self.data_path, count * self.row_bytes)
+            if len(keys) > count:
+                with open(self.keys_path, "w") as f:
+                    f.write("".join(f"{key}\n" for key in keys[:count]))
+
+    def __len__(self) -> int:
+        return len(self.rows)
+
+    def _matrix(self) -> np.ndarray:
+        return np.memmap(
+            self.data_path, dtype=self.dtype, mode="r", shape=(len(self), self.dim)
+        )
+
+    def lookup(self, texts: List[str]) -> np.ndarray:
+        """Return the row of every text, -1 where it is not stored."""
+        return np.array(
+            [self.rows.get(_text_key(text), -1) for text in texts], dtype=np.int64
+        )
+
+    def take(self, rows: np.ndarray) -> np.ndarray:
+        """Return the given rows in the store dtype (int8 rows keep the
+        INT8_SCALE). A run of consecutive rows is a view of the memmap,
+        anything else is gathered in one copy."""
+        matrix = self._matrix()
+        if len(rows) and np.array_equal(rows, np.arange(rows[0], rows[0] + len(rows))):
+            return matrix[rows[0] : rows[0] + len(rows)]
+        return matrix[rows]
+
+    def add(self, texts: List[str], vectors: np.ndarray):
+        """Append the vectors of texts that are not stored yet."""
+        with file_lock(self.lock_path):
+            # other processes may have appended since the keys were read
+            if self._data_bytes() != len(self.rows) * self.row_bytes:
+                self._load(repair=True)
+            new = {}
+            for text, vector in zip(texts, vectors):
+                key = _text_key(text)
+                if key not in self.rows and key not in new:
+                    new[key] = vector
+            if not new:
+                return
+            rows = np.stack(list(new.values()))
+            if self.dtype == np.int8:
+                rows = np.clip(np.round(rows * INT8_SCALE), -127, 127)
+            with open(self.data_path, "ab") as f:
+                f.write(rows.astype(self.dtype).tobytes())
+            with open(self.keys_path, "a") as f:
+                f.write("".join(f"{key}\n" for key in new))
+            for key in new:
+                self.rows[key] = len(self.rows)
+
+
+class EmbeddingEncoder:
+    """Encode texts into L2-normalized float32 rows.
+
+    Args:
+        model_name: sentence-transformers model
+        backend: "torch" or "onnx" (the int8 quantized ONNX export)
+        onnx_file: ONNX export used by the onnx backend
+        processes: Worker processes for large encode calls (1 disables the pool)
+        batch_size: Texts per forward pass
+        store_dir: Directory of the EmbeddingStore (None disables it)
+        store_dtype: "float32", "float16" or "int8" storage of stored vectors
+        min_pool_texts: Below this many texts the pool is not worth its overhead
+    """
+
+    def __init__(
+        self,
+        model_name: str = DEFAULT_MODEL,
+        backend: str = "torch",
+        onnx_file: str = ONNX_QUANTIZED_FILE,
+        processes: int = 1,
+        batch_size: int = 128,
+        store_dir: Optional[str] = None,
+        store_dtype: str = "float16",
+        min_pool_texts: int = 2000,
+    ):
+        self.model_name = model_name
+        self.backend = backend
+        self.onnx_file = onnx_file
+        self.processes = processes
+        self.batch_size = batch_size
+        self.min_pool_texts = min_pool_texts
+        self.store_dir = store_dir
+        self.store_dtype = store_dtype
+        self._model = None
+        self._pool = None
+        self._store = None
+
+    @property
+    def model(self) -> SentenceTransformer:
+        if self._model is None:
+            if self.backend == "onnx":
+                try:
+                    self._model = SentenceTransformer(
+                        self.model_name,
+                        device="cpu",
+                        backend="onnx",
+                        model_kwargs={"file_name": self.onnx_file},
+                    )
+                except ImportError as e:
+                    raise ImportError(
+                        'The onnx backend needs: pip install "optimum[onnxruntime]"'
+                    ) from e
+            else:
+                self._model = SentenceTransformer(self.model_name)
+        return self._model
+
+    @property
+    def store(self) -> Optional[EmbeddingStore]:
+        if self._store is None and self.store_dir:
+            name = f"{self.model_name.replace('/', '_')}_{self.backend}"
+            # an existing store knows its vector size, so reads need no model
+            dim = EmbeddingStore.stored_dim(self.store_dir, name, self.store_dtype)
+            if dim is None:
+                dim = self.model.get_sentence_embedding_dimension()
+            self._store = EmbeddingStore(self.store_dir, name, dim, self.store_dtype)
+        return self._store
+
+    def _encode(self, texts: List[str]) -> np.ndarray:
+        if self.processes > 1 and len(texts) >= self.min_pool_texts:
+            if self._pool is None:
+                self._pool = self.model.start_multi_process_pool(
+                    target_devices=["cpu"] * self.processes
+                )
+                atexit.register(self.close)
+            vectors = self.model.encode_multi_process(
+                texts,
+                self._pool,
+                batch_size=self.batch_size,
+                chunk_size=max(self.batch_size, len(texts) // (self.processes * 4)),
+            )
+        else:
+            vectors = self.model.encode(texts, batch_size=self.batch_size)
+        return normalize_rows(vectors)
+
+    def encode(self, texts: List[str], compact: bool = False) -> np.ndarray:
+        """Embed texts, reusing stored vectors and storing new ones.
+
+        With `compact` and a store, the stored rows are returned as they are
+        (float16, or int8 scaled by INT8_SCALE) instead of as unit float32 rows.
+        """
+        if not texts:
+            return np.empty((0, 0), dtype=np.float32)
+        if self.store is None:
+            return self._encode(texts)
+
+        rows = self.store.lookup(texts)
+        if (rows < 0).any():
+            unique = list(dict.fromkeys(t for t, row in zip(texts, rows) if row < 0))
+            self.store.add(unique, self._encode(unique))
+            rows = self.store.lookup(texts)
+        vectors = self.store.take(rows)
+        # stored rows were rounded, so restore unit length
+        return vectors if compact else normalize_rows(vectors)
+
+    def close(self):
+        """Stop the worker pool, if one was started."""
+        if self._pool is not None:
+            SentenceTransformer.stop_multi_process_pool(self._pool)
+            self._pool = None
+
+
+_default_encoder = EmbeddingEncoder()
+
+
+def configure_encoder(**kwargs) -> EmbeddingEncoder:
+    """Replace the process-wide encoder used by embed_texts."""
+    global _default_encoder
+    _default_encoder.close()
+    _default_encoder = EmbeddingEncoder(**kwargs)
+    return _default_encoder
+
+
+def get_encoder() -> EmbeddingEncoder:
+    return _default_encoder
+
+
+def embed_texts(texts: List[str], compact: bool = False) -> np.ndarray:
+    """Embed texts into L2-normalized float32 rows with the configured encoder
+    (or the stored rows with `compact`, see EmbeddingEncoder.encode)."""
+    return _default_encoder.encode(texts, compact=compact)
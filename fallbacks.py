@@ -1,98 +1,441 @@
 """Module containing fallback parsing logic for model responses."""
 
 import json
+import math
 import re
-from schemas import CommentClassification, PredictionEvaluation, ThemesList
-
-def clean_json_text(text: str) -> str:
-    """Clean and fix common JSON formatting issues."""
-    # Remove markdown code block markers
-    text = re.sub(r'```(?:json)?\n?(.*?)```', r'\1', text, flags=re.DOTALL)
-    
-    # Remove any non-JSON text before or after the JSON content
-    text = re.sub(r'^[^{\[]*', '', text)
-    text = re.sub(r'[^}\]]*$', '', text)
-    
-    # Fix common formatting issues
-    text = text.replace("'", '"')  # Replace single quotes with double quotes
-    text = re.sub(r'//.*?\n', '\n', text)  # Remove single-line comments
-    text = re.sub(r'/\*.*?\*/', '', text, flags=re.DOTALL)  # Remove multi-line comments
-    
-    return text.strip()
-
-def parse_noisy_comments(text: str, batch_size: int) -> CommentClassification:
-    """Parse model response for noisy comments classification."""
-    text = clean_json_text(text)
-    
+from typing import List, Optional, Tuple, Type, get_args, get_origin
+from pydantic import BaseModel, ValidationError
+
+# Runs of characters that can be copied verbatim from inside a string literal
+_PLAIN_STRING_RUN = re.compile(r"[^\"'\\\x00-\x1f]+")
+_BAREWORD = re.compile(r"[A-Za-z0-9_+\-.]+")
+_JSON_NUMBER = re.compile(r"-?(?:0|[1-9]\d*)(?:\.\d+)?(?:[eE][+-]?\d+)?")
+_LITERALS = {
+    "true": "true",
+    "True": "true",
+    "false": "false",
+    "False": "false",
+    "null": "null",
+    "None": "null",
+    "NaN": "null",
+}
+_CONTROL_ESCAPES = {"\n": "\\n", "\r": "\\r", "\t": "\\t", "\b": "\\b", "\f": "\\f"}
+_CLOSERS = {"{": "}", "[": "]"}
+# opening brackets tried as the start of the JSON payload before giving up
+MAX_PAYLOAD_STARTS = 16
+
+
+def _next_significant(text: str, i: int) -> str:
+    """Return the next non-whitespace character at or after i ('' at the end)."""
+    n = len(text)
+    while i < n and text[i] in " \t\r\n":
+        i += 1
+    return text[i] if i < n else ""
+
+
+def _payload_starts(text: str) -> List[int]:
+    """Positions of the first MAX_PAYLOAD_STARTS opening brackets."""
+    return [m.start() for m in re.finditer(r"[{\[]", text)][:MAX_PAYLOAD_STARTS]
+
+
+def repair_json(text: str, start: Optional[int] = None) -> Tuple[str, bool]:
+    """Repair common JSON formatting issues in a single pass.
+
+    Handles surrounding prose and markdown fences, comments, single-quoted
+    strings (without touching apostrophes inside double-quoted ones), unescaped
+    quotes and control characters inside strings, invalid escapes, Python
+    literals, bare keys and trailing commas. If the output was truncated, it is
+    cut back to the last complete array/object element and the open containers
+    are closed, so completed items survive.
+
+    Args:
+        start: Index of the opening bracket to parse from (default: the first
+            one in the text)
+
+    Returns:
+        The repaired JSON text and whether the input was truncated.
+    """
+    if start is None:
+        starts = _payload_starts(text)
+        if not starts:
+            return "", False
+        start = starts[0]
+
+    out: List[str] = []
+    stack: List[str] = []
+    # (len(out), len(stack)) right after the last complete element
+    safe_point: Optional[Tuple[int, int]] = None
+    truncated = False
+    i = start
+    n = len(text)
+
+    while i < n:
+        c = text[i]
+
+        if c == '"' or c == "'":
+            quote = c
+            chunk = ['"']
+            i += 1
+            closed = False
+            while i < n:
+                run = _PLAIN_STRING_RUN.match(text, i)
+                if run:
+                    chunk.append(run.group())
+                    i = run.end()
+                    continue
+                ch = text[i]
+                if ch == "\\":
+                    nxt = text[i + 1] if i + 1 < n else ""
+                    if nxt == "'":
+                        chunk.append("'")
+                        i += 2
+                    elif nxt and nxt in '"\\/bfnrt':
+                        chunk.append(ch + nxt)
+                        i += 2
+                    elif nxt == "u" and re.fullmatch(
+                        r"[0-9a-fA-F]{4}", text[i + 2 : i + 6]
+                    ):
+                        chunk.append(text[i : i + 6])
+                        i += 6
+                    elif not nxt:
+                        i += 1
+                    else:
+                        chunk.append("\\\\")
+                        i += 1
+                elif ch == quote:
+                    # A quote only terminates the string when followed by
+                    # structure; otherwise it is part of the text.
+                    if _next_significant(text, i + 1) in ("", ",", ":", "}", "]"):
+                        closed = True
+                        i += 1
+                        break
+                    chunk.append('\\"' if ch == '"' else ch)
+                    i += 1
+                elif ch == '"':
+                    chunk.append('\\"')
+                    i += 1
+                elif ch == "'":
+                    chunk.append(ch)
+                    i += 1
+                else:
+                    chunk.append(_CONTROL_ESCAPES.get(ch, f"\\u{ord(ch):04x}"))
+                    i += 1
+            if not closed:
+                truncated = True
+                break
+            chunk.append('"')
+            out.append("".join(chunk))
+            continue
+
+        if c in "{[":
+            stack.append(c)
+            out.append(c)
+            i += 1
+        elif c in "}]":
+            i += 1
+            if not stack:
+                continue
+            if out and out[-1] == ",":
+                out.pop()
+            out.append(_CLOSERS[stack.pop()])
+            safe_point = (len(out), len(stack))
+            if not stack:
+                break
+        elif c == ",":
+            i += 1
+            if out and out[-1] not in ",[{:":
+                safe_point = (len(out), len(stack))
+                out.append(",")
+        elif c == ":":
+            out.append(c)
+            i += 1
+        elif c == "/" and text.startswith("//", i):
+            newline = text.find("\n", i)
+            i = n if newline == -1 else newline + 1
+        elif c == "/" and text.startswith("/*", i):
+            end = text.find("*/", i + 2)
+            i = n if end == -1 else end + 2
+        elif c in " \t\r\n":
+            i += 1
+        else:
+            word = _BAREWORD.match(text, i)
+            if not word:
+                i += 1
+                continue
+            token = word.group()
+            i = word.end()
+            if token in _LITERALS:
+                out.append(_LITERALS[token])
+            elif _JSON_NUMBER.fullmatch(token):
+                out.append(token)
+            else:
+                try:
+                    # numbers JSON does not accept, e.g. ".5" or "+1"
+                    number = float(token)
+                    out.append(repr(number) if math.isfinite(number) else "null")
+                except ValueError:
+                    # bare keys and unquoted words
+                    out.append(json.dumps(token))
+    else:
+        truncated = bool(stack)
+
+    if truncated:
+        if safe_point and safe_point[1] > 0:
+            del out[safe_point[0] :]
+            del stack[safe_point[1] :]
+        while out and out[-1] in (",", ":"):
+            out.pop()
+        if (
+            stack
+            and stack[-1] == "{"
+            and len(out) >= 2
+            and out[-1].startswith('"')
+            and out[-2] in ("{", ",")
+        ):
+            # a dangling key without a value cannot be kept
+            out.pop()
+            if out[-1] == ",":
+                out.pop()
+        out.extend(_CLOSERS[opener] for opener in reversed(stack))
+
+    return "".join(out), truncated
+
+
+def _list_item_type(annotation) -> Optional[Type[BaseModel]]:
+    """Return the pydantic item type of a List[Model] annotation, if any."""
+    if get_origin(annotation) in (list, List):
+        args = get_args(annotation)
+        if args and isinstance(args[0], type) and issubclass(args[0], BaseModel):
+            return args[0]
+    return None
+
+
+def _find_payload(data, response_format: Type[BaseModel]):
+    """Locate the object holding the schema fields, up to two levels deep."""
+    fields = response_format.model_fields
+    if isinstance(data, list):
+        # a bare array is the value of the schema's only list field
+        list_fields = [
+            name
+            for name, field in fields.items()
+            if get_origin(field.annotation) in (list, List)
+        ]
+        return {list_fields[0]: data} if len(list_fields) == 1 else None
+
+    level = [data]
+    for _ in range(3):
+        next_level = []
+        for candidate in level:
+            if not isinstance(candidate, dict):
+                continue
+            if any(key in candidate for key in fields):
+                return candidate
+            next_level.extend(v for v in candidate.values() if isinstance(v, dict))
+        level = next_level
+    return None
+
+
+def _validate_partial(payload: dict, response_format: Type[BaseModel]):
+    """Validate after dropping invalid items from list-of-model fields."""
+    cleaned = dict(payload)
+    for name, field in response_format.model_fields.items():
+        item_type = _list_item_type(field.annotation)
+        if item_type is None or not isinstance(cleaned.get(name), list):
+            continue
+        kept = []
+        for item in cleaned[name]:
+            try:
+                kept.append(item_type.model_validate(item))
+            except ValidationError:
+                continue
+        cleaned[name] = kept
     try:
-        # Try parsing as direct JSON array
-        data = json.loads(text)
-        if isinstance(data, list) and all(isinstance(x, bool) for x in data):
-            return CommentClassification(is_noisy=data)
-            
-        # Try parsing as object with results field
-        if isinstance(data, dict) and "results" in data:
-            results = data["results"]
-            if isinstance(results, list) and all(isinstance(x, bool) for x in results):
-                return CommentClassification(is_noisy=results)
-                
-    except json.JSONDecodeError:
-        pass
-        
-    # Fallback: Try to extract boolean array from text
-    pattern = r'\[(.*?)\]'
-    match = re.search(pattern, text)
-    if match:
-        try:
-            values = [x.strip().lower() == "true" for x in match.group(1).split(",")]
-            if len(values) == batch_size:
-                return CommentClassification(is_noisy=values)
-        except Exception:
-            pass
-            
-    # If all parsing attempts fail, return all False
-    return CommentClassification(is_noisy=[False] * batch_size)
-
-def parse_predictions(text: str) -> PredictionEvaluation:
-    """Parse model response for prediction evaluation."""
-    text = clean_json_text(text)
-    
+        return response_format.model_validate(cleaned)
+    except ValidationError:
+        return None
+
+
+def parse_response(
+    text: Optional[str], response_format: Type[BaseModel]
+) -> Optional[BaseModel]:
+    """Parse a model response into the given schema.
+
+    Well-formed responses are decoded once and validated straight from the
+    decoded object; anything else goes through ``repair_json``, starting at
+    each opening bracket in turn until one yields the schema, so brackets in
+    the prose before the payload (``Here is [the] output: {...}``) are
+    skipped. Items of list fields that fail validation (e.g. the cut-off tail
+    of a truncated response) are dropped rather than discarding the whole
+    response.
+    """
+    if not text:
+        return None
+
     try:
-        # Try parsing as direct JSON
-        data = json.loads(text)
-        
-        # Handle case where predictions are directly in root
-        if isinstance(data, list):
-            return PredictionEvaluation(predictions=data)
-            
-        # Handle case where predictions are in a 'predictions' field
-        if isinstance(data, dict) and "predictions" in data:
-            return PredictionEvaluation(predictions=data["predictions"])
-            
+        return _validate_payload(json.loads(text), response_format)[0]
     except json.JSONDecodeError:
         pass
-        
-    # If all parsing attempts fail, return empty predictions list
-    return PredictionEvaluation(predictions=[])
-
-def parse_themes(text: str) -> ThemesList:
-    """Parse model response for theme identification."""
-    text = clean_json_text(text)
-    
+
+    # the first start that validates wins; failing that, the partial
+    # parse that kept the most items
+    best, best_items = None, -1
+    for start in _payload_starts(text):
+        repaired, _ = repair_json(text, start)
+        try:
+            data = json.loads(repaired)
+        except json.JSONDecodeError:
+            continue
+        response, exact = _validate_payload(data, response_format)
+        if response is None:
+            continue
+        if exact:
+            return response
+        items = _item_count(response)
+        if items > best_items:
+            best, best_items = response, items
+    return best
+
+
+def _validate_payload(
+    data, response_format: Type[BaseModel]
+) -> Tuple[Optional[BaseModel], bool]:
+    """Validate decoded data; also return whether it validated without
+    dropping any list items."""
+    payload = _find_payload(data, response_format)
+    if payload is None:
+        return None, False
     try:
-        # Try parsing as direct JSON
-        data = json.loads(text)
-        
-        # Handle case where themes are in a 'themes' field
-        if isinstance(data, dict) and "themes" in data:
-            return ThemesList(**data)
-            
-        # Handle case where themes are directly in root
-        if isinstance(data, list):
-            return ThemesList(themes=data)
-            
-    except json.JSONDecodeError:
-        pass
-        
-    # If all parsing attempts fail, return empty themes list
-    return ThemesList(themes=[])
+        return response_format.model_validate(payload), True
+    except ValidationError:
+        return _validate_partial(payload, response_format), False
+
+
+def _item_count(response: BaseModel) -> int:
+    return sum(
+        len(getattr(response, name))
+        for name, field in type(response).model_fields.items()
+        if _list_item_type(field.annotation) is not None
+    )
+
+
+def streamed_list_field(
+    response_format: Type[BaseModel],
+) -> Optional[Tuple[str, Type[BaseModel]]]:
+    """Return the (name, item type) of the schema's list-of-model field."""
+    for name, field in response_format.model_fields.items():
+        item_type = _list_item_type(field.annotation)
+        if item_type is not None:
+            return name, item_type
+    return None
+
+
+class IncrementalItemParser:
+    """Incrementally parse a streamed JSON response into list items.
+
+    Feed the response text chunk by chunk; every element of the schema's
+    list-of-model field (e.g. ``predictions`` of PredictionEvaluation or
+    ``themes`` of ThemesList) is validated and returned as soon as its closing
+    brace arrives, so a truncated stream still keeps its completed items.
+    """
+
+    def __init__(self, response_format: Type[BaseModel]):
+        field = streamed_list_field(response_format)
+        if field is None:
+            raise ValueError(
+                f"{response_format.__name__} has no list field to stream items from"
+            )
+        self.response_format = response_format
+        self.field_name, self.item_type = field
+        self.buffer = ""
+        self.emitted = 0
+        self.complete = False
+        self._pos = 0
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._string_start = -1
+        self._last_string = None  # (start, end) of the last closed string
+        self._last_token = ""
+        self._key = None
+        self._array_depth = None  # depth inside the target array
+        self._item_start = -1
+
+    def _emit(self, raw: str) -> Optional[BaseModel]:
+        try:
+            return self.item_type.model_validate(json.loads(raw))
+        except (json.JSONDecodeError, ValidationError):
+            return parse_response(raw, self.item_type)
+
+    def feed(self, chunk: str) -> List[BaseModel]:
+        """Consume a chunk of the response and return newly completed items."""
+        self.buffer += chunk
+        items = []
+        text = self.buffer
+        for i in range(self._pos, len(text)):
+            c = text[i]
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif c == "\\":
+                    self._escape = True
+                elif c == '"':
+                    self._in_string = False
+                    self._last_string = (self._string_start, i + 1)
+                    self._last_token = '"'
+                continue
+
+            if c == '"':
+                self._in_string = True
+                self._string_start = i
+            elif c == ":":
+                if self._last_token == '"' and self._last_string:
+                    start, end = self._last_string
+                    try:
+                        self._key = json.loads(text[start:end])
+                    except json.JSONDecodeError:
+                        self._key = None
+                self._last_token = c
+            elif c in "{[":
+                if (
+                    c == "["
+                    and self._array_depth is None
+                    and self._last_token == ":"
+                    and self._key == self.field_name
+                ):
+                    self._array_depth = self._depth + 1
+                elif c == "{" and self._depth == self._array_depth:
+                    self._item_start = i
+                self._depth += 1
+                self._last_token = c
+            elif c in "}]":
+                self._depth -= 1
+                if (
+                    c == "}"
+                    and self._depth == self._array_depth
+                    and self._item_start >= 0
+                ):
+                    item = self._emit(text[self._item_start : i + 1])
+                    self._item_start = -1
+                    if item is not None:
+                        items.append(item)
+                elif c == "]" and self._array_depth is not None:
+                    if self._depth < self._array_depth:
+                        self._array_depth = None
+                self._last_token = c
+            elif not c.isspace():
+                self._last_token = c
+        self._pos = len(text)
+        self.emitted += len(items)
+        return items
+
+    def finish(self) -> List[BaseModel]:
+        """Return the items a tolerant parse of the full text finds beyond those
+        already emitted (e.g. when the stream was not well-formed JSON)."""
+        response = parse_response(self.buffer, self.response_format)
+        self.complete = response is not None
+        if response is None:
+            return []
+        items = getattr(response, self.field_name)
+        remaining = items[self.emitted :]
+        self.emitted += len(remaining)
+        return remaining
@@ -0,0 +1,215 @@
+"""Persisted clustering with an incremental assignment path.
+
+A full HDBSCAN fit (cluster_predictions) reshuffles cluster ids whenever a few
+predictions are added, so every cluster's theme call misses the cache. The
+ClusterModel keeps the last fit (labels of the known predictions, normalized
+centroids and radii of the clusters) in the cache directory. New predictions
+are assigned to the nearest centroid when they fall inside its radius and
+otherwise join the noise cluster as outliers. Only when the outliers or the
+growth since the last fit pass a threshold is HDBSCAN refit. Clusters that
+receive no new predictions keep their exact prediction lists, so their
+"cluster_themes" cache entries stay valid.
+"""
+
+import os
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+
+import numpy as np
+
+from cache_manager import file_lock
+from records import PredictionRecord
+from vector_ops import normalize_rows
+
+NOISE_CLUSTER = "-1"
+
+
+def is_noise_cluster(cluster_id: str) -> bool:
+    """HDBSCAN noise clusters, including noise of recursed subclusters."""
+    return cluster_id == NOISE_CLUSTER or cluster_id.endswith("--1")
+
+
+class ClusterModel:
+    """Cluster assignment state of one model on one thread, persisted as an
+    .npz file."""
+
+    def __init__(
+        self,
+        path: Path,
+        radius_quantile: float = 0.95,
+        radius_slack: float = 1.1,
+        max_outliers: int = 20,
+        max_outlier_fraction: float = 0.1,
+        max_growth: float = 0.5,
+    ):
+        self.path = Path(path)
+        self.radius_quantile = radius_quantile
+        self.radius_slack = radius_slack
+        self.max_outliers = max_outliers
+        self.max_outlier_fraction = max_outlier_fraction
+        self.max_growth = max_growth
+        self.labels: Dict[str, str] = {}  # prediction text -> cluster id
+        self.cluster_ids: List[str] = []
+        self.centroids = np.empty((0, 0), dtype=np.float32)
+        self.radii = np.empty(0, dtype=np.float32)
+        self.fit_size = 0
+        self.outliers = 0
+        self._load()
+
+    @classmethod
+    def for_model(
+        cls, cache_dir, model_name: str, thread_id: Optional[str] = None, **kwargs
+    ) -> "ClusterModel":
+        """The state of a model's run on a thread (thread_id=None: the single
+        thread of the CLI before runs were keyed by thread)."""
+        name = model_name.replace("/", "_").replace("-", "_")
+        if thread_id is not None:
+            name = f"{name}_{thread_id}"
+        return cls(Path(cache_dir) / f"{name}_cluster_model.npz", **kwargs)
+
+    @property
+    def lock_path(self) -> Path:
+        return self.path.with_suffix(".lock")
+
+    def _load(self):
+        if not self.path.exists():
+            return
+        with np.load(self.path) as data:
+            self.labels = dict(zip(data["texts"].tolist(), data["labels"].tolist()))
+            self.cluster_ids = data["cluster_ids"].tolist()
+            self.centroids = data["centroids"]
+            self.radii = data["radii"]
+            self.fit_size = int(data["fit_size"])
+            self.outliers = int(data["outliers"])
+
+    def save(self):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.path.with_suffix(f".{os.getpid()}.tmp")
+        with open(tmp_path, "wb") as f:
+            np.savez(
+                f,
+                texts=np.array(list(self.labels), dtype=str),
+                labels=np.array(list(self.labels.values()), dtype=str),
+                cluster_ids=np.array(self.cluster_ids, dtype=str),
+                centroids=self.centroids,
+                radii=self.radii,
+                fit_size=self.fit_size,
+                outliers=self.outliers,
+            )
+        os.replace(tmp_path, self.path)
+
+    def needs_refit(self, new_count: int) -> bool:
+        """Whether the outlier buffer or the growth since the last fit is too
+        large for centroid assignment to stay representative."""
+        if not self.fit_size or not self.cluster_ids:
+            return True
+        outlier_limit = max(
+            self.max_outliers, self.max_outlier_fraction * self.fit_size
+        )
+        growth_limit = self.fit_size * (1 + self.max_growth)
+        return (
+            self.outliers > outlier_limit or len(self.labels) + new_count > growth_limit
+        )
+
+    def fit(
+        self,
+        predictions: List[PredictionRecord],
+        embeddings: np.ndarray,
+        clusters: Dict,
+    ):
+        """Store the result of a full clustering of the given predictions."""
+        index = {id(p): i for i, p in enumerate(predictions)}
+        self.labels = {}
+        self.cluster_ids = []
+        centroids, radii = [], []
+        for cluster_id, members in clusters.items():
+            rows = [index[id(p)] for p in members]
+            for p in members:
+                self.labels[p.prediction] = cluster_id
+            if is_noise_cluster(cluster_id):
+                continue
+            member_embeddings = embeddings[rows]
+            centroid = normalize_rows(member_embeddings.mean(axis=0))[0]
+            distances = 1 - member_embeddings @ centroid
+            self.cluster_ids.append(cluster_id)
+            centroids.append(centroid)
+            radii.append(np.quantile(distances, self.radius_quantile))
+        self.centroids = np.array(centroids, dtype=np.float32)
+        self.radii = np.array(radii, dtype=np.float32)
+        self.fit_size = len(predictions)
+        self.outliers = sum(
+            1 for label in self.labels.values() if is_noise_cluster(label)
+        )
+
+    def assign(self, texts: List[str], embeddings: np.ndarray) -> List[str]:
+        """Assign new predictions to the nearest cluster within its radius,
+        or to the noise cluster."""
+        if not texts:
+            return []
+        similarities = embeddings @ self.centroids.T
+        nearest = similarities.argmax(axis=1)
+        distances = 1 - similarities[np.arange(len(texts)), nearest]
+        inside = distances <= self.radii[nearest] * self.radius_slack
+        labels = [
+            self.cluster_ids[c] if ok else NOISE_CLUSTER
+            for c, ok in zip(nearest, inside)
+        ]
+        for text, label in zip(texts, labels):
+            self.labels[text] = label
+        self.outliers += int((~inside).sum())
+        return labels
+
+    def cluster(
+        self,
+        predictions: List[PredictionRecord],
+        embed: Callable[[List[str]], np.ndarray],
+        full_fit: Callable[
+            [List[PredictionRecord], np.ndarray], Dict[str, List[PredictionRecord]]
+        ],
+        embeddings: Optional[np.ndarray] = None,
+    ) -> Dict[str, List[PredictionRecord]]:
+        """Cluster predictions, assigning new ones incrementally when possible.
+
+        The persisted state is reloaded, updated and saved under a file lock,
+        so processes sharing the cache directory don't overwrite each other.
+
+        Args:
+            embed: Embeds texts into normalized rows
+            full_fit: Full clustering, e.g. cluster_predictions
+            embeddings: Precomputed embeddings of the predictions, if any
+        """
+        with file_lock(self.lock_path):
+            self._load()
+            clusters = self._cluster(predictions, embed, full_fit, embeddings)
+            self.save()
+        return clusters
+
+    def _cluster(self, predictions, embed, full_fit, embeddings):
+        new_rows = [
+            i for i, p in enumerate(predictions) if p.prediction not in self.labels
+        ]
+        if self.needs_refit(len(new_rows)):
+            if embeddings is None:
+                embeddings = embed([p.prediction for p in predictions])
+            clusters = full_fit(predictions, embeddings)
+            self.fit(predictions, embeddings, clusters)
+            print(
+                f"Refit clustering on {len(predictions)} predictions "
+                f"({len(self.cluster_ids)} clusters)"
+            )
+        else:
+            new_texts = [predictions[i].prediction for i in new_rows]
+            labels = []
+            if new_rows:
+                new_embeddings = (
+                    embeddings[new_rows] if embeddings is not None else embed(new_texts)
+                )
+                labels = self.assign(new_texts, new_embeddings)
+            print(
+                f"Assigned {len(new_rows)} new predictions incrementally "
+                f"({labels.count(NOISE_CLUSTER)} outliers, {self.outliers} buffered)"
+            )
+            clusters = {}
+            for p in predictions:
+                clusters.setdefault(self.labels[p.prediction], []).append(p)
+        return clusters
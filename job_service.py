@@ -0,0 +1,968 @@
+"""Service mode: an HTTP API over a durable job queue, and scalable workers.
+
+A job analyses one thread with one model. It is split into work units, one
+per step and batch: fetch (the thread's comments), filter and extract (one
+unit per comment batch) and theme (one unit per job). Units of a step are
+created when the previous step has finished. The queue lives in SQLite and
+is only touched by the server. Workers, on this machine or on other nodes,
+claim units over HTTP and renew a lease while they work. A unit whose
+worker dies is claimed again once its lease expires. Workers share the
+CacheManager directory (a shared filesystem for several nodes), so a unit
+that is retried, or that ran before in a CLI run, is answered from cache.
+
+    python job_service.py serve --port 8800 --workers 4
+    python job_service.py worker --server http://queue-host:8800 --cache-dir /shared/cache
+    python job_service.py submit 42490343 --models openai anthropic --follow
+    python job_service.py status 1
+
+API:
+    POST /jobs                  {"threads": [...], "models": [...], options}
+    GET  /jobs                  all jobs
+    GET  /jobs/<id>             status and per-step unit counts
+    GET  /jobs/<id>/events      progress as server-sent events
+    GET  /jobs/<id>/results     themes of a completed job
+    POST /units/claim           {"worker": ..., "lease": seconds}
+    POST /units/<id>/heartbeat  {"worker": ..., "lease": seconds}
+    POST /units/<id>/complete   {"worker": ..., "result": ...}
+    POST /units/<id>/fail       {"worker": ..., "error": ...}
+"""
+
+import argparse
+import json
+import os
+import socket
+import sqlite3
+import subprocess
+import sys
+import threading
+import time
+import traceback
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import requests
+from dotenv import load_dotenv
+
+from analyse_predictions import (
+    attribute_predictions,
+    extract_predictions_with_retry,
+    fetch_hacker_news_comments,
+    identify_themes,
+    is_comment_noisy,
+    load_batch_flags,
+    load_batch_predictions,
+    make_comment_batches,
+    prepare_comments,
+)
+from cache_manager import CacheManager
+from embeddings import configure_encoder
+from records import CommentRecord, predictions_from_cache
+from results_store import ResultsStore
+from run_analysis import get_analysis_model
+
+DEFAULT_DB = "outputs/jobs.db"
+MODELS = ["gemini", "openai", "anthropic", "ollama", "groq", "local"]
+STEPS = ["fetch", "filter", "extract", "theme"]
+DEFAULT_OPTIONS = {
+    "batch_size": 5,
+    "batching": "page",
+    "fallback_models": [],
+    "api_base": None,
+    # the failover wrapper is only used with fallbacks, a deadline or hedging
+    "deadline": None,
+    "hedge_quantile": None,
+    "dedup_threshold": 0.92,
+    "merge_threshold": 0.8,
+}
+# seconds a claimed unit stays with its worker without a heartbeat
+DEFAULT_LEASE = 300.0
+MAX_ATTEMPTS = 3
+# body fields the worker endpoints need
+REQUIRED_FIELDS = {
+    "claim": ("worker",),
+    "heartbeat": ("worker",),
+    "complete": ("worker", "result"),
+    "fail": ("worker", "error"),
+}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    job_id INTEGER PRIMARY KEY,
+    thread_id TEXT NOT NULL,
+    model TEXT NOT NULL,
+    options TEXT NOT NULL,
+    status TEXT NOT NULL,
+    comments TEXT,
+    result TEXT,
+    error TEXT,
+    created REAL NOT NULL,
+    updated REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS units (
+    unit_id INTEGER PRIMARY KEY,
+    job_id INTEGER NOT NULL REFERENCES jobs (job_id),
+    step TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    payload TEXT NOT NULL,
+    status TEXT NOT NULL,
+    worker TEXT,
+    lease_until REAL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    result TEXT,
+    error TEXT
+);
+CREATE TABLE IF NOT EXISTS events (
+    event_id INTEGER PRIMARY KEY,
+    job_id INTEGER NOT NULL REFERENCES jobs (job_id),
+    time REAL NOT NULL,
+    message TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_units_queue ON units (status, unit_id);
+CREATE INDEX IF NOT EXISTS idx_units_job ON units (job_id, step, position);
+CREATE INDEX IF NOT EXISTS idx_events_job ON events (job_id, event_id);
+"""
+
+
+class JobQueue:
+    """SQLite-backed jobs, work units and progress events.
+
+    Units move from pending to claimed (with a lease) to done; a failed
+    unit goes back to pending until it has used MAX_ATTEMPTS claims, then
+    its job fails. Finishing the last unit of a step plans the next step.
+    """
+
+    def __init__(
+        self,
+        db_path: str = DEFAULT_DB,
+        results_db: Optional[str] = None,
+        max_attempts: int = MAX_ATTEMPTS,
+    ):
+        Path(db_path).parent.mkdir(parents=True, exist_ok=True)
+        self.conn = sqlite3.connect(db_path, check_same_thread=False)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.executescript(SCHEMA)
+        self.results_db = results_db
+        self.max_attempts = max_attempts
+        # the HTTP server is threaded and sqlite3 connections are not
+        self.lock = threading.RLock()
+
+    def close(self):
+        self.conn.close()
+
+    def _event(self, job_id: int, message: str):
+        self.conn.execute(
+            "INSERT INTO events (job_id, time, message) VALUES (?, ?, ?)",
+            (job_id, time.time(), message),
+        )
+
+    def _set_job(self, job_id: int, **fields):
+        fields["updated"] = time.time()
+        assignments = ", ".join(f"{key} = ?" for key in fields)
+        self.conn.execute(
+            f"UPDATE jobs SET {assignments} WHERE job_id = ?",
+            [*fields.values(), job_id],
+        )
+
+    def _add_units(self, job_id: int, step: str, payloads: List[Dict]):
+        self.conn.executemany(
+            "INSERT INTO units (job_id, step, position, payload, status)"
+            " VALUES (?, ?, ?, ?, 'pending')",
+            [
+                (job_id, step, position, json.dumps(payload))
+                for position, payload in enumerate(payloads)
+            ],
+        )
+        self._event(job_id, f"{step}: {len(payloads)} units queued")
+
+    def submit(
+        self,
+        thread_id: str,
+        model: str,
+        options: Dict = None,
+        comments: Optional[List] = None,
+    ) -> int:
+        """Queue a job; with `comments` the fetch step is skipped."""
+        if model not in MODELS:
+            raise ValueError(f"Unknown model: {model}")
+        options = {**DEFAULT_OPTIONS, **(options or {})}
+        now = time.time()
+        with self.lock, self.conn:
+            job_id = self.conn.execute(
+                "INSERT INTO jobs (thread_id, model, options, status, created,"
+                " updated) VALUES (?, ?, ?, 'queued', ?, ?)",
+                (thread_id, model, json.dumps(options), now, now),
+            ).lastrowid
+            self._event(job_id, f"Job for thread {thread_id} with {model} queued")
+            if comments is None:
+                self._add_units(job_id, "fetch", [{"thread_id": thread_id}])
+            else:
+                self._plan_filter(job_id, options, comments)
+        return job_id
+
+    def claim(self, worker: str, lease: float = DEFAULT_LEASE) -> Optional[Dict]:
+        """Claim the oldest pending unit, or one whose lease has expired."""
+        now = time.time()
+        with self.lock, self.conn:
+            row = self.conn.execute(
+                """
+                SELECT u.*, j.model, j.options FROM units u
+                JOIN jobs j ON j.job_id = u.job_id
+                WHERE j.status IN ('queued', 'running')
+                  AND (u.status = 'pending'
+                       OR (u.status = 'claimed' AND u.lease_until < ?))
+                ORDER BY u.unit_id LIMIT 1
+                """,
+                (now,),
+            ).fetchone()
+            if row is None:
+                return None
+            if row["status"] == "claimed":
+                self._event(
+                    row["job_id"],
+                    f"{row['step']} unit {row['position']}: lease of "
+                    f"{row['worker']} expired",
+                )
+                if row["attempts"] >= self.max_attempts:
+                    self._fail_unit(row, "lease expired")
+                    return self.claim(worker, lease)
+            self.conn.execute(
+                "UPDATE units SET status = 'claimed', worker = ?, lease_until = ?,"
+                " attempts = attempts + 1 WHERE unit_id = ?",
+                (worker, now + lease, row["unit_id"]),
+            )
+            self._set_job(row["job_id"], status="running")
+        return {
+            "unit_id": row["unit_id"],
+            "job_id": row["job_id"],
+            "step": row["step"],
+            "position": row["position"],
+            "model": row["model"],
+            "options": json.loads(row["options"]),
+            "payload": json.loads(row["payload"]),
+        }
+
+    def _claimed_unit(self, unit_id: int, worker: str) -> Optional[sqlite3.Row]:
+        """The unit if `worker` still holds it (its lease may have been taken
+        over by another worker)."""
+        return self.conn.execute(
+            "SELECT * FROM units WHERE unit_id = ? AND status = 'claimed'"
+            " AND worker = ?",
+            (unit_id, worker),
+        ).fetchone()
+
+    def heartbeat(self, unit_id: int, worker: str, lease: float = DEFAULT_LEASE):
+        """Extend the lease; False when the worker no longer holds the unit."""
+        with self.lock, self.conn:
+            if self._claimed_unit(unit_id, worker) is None:
+                return False
+            self.conn.execute(
+                "UPDATE units SET lease_until = ? WHERE unit_id = ?",
+                (time.time() + lease, unit_id),
+            )
+        return True
+
+    def complete(self, unit_id: int, worker: str, result) -> bool:
+        with self.lock, self.conn:
+            row = self._claimed_unit(unit_id, worker)
+            if row is None:
+                return False
+            self.conn.execute(
+                "UPDATE units SET status = 'done', result = ? WHERE unit_id = ?",
+                (json.dumps(result), unit_id),
+            )
+            job_id, step = row["job_id"], row["step"]
+            done, total = self.conn.execute(
+                "SELECT SUM(status = 'done'), COUNT(*) FROM units"
+                " WHERE job_id = ? AND step = ?",
+                (job_id, step),
+            ).fetchone()
+            self._event(job_id, f"{step}: {done}/{total} units done")
+            if done == total:
+                self._advance(job_id, step)
+        return True
+
+    def fail(self, unit_id: int, worker: str, error: str) -> bool:
+        with self.lock, self.conn:
+            row = self._claimed_unit(unit_id, worker)
+            if row is None:
+                return False
+            if row["attempts"] >= self.max_attempts:
+                self._fail_unit(row, error)
+            else:
+                self.conn.execute(
+                    "UPDATE units SET status = 'pending', worker = NULL,"
+                    " lease_until = NULL, error = ? WHERE unit_id = ?",
+                    (error, unit_id),
+                )
+                self._event(
+                    row["job_id"],
+                    f"{row['step']} unit {row['position']} failed on "
+                    f"{worker}, retrying: {error}",
+                )
+        return True
+
+    def _fail_unit(self, row: sqlite3.Row, error: str):
+        self.conn.execute(
+            "UPDATE units SET status = 'failed', error = ? WHERE unit_id = ?",
+            (error, row["unit_id"]),
+        )
+        message = (
+            f"{row['step']} unit {row['position']} failed after "
+            f"{row['attempts']} attempts: {error}"
+        )
+        self._set_job(row["job_id"], status="failed", error=message)
+        self._event(row["job_id"], message)
+
+    def _step_results(self, job_id: int, step: str) -> List:
+        return [
+            json.loads(row["result"])
+            for row in self.conn.execute(
+                "SELECT result FROM units WHERE job_id = ? AND step = ?"
+                " ORDER BY position",
+                (job_id, step),
+            )
+        ]
+
+    def _step_payloads(self, job_id: int, step: str) -> List[Dict]:
+        return [
+            json.loads(row["payload"])
+            for row in self.conn.execute(
+                "SELECT payload FROM units WHERE job_id = ? AND step = ?"
+                " ORDER BY position",
+                (job_id, step),
+            )
+        ]
+
+    def _plan_filter(self, job_id: int, options: Dict, comments: List):
+        comment_objs = prepare_comments(comments)
+        if not comment_objs:
+            message = "No comments to analyse"
+            self._set_job(job_id, status="failed", error=message)
+            self._event(job_id, message)
+            return
+        self._set_job(job_id, comments=json.dumps([c.to_dict() for c in comment_objs]))
+        self._add_units(
+            job_id,
+            "filter",
+            _batch_payloads(
+                make_comment_batches(
+                    comment_objs, options["batch_size"], options["batching"]
+                )
+            ),
+        )
+
+    def _advance(self, job_id: int, step: str):
+        """Plan the units of the step after `step`, or finish the job."""
+        job = self.conn.execute(
+            "SELECT * FROM jobs WHERE job_id = ?", (job_id,)
+        ).fetchone()
+        options = json.loads(job["options"])
+        if step == "fetch":
+            self._plan_filter(job_id, options, self._step_results(job_id, step)[0])
+            return
+
+        comment_objs = prepare_comments(json.loads(job["comments"]))
+        filtered = _filtered_comments(
+            self._step_payloads(job_id, "filter"),
+            self._step_results(job_id, "filter"),
+        )
+        if step == "filter":
+            self._event(
+                job_id, f"Filtered {len(comment_objs) - len(filtered)} noisy comments"
+            )
+            batches = make_comment_batches(
+                filtered,
+                options["batch_size"],
+                options["batching"],
+                lookup=comment_objs,
+            )
+            if batches:
+                self._add_units(job_id, "extract", _batch_payloads(batches))
+            else:
+                self._finish(job_id, job, comment_objs, filtered, [], None)
+        elif step == "extract":
+            predictions = [
+                p for result in self._step_results(job_id, step) for p in result
+            ]
+            self._event(job_id, f"Extracted {len(predictions)} predictions")
+            if predictions:
+                self._add_units(job_id, "theme", [{"predictions": predictions}])
+            else:
+                self._finish(job_id, job, comment_objs, filtered, [], None)
+        elif step == "theme":
+            predictions = self._step_payloads(job_id, step)[0]["predictions"]
+            self._finish(
+                job_id,
+                job,
+                comment_objs,
+                filtered,
+                predictions,
+                self._step_results(job_id, step)[0],
+            )
+
+    def _finish(
+        self,
+        job_id: int,
+        job: sqlite3.Row,
+        comment_objs: List[CommentRecord],
+        filtered: List[CommentRecord],
+        predictions: List[Dict],
+        result: Optional[Dict],
+    ):
+        """Store the job's themes (in the serialize_data format) and export
+        them to the results store when one is configured."""
+        if result is None:
+            result = {"themes": [], "model": job["model"]}
+        self._set_job(job_id, status="completed", result=json.dumps(result))
+        self._event(job_id, f"Job completed with {len(result['themes'])} themes")
+        if self.results_db:
+            # like export_run, from the serialized themes
+            store = ResultsStore(self.results_db)
+            store.clear_run(job["thread_id"], result["model"])
+            store.write_comments(
+                job["thread_id"], result["model"], comment_objs, filtered
+            )
+            store.write_themes(
+                job["thread_id"],
+                result["model"],
+                result["themes"],
+                predictions_from_cache(predictions),
+            )
+            store.conn.commit()
+            store.close()
+
+    def job_status(self, job_id: int) -> Optional[Dict]:
+        with self.lock:
+            job = self.conn.execute(
+                "SELECT job_id, thread_id, model, options, status, error, created,"
+                " updated FROM jobs WHERE job_id = ?",
+                (job_id,),
+            ).fetchone()
+            if job is None:
+                return None
+            steps = {}
+            for row in self.conn.execute(
+                "SELECT step, status, COUNT(*) AS units FROM units WHERE job_id = ?"
+                " GROUP BY step, status",
+                (job_id,),
+            ):
+                steps.setdefault(row["step"], {})[row["status"]] = row["units"]
+        status = dict(job)
+        status["options"] = json.loads(status["options"])
+        status["steps"] = {step: steps[step] for step in STEPS if step in steps}
+        return status
+
+    def list_jobs(self) -> List[Dict]:
+        with self.lock:
+            return [
+                dict(row)
+                for row in self.conn.execute(
+                    "SELECT job_id, thread_id, model, status, created, updated"
+                    " FROM jobs ORDER BY job_id"
+                )
+            ]
+
+    def events(self, job_id: int, after: int = 0) -> List[Dict]:
+        with self.lock:
+            return [
+                dict(row)
+                for row in self.conn.execute(
+                    "SELECT event_id, time, message FROM events"
+                    " WHERE job_id = ? AND event_id > ? ORDER BY event_id",
+                    (job_id, after),
+                )
+            ]
+
+    def results(self, job_id: int) -> Optional[Dict]:
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT result FROM jobs WHERE job_id = ?", (job_id,)
+            ).fetchone()
+        return json.loads(row["result"]) if row and row["result"] else None
+
+
+def _batch_payloads(batches) -> List[Dict]:
+    return [
+        {
+            "batch": [c.to_dict() for c in batch],
+            "context": None if context is None else [c.to_dict() for c in context],
+        }
+        for batch, context in batches
+    ]
+
+
+def _unit_comments(payload: Dict):
+    batch = prepare_comments(payload["batch"])
+    context = payload["context"]
+    return batch, None if context is None else prepare_comments(context)
+
+
+def _filtered_comments(payloads: List[Dict], flags: List[List[bool]]):
+    """Non-noisy comments in page order, from the filter units."""
+    return [
+        comment
+        for payload, unit_flags in zip(payloads, flags)
+        for comment, is_noisy in zip(_unit_comments(payload)[0], unit_flags)
+        if not is_noisy
+    ]
+
+
+class JobHandler(BaseHTTPRequestHandler):
+    queue: JobQueue = None
+    # seconds between polls of the events table while streaming progress
+    poll_interval = 0.5
+
+    def log_message(self, format, *args):
+        pass
+
+    def handle_one_request(self):
+        try:
+            super().handle_one_request()
+        except (BrokenPipeError, ConnectionResetError):
+            # a client stopped following a progress stream
+            self.close_connection = True
+
+    def _send_json(self, status: int, payload):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _read_json(self) -> Dict:
+        length = int(self.headers.get("Content-Length", 0))
+        return json.loads(self.rfile.read(length) or b"{}")
+
+    def _has_fields(self, request: Dict, action: str) -> bool:
+        """Answer 400 (and return False) if the body lacks a required field."""
+        missing = [field for field in REQUIRED_FIELDS[action] if field not in request]
+        if missing:
+            self._send_json(400, {"error": f"missing fields: {', '.join(missing)}"})
+        return not missing
+
+    def _stream_events(self, job_id: int):
+        """Send the job's events as server-sent events until it finishes."""
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.end_headers()
+        last = 0
+        while True:
+            status = self.queue.job_status(job_id)["status"]
+            for event in self.queue.events(job_id, last):
+                last = event["event_id"]
+                self.wfile.write(f"data: {json.dumps(event)}\n\n".encode())
+            self.wfile.flush()
+            if status in ("completed", "failed"):
+                self.wfile.write(
+                    f"event: end\ndata: {json.dumps({'status': status})}\n\n".encode()
+                )
+                self.wfile.flush()
+                return
+            time.sleep(self.poll_interval)
+
+    def do_GET(self):
+        parts = self.path.strip("/").split("/")
+        if parts == ["jobs"]:
+            self._send_json(200, self.queue.list_jobs())
+            return
+        if len(parts) < 2 or parts[0] != "jobs" or not parts[1].isdigit():
+            self._send_json(404, {"error": "not found"})
+            return
+        job_id = int(parts[1])
+        status = self.queue.job_status(job_id)
+        if status is None:
+            self._send_json(404, {"error": f"no job {job_id}"})
+        elif len(parts) == 2:
+            self._send_json(200, status)
+        elif parts[2:] == ["events"]:
+            self._stream_events(job_id)
+        elif parts[2:] == ["results"]:
+            if status["status"] != "completed":
+                self._send_json(409, {"error": f"job {job_id} is {status['status']}"})
+            else:
+                self._send_json(200, self.queue.results(job_id))
+        else:
+            self._send_json(404, {"error": "not found"})
+
+    def do_POST(self):
+        parts = self.path.strip("/").split("/")
+        try:
+            request = self._read_json()
+        except json.JSONDecodeError:
+            self._send_json(400, {"error": "invalid JSON"})
+            return
+        if not isinstance(request, dict):
+            self._send_json(400, {"error": "the body must be a JSON object"})
+            return
+        if parts == ["jobs"]:
+            self._submit(request)
+        elif parts == ["units", "claim"]:
+            if not self._has_fields(request, "claim"):
+                return
+            unit = self.queue.claim(
+                request["worker"], request.get("lease", DEFAULT_LEASE)
+            )
+            if unit is None:
+                self.send_response(204)
+                self.end_headers()
+            else:
+                self._send_json(200, unit)
+        elif len(parts) == 3 and parts[0] == "units" and parts[1].isdigit():
+            unit_id, action = int(parts[1]), parts[2]
+            if action in REQUIRED_FIELDS and not self._has_fields(request, action):
+                return
+            if action == "heartbeat":
+                held = self.queue.heartbeat(
+                    unit_id, request["worker"], request.get("lease", DEFAULT_LEASE)
+                )
+            elif action == "complete":
+                held = self.queue.complete(
+                    unit_id, request["worker"], request["result"]
+                )
+            elif action == "fail":
+                held = self.queue.fail(unit_id, request["worker"], request["error"])
+            else:
+                self._send_json(404, {"error": "not found"})
+                return
+            # 409: the lease expired and the unit went to another worker
+            self._send_json(200 if held else 409, {"held": held})
+        else:
+            self._send_json(404, {"error": "not found"})
+
+    def _submit(self, request: Dict):
+        threads = request.get("threads") or [request.get("thread_id")]
+        models = request.get("models") or [request.get("model")]
+        options = {
+            key: request[key] for key in DEFAULT_OPTIONS if request.get(key) is not None
+        }
+        if not all(threads) or not all(models):
+            self._send_json(400, {"error": "threads and models are required"})
+            return
+        if request.get("comments") is not None and len(threads) != 1:
+            self._send_json(400, {"error": "comments need exactly one thread"})
+            return
+        try:
+            job_ids = [
+                self.queue.submit(thread_id, model, options, request.get("comments"))
+                for thread_id in threads
+                for model in models
+            ]
+        except ValueError as e:
+            self._send_json(400, {"error": str(e)})
+            return
+        self._send_json(201, {"jobs": job_ids})
+
+
+def make_server(
+    queue: JobQueue, host: str = "127.0.0.1", port: int = 8800
+) -> ThreadingHTTPServer:
+    """Create (but do not start) the job API bound to host:port."""
+    handler = type("BoundJobHandler", (JobHandler,), {"queue": queue})
+    return ThreadingHTTPServer((host, port), handler)
+
+
+def run_unit(unit: Dict, model, cache_manager: CacheManager):
+    """Run one work unit and return its JSON result."""
+    step, payload, options = unit["step"], unit["payload"], unit["options"]
+    if step == "fetch":
+        comments = fetch_hacker_news_comments(payload["thread_id"])
+        if not comments:
+            raise RuntimeError(f"No comments fetched for {payload['thread_id']}")
+        return comments
+    # every answer is cached, so a batch missing from the cache afterwards
+    # means that no model answered; fail the unit so that it is retried
+    # instead of completing it with placeholder results
+    if step == "filter":
+        batch, context = _unit_comments(payload)
+        flags = is_comment_noisy(
+            batch, model, cache_manager, batch_size=len(batch), context=context
+        )
+        if load_batch_flags(batch, context, model, cache_manager) is None:
+            raise RuntimeError("No model answered the filter unit")
+        return flags
+    if step == "extract":
+        batch, context = _unit_comments(payload)
+        extract_predictions_with_retry(batch, model, cache_manager, context=context)
+        predictions = load_batch_predictions(batch, context, model, cache_manager)
+        if predictions is None:
+            raise RuntimeError("No model answered the extract unit")
+        return [p.to_dict() for p in attribute_predictions(predictions, batch)]
+    if step == "theme":
+        predictions = predictions_from_cache(payload["predictions"])
+        themes = identify_themes(
+            predictions,
+            predictions,
+            model,
+            cache_manager,
+            batch_size=options["batch_size"],
+            dedup_threshold=options["dedup_threshold"],
+            merge_threshold=options["merge_threshold"],
+        )
+        return {"themes": themes.model_dump()["themes"], "model": model.model_name}
+    raise ValueError(f"Unknown step: {step}")
+
+
+class Worker:
+    """Claims units from a job server and runs them until stopped.
+
+    The lease of the running unit is renewed every lease/3 seconds, so only
+    a worker that died (or lost its connection) gives its unit away.
+    """
+
+    def __init__(
+        self,
+        server: str,
+        cache_dir: str = "cache",
+        worker_id: Optional[str] = None,
+        lease: float = DEFAULT_LEASE,
+        poll_interval: float = 1.0,
+    ):
+        self.server = server.rstrip("/")
+        self.cache_manager = CacheManager(cache_dir)
+        self.worker_id = worker_id or f"{socket.gethostname()}-{os.getpid()}"
+        self.lease = lease
+        self.poll_interval = poll_interval
+        self.models = {}
+        self.session = requests.Session()
+
+    def _post(self, path: str, payload: Dict) -> requests.Response:
+        return self.session.post(f"{self.server}{path}", json=payload, timeout=30)
+
+    def _model(self, name: str, options: Dict):
+        key = (
+            name,
+            tuple(options["fallback_models"]),
+            options["api_base"],
+            options.get("deadline"),
+            options.get("hedge_quantile"),
+        )
+        if key not in self.models:
+            self.models[key] = get_analysis_model(
+                name,
+                options["fallback_models"],
+                api_base=options["api_base"],
+                deadline=options.get("deadline"),
+                hedge_quantile=options.get("hedge_quantile"),
+            )
+        return self.models[key]
+
+    def _heartbeat(self, unit_id: int, stop: threading.Event):
+        while not stop.wait(self.lease / 3):
+            try:
+                response = self._post(
+                    f"/units/{unit_id}/heartbeat",
+                    {"worker": self.worker_id, "lease": self.lease},
+                )
+                if response.status_code == 409:
+                    print(f"Lost the lease of unit {unit_id}")
+                    return
+            except requests.RequestException as e:
+                print(f"Heartbeat for unit {unit_id} failed: {e}")
+
+    def run_once(self) -> bool:
+        """Claim and run one unit; False when the queue had no work."""
+        response = self._post(
+            "/units/claim", {"worker": self.worker_id, "lease": self.lease}
+        )
+        if response.status_code == 204:
+            return False
+        response.raise_for_status()
+        unit = response.json()
+        print(
+            f"[{self.worker_id}] job {unit['job_id']}: {unit['step']} unit "
+            f"{unit['position']}"
+        )
+        stop = threading.Event()
+        heartbeat = threading.Thread(
+            target=self._heartbeat, args=(unit["unit_id"], stop), daemon=True
+        )
+        heartbeat.start()
+        try:
+            model = self._model(unit["model"], unit["options"])
+            result = run_unit(unit, model, self.cache_manager)
+        except Exception as e:
+            traceback.print_exc()
+            self._post(
+                f"/units/{unit['unit_id']}/fail",
+                {"worker": self.worker_id, "error": f"{type(e).__name__}: {e}"},
+            )
+            return True
+        finally:
+            stop.set()
+        self._post(
+            f"/units/{unit['unit_id']}/complete",
+            {"worker": self.worker_id, "result": result},
+        )
+        return True
+
+    def run(self):
+        print(f"Worker {self.worker_id} polling {self.server}")
+        try:
+            while True:
+                try:
+                    if not self.run_once():
+                        time.sleep(self.poll_interval)
+                except requests.RequestException as e:
+                    print(f"Job server unavailable: {e}")
+                    time.sleep(self.poll_interval * 5)
+        finally:
+            for model in self.models.values():
+                model.close()
+
+
+def start_local_workers(
+    count: int, server: str, cache_dir: str, lease: float
+) -> List[subprocess.Popen]:
+    """Start worker processes on this machine, exactly as on another node."""
+    return [
+        subprocess.Popen(
+            [
+                sys.executable,
+                os.path.abspath(__file__),
+                "worker",
+                "--server",
+                server,
+                "--cache-dir",
+                cache_dir,
+                "--lease",
+                str(lease),
+            ]
+        )
+        for _ in range(count)
+    ]
+
+
+def follow_events(server: str, job_id: int) -> str:
+    """Print a job's progress until it finishes; returns its final status."""
+    with requests.get(
+        f"{server.rstrip('/')}/jobs/{job_id}/events", stream=True, timeout=None
+    ) as response:
+        response.raise_for_status()
+        event_type = None
+        for line in response.iter_lines(decode_unicode=True):
+            if line.startswith("event: "):
+                event_type = line[len("event: ") :]
+            elif line.startswith("data: "):
+                data = json.loads(line[len("data: ") :])
+                if event_type == "end":
+                    return data["status"]
+                print(f"[job {job_id}] {data['message']}")
+    return "unknown"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Job service for analysis runs")
+    parser.add_argument("command", choices=["serve", "worker", "submit", "status"])
+    parser.add_argument(
+        "targets", nargs="*", help="Thread ids (submit) or job ids (status)"
+    )
+    parser.add_argument("--host", type=str, default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8800)
+    parser.add_argument("--db", type=str, default=DEFAULT_DB)
+    parser.add_argument(
+        "--results-db",
+        type=str,
+        default=None,
+        help="Export completed jobs to this results store (serve)",
+    )
+    parser.add_argument(
+        "--workers", type=int, default=0, help="Local worker processes (serve)"
+    )
+    parser.add_argument("--server", type=str, default="http://127.0.0.1:8800")
+    parser.add_argument("--cache-dir", type=str, default="cache")
+    parser.add_argument("--lease", type=float, default=DEFAULT_LEASE)
+    parser.add_argument(
+        "--embedding-processes",
+        type=int,
+        default=1,
+        help="CPU worker processes used to encode predictions (worker)",
+    )
+    parser.add_argument("--models", type=str, nargs="+", default=["gemini"])
+    parser.add_argument("--fallback-models", type=str, nargs="+", default=[])
+    parser.add_argument(
+        "--deadline",
+        type=float,
+        default=None,
+        help="Seconds a model gets per call before failing over (see run_analysis)",
+    )
+    parser.add_argument(
+        "--hedge-quantile",
+        type=float,
+        default=None,
+        help="Latency quantile after which a duplicate request is sent",
+    )
+    parser.add_argument("--api-base", type=str, default=None)
+    parser.add_argument("--batch-size", type=int, default=5)
+    parser.add_argument(
+        "--batching", type=str, choices=["page", "thread"], default="page"
+    )
+    parser.add_argument(
+        "--comments-file",
+        type=str,
+        default=None,
+        help="JSON list of comments to analyse instead of fetching the thread",
+    )
+    parser.add_argument(
+        "--follow", action="store_true", help="Stream the progress of submitted jobs"
+    )
+    args = parser.parse_args()
+
+    if args.command == "serve":
+        queue = JobQueue(args.db, results_db=args.results_db)
+        server = make_server(queue, args.host, args.port)
+        url = f"http://{args.host}:{args.port}"
+        workers = start_local_workers(args.workers, url, args.cache_dir, args.lease)
+        print(f"Job service on {url} with {len(workers)} local workers")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            for worker in workers:
+                worker.terminate()
+            server.server_close()
+            queue.close()
+    elif args.command == "worker":
+        configure_encoder(
+            processes=args.embedding_processes,
+            store_dir=str(Path(args.cache_dir) / "embeddings"),
+        )
+        Worker(args.server, args.cache_dir, lease=args.lease).run()
+    elif args.command == "submit":
+        if not args.targets:
+            parser.error("submit needs at least one thread id")
+        request = {
+            "threads": args.targets,
+            "models": args.models,
+            "fallback_models": args.fallback_models,
+            "api_base": args.api_base,
+            "deadline": args.deadline,
+            "hedge_quantile": args.hedge_quantile,
+            "batch_size": args.batch_size,
+            "batching": args.batching,
+        }
+        if args.comments_file:
+            with open(args.comments_file, "r") as f:
+                request["comments"] = json.load(f)
+        response = requests.post(f"{args.server}/jobs", json=request, timeout=30)
+        if response.status_code != 201:
+            print(f"Submit failed: {response.json()['error']}")
+            return
+        job_ids = response.json()["jobs"]
+        print(f"Submitted jobs {', '.join(map(str, job_ids))}")
+        if args.follow:
+            for job_id in job_ids:
+                print(f"Job {job_id} {follow_events(args.server, job_id)}")
+    else:
+        for job_id in args.targets:
+            response = requests.get(f"{args.server}/jobs/{job_id}", timeout=30)
+            print(json.dumps(response.json(), indent=2))
+
+
+if __name__ == "__main__":
+    load_dotenv()
+    main()
@@ -1,8 +1,19 @@
 from .base_model import BaseAIModel
+from .litellm_model import LiteLLMModel
 from .gemini_model import GeminiModel
 from .openai_model import OpenAIModel
 from .anthropic_model import AnthropicModel
 from .ollama_model import OllamaModel
 from .groq_model import GroqModel
+from .failover_model import FailoverModel
 
-__all__ = ['BaseAIModel', 'GeminiModel', 'OpenAIModel', 'AnthropicModel', 'OllamaModel', 'GroqModel']
+__all__ = [
+    "BaseAIModel",
+    "LiteLLMModel",
+    "GeminiModel",
+    "OpenAIModel",
+    "AnthropicModel",
+    "OllamaModel",
+    "GroqModel",
+    "FailoverModel",
+]
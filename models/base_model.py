@@ -1,10 +1,9 @@
 from abc import ABC, abstractmethod
 import time
-from typing import List, Dict, Any, Optional, Type
+from typing import List, Dict, Any, Iterator, Optional, Type
 from litellm import completion, RateLimitError
 from pydantic import BaseModel
-import re
-import json
+from fallbacks import parse_response, IncrementalItemParser
 
 
 class BaseAIModel(ABC):
@@ -12,6 +11,19 @@ class BaseAIModel(ABC):
         self.model_name = model_name
         self.max_tokens = max_tokens
 
+    @property
+    def responder(self) -> str:
+        """Name of the model that answered the last call (see FailoverModel)."""
+        return self.model_name
+
+    @property
+    def cache_names(self) -> List[str]:
+        """Model names whose cache entries this model may reuse."""
+        return [self.model_name]
+
+    def close(self):
+        """Release what the model holds (e.g. FailoverModel's thread pool)."""
+
     @abstractmethod
     def generate_text(
         self, prompt: str, response_format: Optional[Type[BaseModel]] = None
@@ -19,68 +31,69 @@ class BaseAIModel(ABC):
         """Generate text from the model with the given prompt."""
         pass
 
-    def clean_json_text(self, text: str | None) -> str | None:
-        """Clean and fix common JSON formatting issues."""
-        if not text:
-            return None
-
-        try:
-            data = json.loads(text)
-            # if the first key is the expected one, return the text directly
-            if isinstance(data, dict) and (
-                "predictions" in data or "is_noisy" in data or "themes" in data
-            ):
-                return json.dumps(data)
-
-            # if we don't have the key at the top level, then look for it as a value
-            if isinstance(data, dict):
-                for key, value in data.items():
-                    if isinstance(value, dict) and (
-                        "predictions" in value
-                        or "is_noisy" in value
-                        or "themes" in value
-                    ):
-                        return json.dumps(value)
-                    if isinstance(value, dict):
-                        for k, v in value.items():
-                            if isinstance(v, dict) and (
-                                "predictions" in v or "is_noisy" in v or "themes" in v
-                            ):
-                                return json.dumps(v)
-
-        except json.JSONDecodeError:
-            # Remove markdown code block markers
-            text = re.sub(r"```(?:json)?\n?(.*?)```", r"\1", text, flags=re.DOTALL)
-
-            # Remove any non-JSON text before or after the JSON content
-            text = re.sub(r"^[^{\[]*", "", text)
-            text = re.sub(r"[^}\]]*$", "", text)
-
-            # Fix common formatting issues
-            text = text.replace("'", '"')  # Replace single quotes with double quotes
-            text = re.sub(r"//.*?\n", "\n", text)  # Remove single-line comments
-            text = re.sub(
-                r"/\*.*?\*/", "", text, flags=re.DOTALL
-            )  # Remove multi-line comments
-
-            # Remove any invalid escape characters
-            text = re.sub(
-                r'\\([^\/"bfnrtu])', r"\1", text
-            )  # Remove invalid escape sequences
-
-            # Attempt to fix escaped characters
-            text = text.replace('\\"', '"')  # fix escaped double quotes
+    def parse_response(
+        self, text: str | None, response_format: Type[BaseModel]
+    ) -> Optional[BaseModel]:
+        """Parse (and if necessary repair) a JSON response into the schema."""
+        return parse_response(text, response_format)
 
-            # Fix extra commas or other basic syntax issues.
-            text = re.sub(r",\s*([}\]])", r"\1", text)  # remove trailing commas
+    def stream_text(
+        self, prompt: str, response_format: Optional[Type[BaseModel]] = None
+    ) -> Iterator[str]:
+        """Yield the raw response text in chunks as the provider streams it."""
+        raise NotImplementedError(f"{type(self).__name__} does not support streaming")
 
+    def call_streaming(
+        self,
+        prompt: str,
+        response_format: Type[BaseModel],
+        retry_count: int = 3,
+        retry_delay: int = 1,
+        retry_backoff_factor: int = 2,
+    ) -> Iterator[BaseModel]:
+        """Yield the items of the response's list field (predictions, themes)
+        as soon as each one is complete in the stream.
+
+        Failed attempts are retried only while nothing has been yielded yet; a
+        stream that breaks off later keeps the items completed so far. Models
+        without streaming support fall back to call_with_retry.
+        """
+        current_delay = retry_delay
+        for attempt in range(retry_count):
+            parser = IncrementalItemParser(response_format)
             try:
-                json.loads(text)
-                return text.strip()
-            except json.JSONDecodeError:
-                return None
+                for chunk in self.stream_text(prompt, response_format):
+                    yield from parser.feed(chunk)
+            except NotImplementedError:
+                response = self.call_with_retry(
+                    prompt,
+                    retry_count=retry_count,
+                    retry_delay=retry_delay,
+                    retry_backoff_factor=retry_backoff_factor,
+                    response_format=response_format,
+                )
+                if response:
+                    yield from getattr(response, parser.field_name)
+                return
+            except Exception as e:
+                if parser.emitted:
+                    print(f"Stream interrupted after {parser.emitted} items: {e}")
+                    return
+                if attempt == retry_count - 1:
+                    print(f"Failed after {retry_count} attempts. Error: {str(e)}")
+                    return
+                print(
+                    f"Attempt {attempt + 1} failed. Retrying in {current_delay} seconds..."
+                )
+                time.sleep(current_delay)
+                current_delay *= retry_backoff_factor
+                continue
 
-        return None
+            yield from parser.finish()
+            if parser.complete or parser.emitted or attempt == retry_count - 1:
+                return
+            time.sleep(current_delay)
+            current_delay *= retry_backoff_factor
 
     def call_with_retry(
         self,
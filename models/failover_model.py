@@ -0,0 +1,192 @@
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Dict, Iterator, List, Optional, Type
+import numpy as np
+from litellm import RateLimitError
+from pydantic import BaseModel
+from .base_model import BaseAIModel
+from .litellm_model import LiteLLMModel
+
+
+class FailoverModel(BaseAIModel):
+    """Wraps a chain of models with per-call deadlines, hedged requests and
+    failover.
+
+    Every call goes to the first model of the chain. When it has not answered
+    after the model's observed latency quantile (p95 by default), one
+    duplicate request is sent and the first answer wins. A model that fails,
+    is rate limited or misses the deadline hands the call to the next model
+    of the chain.
+
+    The wrapper keeps the name of the first model, so outputs and cache
+    entries of a run without failover are unchanged. `responder` tells which
+    model answered the last call of the current thread: callers save cache
+    entries under it and load them from any model of `cache_names`.
+    """
+
+    def __init__(
+        self,
+        models: List[BaseAIModel],
+        deadline: Optional[float] = 120.0,
+        hedge_quantile: Optional[float] = 0.95,
+        hedge_min_samples: int = 20,
+        min_hedge_delay: float = 1.0,
+        latency_window: int = 200,
+    ):
+        if not models:
+            raise ValueError("FailoverModel needs at least one model")
+        super().__init__(models[0].model_name, models[0].max_tokens)
+        self.models = models
+        self.deadline = deadline
+        self.hedge_quantile = hedge_quantile
+        self.hedge_min_samples = hedge_min_samples
+        self.min_hedge_delay = min_hedge_delay
+        self.latencies: Dict[str, deque] = {
+            model.model_name: deque(maxlen=latency_window) for model in models
+        }
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        # abandoned calls keep a worker until they return, so the pool leaves
+        # room for a stuck call and its hedge on every model
+        self.executor = ThreadPoolExecutor(max_workers=4 * len(models))
+        for model in models:
+            # let litellm give up on calls the wrapper stopped waiting for
+            if isinstance(model, LiteLLMModel) and deadline and not model.timeout:
+                model.timeout = deadline
+
+    def close(self):
+        """Shut down the thread pool without waiting for abandoned calls."""
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+    @property
+    def responder(self) -> str:
+        return getattr(self.local, "responder", self.model_name)
+
+    @property
+    def cache_names(self) -> List[str]:
+        return [model.model_name for model in self.models]
+
+    def hedge_delay(self, model: BaseAIModel) -> Optional[float]:
+        """Seconds after which a duplicate request is sent (None: no hedge)."""
+        if self.hedge_quantile is None:
+            return None
+        with self.lock:
+            samples = list(self.latencies[model.model_name])
+        if len(samples) < self.hedge_min_samples:
+            return None
+        return max(
+            self.min_hedge_delay, float(np.quantile(samples, self.hedge_quantile))
+        )
+
+    def _timed_call(
+        self,
+        model: BaseAIModel,
+        prompt: str,
+        response_format: Optional[Type[BaseModel]],
+    ):
+        start = time.monotonic()
+        response = model.generate_text(prompt, response_format)
+        if response:
+            with self.lock:
+                self.latencies[model.model_name].append(time.monotonic() - start)
+        return response
+
+    def _call_hedged(
+        self,
+        model: BaseAIModel,
+        prompt: str,
+        response_format: Optional[Type[BaseModel]],
+    ):
+        """Call one model with a deadline and at most one hedged duplicate.
+        Returns None on a miss; re-raises the error of a failed call."""
+        start = time.monotonic()
+        hedge_at = self.hedge_delay(model)
+        pending = {
+            self.executor.submit(self._timed_call, model, prompt, response_format)
+        }
+        error = None
+        while pending:
+            elapsed = time.monotonic() - start
+            timeouts = []
+            if self.deadline:
+                timeouts.append(self.deadline - elapsed)
+            if hedge_at is not None:
+                timeouts.append(hedge_at - elapsed)
+            done, pending = wait(
+                pending,
+                timeout=max(0.0, min(timeouts)) if timeouts else None,
+                return_when=FIRST_COMPLETED,
+            )
+            for future in done:
+                try:
+                    response = future.result()
+                except Exception as e:
+                    error = e
+                    continue
+                if response:
+                    return response
+            elapsed = time.monotonic() - start
+            if self.deadline and elapsed >= self.deadline:
+                print(f"{model.model_name} missed the {self.deadline}s deadline")
+                return None
+            if hedge_at is not None and elapsed >= hedge_at:
+                print(f"Hedging a request to {model.model_name} after {elapsed:.1f}s")
+                pending.add(
+                    self.executor.submit(
+                        self._timed_call, model, prompt, response_format
+                    )
+                )
+                hedge_at = None
+        if error:
+            raise error
+        return None
+
+    def generate_text(
+        self, prompt: str, response_format: Optional[Type[BaseModel]] = None
+    ) -> Optional[BaseModel]:
+        rate_limited = None
+        for model in self.models:
+            try:
+                response = self._call_hedged(model, prompt, response_format)
+            except RateLimitError as e:
+                rate_limited = e
+                response = None
+            except Exception as e:
+                print(f"Error generating text with {model.model_name}: {e}")
+                response = None
+            if response:
+                self.local.responder = model.model_name
+                return response
+            if model is not self.models[-1]:
+                print(f"Failing over from {model.model_name}")
+        self.local.responder = self.model_name
+        if rate_limited:
+            # every model is limited, so let call_with_retry back off
+            raise rate_limited
+        return None
+
+    def stream_text(
+        self, prompt: str, response_format: Optional[Type[BaseModel]] = None
+    ) -> Iterator[str]:
+        """Stream from the first model that starts answering. Streams are not
+        hedged; their deadline is the litellm timeout of each model."""
+        error = None
+        for model in self.models:
+            try:
+                chunks = model.stream_text(prompt, response_format)
+                first = next(chunks)
+            except StopIteration:
+                continue
+            except Exception as e:
+                error = e
+                print(f"Failing over from {model.model_name}: {e}")
+                continue
+            self.local.responder = model.model_name
+            yield first
+            yield from chunks
+            return
+        self.local.responder = self.model_name
+        if error:
+            raise error
@@ -0,0 +1,89 @@
+from litellm import completion, RateLimitError
+from .base_model import BaseAIModel
+import os
+from pydantic import BaseModel
+from typing import Iterator, Optional, Type
+
+
+class LiteLLMModel(BaseAIModel):
+    """Configurable provider that talks to any backend litellm can route to.
+
+    The provider specific classes only differ in the litellm prefix of the
+    model name and the environment variable holding the API key, so they are
+    thin subclasses of this one. Passing ``api_base`` targets any
+    OpenAI-compatible server, e.g. a local Ollama, vLLM or the stand-in server
+    in ``stub_server.py``.
+    """
+
+    provider_label = "LiteLLM"
+
+    def __init__(
+        self,
+        model_name: str,
+        provider: Optional[str] = None,
+        api_key_env: Optional[str] = None,
+        api_key: Optional[str] = None,
+        api_base: Optional[str] = None,
+        max_tokens: int = 4000,
+        timeout: Optional[float] = None,
+        num_retries: int = 3,
+    ):
+        super().__init__(
+            f"{provider}/{model_name}" if provider else model_name, max_tokens
+        )
+        self.api_base = api_base
+        self.timeout = timeout
+        self.num_retries = num_retries
+        self.api_key = api_key or (os.getenv(api_key_env) if api_key_env else None)
+        if api_key_env and not self.api_key:
+            raise ValueError(f"{api_key_env} environment variable not set")
+
+    def completion_kwargs(
+        self, prompt: str, response_format: Optional[Type[BaseModel]] = None
+    ) -> dict:
+        """Build the keyword arguments for a litellm completion call."""
+        kwargs = {
+            "model": self.model_name,
+            "messages": [{"role": "user", "content": prompt}],
+            "max_tokens": self.max_tokens,
+            "num_retries": self.num_retries,
+        }
+        if self.api_key:
+            kwargs["api_key"] = self.api_key
+        if self.api_base:
+            kwargs["api_base"] = self.api_base
+        if self.timeout:
+            kwargs["timeout"] = self.timeout
+        if response_format:
+            kwargs["response_format"] = {"type": "json_object"}
+        return kwargs
+
+    def generate_text(
+        self, prompt: str, response_format: Optional[Type[BaseModel]] = None
+    ) -> Optional[BaseModel]:
+        try:
+            response = completion(**self.completion_kwargs(prompt, response_format))
+            if response and response.choices and response.choices[0].message.content:
+                if not response_format:
+                    return response.choices[0].message.content
+                return self.parse_response(
+                    response.choices[0].message.content, response_format
+                )
+            else:
+                return None
+        except RateLimitError:
+            # let call_with_retry apply its backoff instead of swallowing the 429
+            raise
+        except Exception as e:
+            print(f"Error generating text with {self.provider_label}: {e}")
+            return None
+
+    def stream_text(
+        self, prompt: str, response_format: Optional[Type[BaseModel]] = None
+    ) -> Iterator[str]:
+        response = completion(
+            **self.completion_kwargs(prompt, response_format), stream=True
+        )
+        for chunk in response:
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
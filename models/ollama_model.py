@@ -1,15 +1,14 @@
-from litellm import completion
-from .base_model import BaseAIModel
+from .litellm_model import LiteLLMModel
+import os
 
-class OllamaModel(BaseAIModel):
-    def __init__(self, model_name: str = "llama2:13b", max_tokens: int = 4000):
-        super().__init__(model_name, max_tokens)
 
-    def generate_text(self, prompt: str) -> str:
-        response = completion(
-            model=f"ollama/{self.model_name}",
-            messages=[{"role": "user", "content": prompt}],
-            max_tokens=self.max_tokens,
-            num_retries=3
+class OllamaModel(LiteLLMModel):
+    provider_label = "Ollama"
+
+    def __init__(self, model_name: str = "llama2:13b", max_tokens: int = 4000):
+        super().__init__(
+            model_name,
+            provider="ollama",
+            api_base=os.getenv("OLLAMA_API_BASE", "http://localhost:11434"),
+            max_tokens=max_tokens,
         )
-        return response.choices[0].message.content
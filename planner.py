@@ -0,0 +1,565 @@
+"""Dry-run planner: projected calls, tokens, cost and wall time of a run.
+
+plan_run walks the batches run_analysis_for_model would send, without calling
+a model. Cache hits come from the CacheManager. The prompts of the misses are
+rendered from prompts.py and counted with litellm's tokenizer. The output of
+the misses is extrapolated from the cached answers of the same step, or from
+DEFAULT_OUTPUT_TOKENS when nothing is cached yet. The theme step is planned
+exactly once every prediction is cached. Before that it is estimated from
+the expected number of predictions.
+
+    python run_analysis.py --model openai --plan --batch-size 10 --concurrency 4
+"""
+
+import json
+import math
+from typing import Dict, List, Optional, Tuple
+
+import litellm
+
+from analyse_predictions import (
+    chunk_prompt_data,
+    cluster_predictions,
+    comment_cache_key,
+    comment_sub_batch,
+    deduplicate_predictions,
+    load_comment_results,
+    format_comment_batch,
+    make_comment_batches,
+    prepare_comments,
+    single_comment_keys,
+)
+from cache_manager import CacheManager
+from models import BaseAIModel
+from prompts import (
+    EVALUATE_PREDICTIONS_PROMPT,
+    FILTER_AND_EXTRACT_PROMPT,
+    FILTER_NOISY_COMMENTS_PROMPT,
+    IDENTIFY_THEMES_PROMPT,
+)
+from records import CommentRecord, predictions_from_cache
+
+BATCH_SIZE_CANDIDATES = (1, 2, 5, 10, 20, 30, 50)
+# output tokens per input item when no answer of the step is cached yet:
+# per comment for filter/extract/fused, per prediction for theme
+DEFAULT_OUTPUT_TOKENS = {"filter": 3, "extract": 60, "fused": 65, "theme": 25}
+DEFAULT_PREDICTIONS_PER_COMMENT = 0.5
+DEFAULT_PREDICTION_TOKENS = 25
+# rough HDBSCAN cluster size, used while the predictions are unknown
+PREDICTIONS_PER_CLUSTER = 5
+# latency model of one call: fixed overhead plus generation time
+SECONDS_PER_CALL = 1.0
+OUTPUT_TOKENS_PER_SECOND = 60.0
+# share of the model's max_tokens one batch's answer may fill
+OUTPUT_HEADROOM = 0.5
+
+PROMPTS = {
+    "filter": FILTER_NOISY_COMMENTS_PROMPT,
+    "extract": EVALUATE_PREDICTIONS_PROMPT,
+    "fused": FILTER_AND_EXTRACT_PROMPT,
+}
+
+
+def count_tokens(model_name: str, text: str) -> int:
+    """Token count of text for the model (about 4 characters per token when
+    litellm has no tokenizer for it)."""
+    try:
+        return litellm.token_counter(model=model_name, text=text)
+    except Exception:
+        return len(text) // 4
+
+
+def estimate_cost(
+    model_name: str, input_tokens: int, output_tokens: int
+) -> Optional[float]:
+    """USD cost from litellm's price list; None for unknown models."""
+    try:
+        input_cost, output_cost = litellm.cost_per_token(
+            model=model_name,
+            prompt_tokens=input_tokens,
+            completion_tokens=output_tokens,
+        )
+    except Exception:
+        return None
+    return input_cost + output_cost
+
+
+def estimate_seconds(
+    calls: int,
+    input_tokens: int,
+    output_tokens: int,
+    concurrency: int = 1,
+    rpm: Optional[int] = None,
+    tpm: Optional[int] = None,
+) -> float:
+    """Wall time of the calls at the given concurrency, but no faster than
+    the requests/tokens per minute limits allow."""
+    seconds = (
+        calls * SECONDS_PER_CALL + output_tokens / OUTPUT_TOKENS_PER_SECOND
+    ) / max(1, concurrency)
+    if rpm:
+        seconds = max(seconds, 60.0 * calls / rpm)
+    if tpm:
+        seconds = max(seconds, 60.0 * (input_tokens + output_tokens) / tpm)
+    return seconds
+
+
+class StepPlan:
+    """Cache hits and misses of one pipeline step."""
+
+    def __init__(self, step: str):
+        self.step = step
+        self.calls = 0
+        self.cached = 0
+        self.input_tokens = 0
+        self.missed_items = 0
+        # output tokens and items of the cached answers, for extrapolation
+        self.cached_output_tokens = 0
+        self.cached_items = 0
+        self.exact = True
+
+    def hit(self, model_name: str, cached, items: int):
+        self.cached += 1
+        self.cached_output_tokens += count_tokens(model_name, json.dumps(cached))
+        self.cached_items += items
+
+    def miss(self, input_tokens: int, items: int):
+        self.calls += 1
+        self.input_tokens += input_tokens
+        self.missed_items += items
+
+    @property
+    def output_rate(self) -> float:
+        """Output tokens per item (comment or prediction)."""
+        if self.cached_items:
+            return self.cached_output_tokens / self.cached_items
+        return DEFAULT_OUTPUT_TOKENS[self.step]
+
+    @property
+    def output_tokens(self) -> int:
+        return round(self.missed_items * self.output_rate)
+
+
+def _comment_prompt(step: str, batch, context) -> str:
+    context_section, comment_lines = format_comment_batch(batch, context)
+    return PROMPTS[step].format(context=context_section, comments=comment_lines)
+
+
+def _cached_batch_predictions(
+    model: BaseAIModel, cache_manager: CacheManager, batch, context
+) -> Optional[List]:
+    """Read-only version of the lookup in load_batch_predictions."""
+    cached = cache_manager.load_cache(
+        model.cache_names, "predictions", comment_cache_key(batch, context)
+    )
+    if cached is not None:
+        return cached
+    per_comment = [
+        cache_manager.load_cache(model.cache_names, "predictions", key)
+        for key in single_comment_keys(batch, context)
+    ]
+    if any(predictions is None for predictions in per_comment):
+        return None
+    return [p for predictions in per_comment for p in predictions]
+
+
+def _plan_comment_steps(
+    model: BaseAIModel,
+    comment_objs: List[CommentRecord],
+    cache_manager: CacheManager,
+    batch_size: int,
+    batching: str,
+    fused: bool,
+) -> Tuple[List[StepPlan], List[Dict], int, float]:
+    """Plan the filter and extract steps (or the fused step).
+
+    Comments of uncached filter batches count as kept, so the extract step
+    is an upper bound until the filter step is cached.
+
+    Returns:
+        The step plans, the cached predictions, the number of kept comments
+        whose predictions are not cached and the share of comments kept by
+        the cached filter answers.
+    """
+    name = model.model_name
+    predictions, unknown = [], 0
+
+    if fused:
+        step = StepPlan("fused")
+        for batch, context in make_comment_batches(comment_objs, batch_size, batching):
+            flags = cache_manager.load_cache(
+                model.cache_names, "noisy_comments", comment_cache_key(batch, context)
+            )
+            cached = None
+            if flags:
+                cached = [
+                    (
+                        []
+                        if is_noisy
+                        else cache_manager.load_cache(
+                            model.cache_names, "predictions", key
+                        )
+                    )
+                    for is_noisy, key in zip(flags, single_comment_keys(batch, context))
+                ]
+            if cached is not None and all(p is not None for p in cached):
+                step.hit(name, [flags, cached], len(batch))
+                predictions.extend(p for comment in cached for p in comment)
+                continue
+            # per-comment entries (e.g. of a preview run) leave only the
+            # other comments of the batch to send
+            known = (
+                load_comment_results(
+                    single_comment_keys(batch, context), model, cache_manager
+                )
+                if len(batch) > 1
+                else [None]
+            )
+            missing = [i for i, result in enumerate(known) if result is None]
+            if len(missing) < len(batch):
+                step.hit(
+                    name,
+                    [[p.to_dict() for p in r[1]] for r in known if r],
+                    len(batch) - len(missing),
+                )
+                predictions.extend(p.to_dict() for r in known if r for p in r[1])
+            if missing:
+                sub_batch, sub_context = comment_sub_batch(batch, context, missing)
+                step.miss(
+                    count_tokens(
+                        name, _comment_prompt("fused", sub_batch, sub_context)
+                    ),
+                    len(sub_batch),
+                )
+                unknown += len(sub_batch)
+        return [step], predictions, unknown, 1.0
+
+    filter_step = StepPlan("filter")
+    kept = []
+    kept_cached = 0
+    for batch, context in make_comment_batches(comment_objs, batch_size, batching):
+        flags = cache_manager.load_cache(
+            model.cache_names, "noisy_comments", comment_cache_key(batch, context)
+        )
+        if flags:
+            filter_step.hit(name, flags, len(batch))
+            kept.extend(c for c, is_noisy in zip(batch, flags) if not is_noisy)
+            kept_cached += flags.count(False)
+            continue
+        # per-comment flags (e.g. of a preview run) leave only the other
+        # comments of the batch to classify
+        known = [
+            (
+                cache_manager.load_cache(model.cache_names, "noisy_comments", key)
+                if len(batch) > 1
+                else None
+            )
+            for key in single_comment_keys(batch, context)
+        ]
+        missing = [i for i, flags in enumerate(known) if not flags]
+        if len(missing) < len(batch):
+            known_flags = [flags[0] for flags in known if flags]
+            filter_step.hit(name, known_flags, len(known_flags))
+            kept_cached += known_flags.count(False)
+        if missing:
+            sub_batch, sub_context = comment_sub_batch(batch, context, missing)
+            filter_step.miss(
+                count_tokens(name, _comment_prompt("filter", sub_batch, sub_context)),
+                len(sub_batch),
+            )
+        # uncached comments count as kept
+        kept.extend(c for c, flags in zip(batch, known) if not flags or not flags[0])
+
+    extract_step = StepPlan("extract")
+    extract_step.exact = filter_step.calls == 0
+    for batch, context in make_comment_batches(
+        kept, batch_size, batching, lookup=comment_objs
+    ):
+        cached = _cached_batch_predictions(model, cache_manager, batch, context)
+        if cached is not None:
+            extract_step.hit(name, cached, len(batch))
+            predictions.extend(cached)
+        else:
+            extract_step.miss(
+                count_tokens(name, _comment_prompt("extract", batch, context)),
+                len(batch),
+            )
+            unknown += len(batch)
+    kept_fraction = (
+        kept_cached / filter_step.cached_items if filter_step.cached_items else 1.0
+    )
+    return [filter_step, extract_step], predictions, unknown, kept_fraction
+
+
+def _plan_theme_step(
+    model: BaseAIModel,
+    cache_manager: CacheManager,
+    predictions: List[Dict],
+    unknown_comments: int,
+    predictions_per_comment: float,
+    dedup_threshold: Optional[float],
+) -> StepPlan:
+    """Plan the map calls of identify_themes (the few reduce merges are not
+    counted). Exact when every prediction is cached."""
+    name = model.model_name
+    step = StepPlan("theme")
+    records = predictions_from_cache(predictions)
+
+    if not unknown_comments:
+        embeddings = None
+        if dedup_threshold is not None and records:
+            records, embeddings = deduplicate_predictions(records, dedup_threshold)
+        clusters = (
+            cluster_predictions(records, embeddings=embeddings) if records else {}
+        )
+        for predictions_in_cluster in clusters.values():
+            for chunk in chunk_prompt_data(
+                [p.prediction for p in predictions_in_cluster]
+            ):
+                cached = cache_manager.load_cache(
+                    model.cache_names, "cluster_themes", chunk
+                )
+                if cached:
+                    step.hit(name, cached, len(chunk))
+                else:
+                    prompt = IDENTIFY_THEMES_PROMPT.format(
+                        predictions_and_evaluations="\n".join(chunk)
+                    )
+                    step.miss(count_tokens(name, prompt), len(chunk))
+        return step
+
+    step.exact = False
+    expected = len(records) + round(unknown_comments * predictions_per_comment)
+    prediction_tokens = (
+        sum(count_tokens(name, p.prediction) for p in records) / len(records)
+        if records
+        else DEFAULT_PREDICTION_TOKENS
+    )
+    overhead = count_tokens(
+        name, IDENTIFY_THEMES_PROMPT.format(predictions_and_evaluations="")
+    )
+    calls = math.ceil(expected / PREDICTIONS_PER_CLUSTER)
+    step.calls = calls
+    step.input_tokens = round(calls * overhead + expected * prediction_tokens)
+    step.missed_items = expected
+    return step
+
+
+def recommend_batch_size(
+    model: BaseAIModel,
+    comment_objs: List[CommentRecord],
+    batching: str,
+    fused: bool,
+    kept_fraction: float,
+    output_rates: Dict[str, float],
+    concurrency: int = 1,
+    rpm: Optional[int] = None,
+    tpm: Optional[int] = None,
+    candidates=BATCH_SIZE_CANDIDATES,
+) -> Tuple[Optional[int], List[Dict]]:
+    """Compare batch sizes for a run from scratch (batch cache keys depend on
+    the batch size).
+
+    A batch size is feasible when the expected answer of its largest batch
+    fits in OUTPUT_HEADROOM of the model's max_tokens. Of the feasible sizes
+    the cheapest wins (fewest tokens for models without a price), then the
+    fastest.
+
+    Returns:
+        The recommended batch size (None if none is feasible) and one row
+        per candidate.
+    """
+    name = model.model_name
+    tokens = {id(c): count_tokens(name, c.text) + 1 for c in comment_objs}
+    overheads = {
+        step: count_tokens(name, prompt.format(context="", comments=""))
+        for step, prompt in PROMPTS.items()
+    }
+    steps = ["fused"] if fused else ["filter", "extract"]
+    output_limit = model.max_tokens * OUTPUT_HEADROOM
+
+    rows = []
+    for batch_size in candidates:
+        batches = make_comment_batches(comment_objs, batch_size, batching)
+        comment_tokens = sum(tokens.values())
+        # replies repeat their parent's text once per batch as context
+        context_tokens = sum(
+            tokens[id(c)] for _, context in batches for c in context or []
+        )
+        calls, input_tokens, output_tokens, largest = 0, 0, 0, 0
+        for step in steps:
+            share = kept_fraction if step == "extract" else 1.0
+            step_calls = math.ceil(len(batches) * share)
+            calls += step_calls
+            input_tokens += round(
+                step_calls * overheads[step] + share * (comment_tokens + context_tokens)
+            )
+            output_tokens += round(share * len(comment_objs) * output_rates[step])
+            largest = max(largest, batch_size * output_rates[step])
+        rows.append(
+            {
+                "batch_size": batch_size,
+                "calls": calls,
+                "input_tokens": input_tokens,
+                "output_tokens": output_tokens,
+                "cost": estimate_cost(name, input_tokens, output_tokens),
+                "seconds": estimate_seconds(
+                    calls, input_tokens, output_tokens, concurrency, rpm, tpm
+                ),
+                "feasible": largest <= output_limit,
+            }
+        )
+
+    feasible = [row for row in rows if row["feasible"]]
+    if not feasible:
+        return None, rows
+    best = min(
+        feasible,
+        key=lambda row: (
+            row["cost"] if row["cost"] is not None else 0.0,
+            row["input_tokens"] + row["output_tokens"],
+            row["seconds"],
+        ),
+    )
+    return best["batch_size"], rows
+
+
+def plan_run(
+    model: BaseAIModel,
+    comments,
+    cache_manager: CacheManager,
+    batch_size: int = 5,
+    batching: str = "page",
+    fused: bool = False,
+    dedup_threshold: Optional[float] = 0.92,
+    concurrency: int = 1,
+    rpm: Optional[int] = None,
+    tpm: Optional[int] = None,
+) -> Dict:
+    """Project the calls, tokens, cost and wall time of run_analysis_for_model
+    with the same arguments, without calling the model.
+
+    `concurrency` is the number of calls in flight; `rpm`/`tpm` are the
+    provider's requests and tokens per minute limits.
+    """
+    comment_objs = prepare_comments(comments)
+    steps, predictions, unknown, kept_fraction = _plan_comment_steps(
+        model, comment_objs, cache_manager, batch_size, batching, fused
+    )
+    extract_step = steps[-1]
+    predictions_per_comment = (
+        len(predictions) / extract_step.cached_items
+        if extract_step.cached_items
+        else DEFAULT_PREDICTIONS_PER_COMMENT
+    )
+    steps.append(
+        _plan_theme_step(
+            model,
+            cache_manager,
+            predictions,
+            unknown,
+            predictions_per_comment,
+            dedup_threshold,
+        )
+    )
+
+    rows = []
+    for step in steps:
+        rows.append(
+            {
+                "step": step.step,
+                "calls": step.calls,
+                "cached": step.cached,
+                "input_tokens": step.input_tokens,
+                "output_tokens": step.output_tokens,
+                "cost": estimate_cost(
+                    model.model_name, step.input_tokens, step.output_tokens
+                ),
+                "seconds": estimate_seconds(
+                    step.calls,
+                    step.input_tokens,
+                    step.output_tokens,
+                    concurrency,
+                    rpm,
+                    tpm,
+                ),
+                "exact": step.exact,
+            }
+        )
+
+    recommended, candidates = recommend_batch_size(
+        model,
+        comment_objs,
+        batching,
+        fused,
+        kept_fraction,
+        {step.step: step.output_rate for step in steps},
+        concurrency,
+        rpm,
+        tpm,
+    )
+    return {
+        "model": model.model_name,
+        "comments": len(comment_objs),
+        "batch_size": batch_size,
+        "batching": batching,
+        "fused": fused,
+        "concurrency": concurrency,
+        "steps": rows,
+        "recommended_batch_size": recommended,
+        "batch_sizes": candidates,
+    }
+
+
+def _format_cost(cost: Optional[float]) -> str:
+    return "n/a" if cost is None else f"${cost:.2f}"
+
+
+def _format_seconds(seconds: float) -> str:
+    return f"{seconds / 60:.1f} min" if seconds >= 60 else f"{seconds:.0f} s"
+
+
+def print_plan(plan: Dict):
+    """Print the step table and the batch size comparison of a plan."""
+    print(
+        f"\nPlan for {plan['model']}: {plan['comments']} comments, batch size "
+        f"{plan['batch_size']}, {plan['batching']} batching"
+        f"{', fused' if plan['fused'] else ''}, concurrency {plan['concurrency']}"
+    )
+    print(
+        f"{'step':<8} {'calls':>7} {'cached':>7} {'input tok':>11}"
+        f" {'output tok':>11} {'cost':>9} {'time':>10}"
+    )
+    total = {"calls": 0, "cached": 0, "input_tokens": 0, "output_tokens": 0}
+    total_cost, total_seconds = 0.0, 0.0
+    for row in plan["steps"]:
+        print(
+            f"{row['step']:<8} {row['calls']:>7} {row['cached']:>7}"
+            f" {row['input_tokens']:>11,} {row['output_tokens']:>11,}"
+            f" {_format_cost(row['cost']):>9} {_format_seconds(row['seconds']):>10}"
+            f"{'' if row['exact'] else '  (estimate)'}"
+        )
+        for key in total:
+            total[key] += row[key]
+        if total_cost is not None:
+            total_cost = None if row["cost"] is None else total_cost + row["cost"]
+        total_seconds += row["seconds"]
+    print(
+        f"{'total':<8} {total['calls']:>7} {total['cached']:>7}"
+        f" {total['input_tokens']:>11,} {total['output_tokens']:>11,}"
+        f" {_format_cost(total_cost):>9} {_format_seconds(total_seconds):>10}"
+    )
+
+    print("\nBatch sizes for the comment steps of a run from scratch:")
+    for row in plan["batch_sizes"]:
+        marker = "*" if row["batch_size"] == plan["recommended_batch_size"] else " "
+        print(
+            f"{marker} {row['batch_size']:>3}: {row['calls']:>6} calls"
+            f" {row['input_tokens'] + row['output_tokens']:>11,} tokens"
+            f" {_format_cost(row['cost']):>9} {_format_seconds(row['seconds']):>10}"
+            f"{'' if row['feasible'] else '  (answers may exceed max_tokens)'}"
+        )
+    if plan["recommended_batch_size"] is None:
+        print("No batch size keeps the answers within max_tokens")
+    else:
+        print(f"Recommended batch size: {plan['recommended_batch_size']}")
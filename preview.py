@@ -0,0 +1,239 @@
+"""Preview runs: analyse a stratified sample of the comments and extrapolate.
+
+stratified_sample draws a sample that keeps the mix of reply levels (top
+level, first replies, deeper replies) and comment lengths (tertiles) of the
+thread. preview_report projects the noise rate, the number of predictions,
+the likely/maybe/unlikely proportions and the theme shares to the whole
+thread, with percentile confidence intervals from a stratified bootstrap over
+the sampled comments.
+
+The sample runs single-pass (fused), which caches every comment's noise flag
+and predictions under its own key, so a later full run only sends the
+comments the preview did not cover:
+
+    python run_analysis.py --model openai --preview --preview-fraction 0.1
+    python run_analysis.py --model openai --fused
+"""
+
+from dataclasses import dataclass, replace
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from build_site import probability_category
+from records import CommentRecord, PredictionRecord
+from schemas import ThemesList
+
+LEVEL_BUCKETS = ("top level", "reply", "deep reply")
+LENGTH_BUCKETS = ("short", "medium", "long")
+CATEGORIES = ("likely", "maybe", "unlikely")
+NO_THEME = "(no theme)"
+
+
+@dataclass
+class PreviewSample:
+    """A stratified sample: `strata[i]` is the (level, length) stratum of
+    `comments[i]` and `population` counts the thread's comments per stratum."""
+
+    comments: List[CommentRecord]
+    strata: List[Tuple[int, int]]
+    population: Dict[Tuple[int, int], int]
+    population_size: int
+
+
+def comment_strata(comments: List[CommentRecord]) -> List[Tuple[int, int]]:
+    """(reply level bucket, length tertile) of every comment."""
+    lengths = np.array([len(c.text) for c in comments], dtype=np.float64)
+    cutoffs = np.quantile(lengths, [1 / 3, 2 / 3]) if len(lengths) else []
+    length_buckets = np.searchsorted(cutoffs, lengths, side="right")
+    return [
+        (min(c.level or 0, len(LEVEL_BUCKETS) - 1), int(length_bucket))
+        for c, length_bucket in zip(comments, length_buckets)
+    ]
+
+
+def stratified_sample(
+    comments: List[CommentRecord],
+    fraction: float = 0.1,
+    seed: int = 0,
+    min_per_stratum: int = 2,
+) -> PreviewSample:
+    """Draw `fraction` of every stratum (at least `min_per_stratum` comments,
+    so each stratum can be bootstrapped) and keep the page order.
+
+    Comments without an id get their page position as id, so predictions can
+    be attributed to them.
+    """
+    if not 0 < fraction <= 1:
+        raise ValueError("The preview fraction must be in (0, 1]")
+    comments = [c if c.id else replace(c, id=str(i)) for i, c in enumerate(comments)]
+    strata = comment_strata(comments)
+    members = {}
+    for i, stratum in enumerate(strata):
+        members.setdefault(stratum, []).append(i)
+
+    rng = np.random.default_rng(seed)
+    chosen = []
+    for stratum in sorted(members):
+        indices = members[stratum]
+        size = max(round(fraction * len(indices)), min_per_stratum)
+        chosen.extend(rng.choice(indices, min(size, len(indices)), replace=False))
+    chosen.sort()
+    return PreviewSample(
+        [comments[i] for i in chosen],
+        [strata[i] for i in chosen],
+        {stratum: len(indices) for stratum, indices in members.items()},
+        len(comments),
+    )
+
+
+def theme_by_prediction(themes: Optional[ThemesList]) -> Dict[str, str]:
+    """Theme name of every prediction text, including the copies a
+    deduplicated prediction was collapsed from."""
+    names = {}
+    for theme in themes.themes if themes else []:
+        for prediction in theme.predictions:
+            names.setdefault(prediction["prediction"], theme.theme)
+            for source in prediction.get("sources") or []:
+                names.setdefault(source["prediction"], theme.theme)
+    return names
+
+
+def _interval(estimates: np.ndarray, replicates: np.ndarray, confidence: float):
+    """Point estimates with percentile intervals, one dict per column."""
+    tail = (1 - confidence) / 2 * 100
+    low, high = np.nanpercentile(replicates, [tail, 100 - tail], axis=0)
+    return [
+        {"estimate": float(e), "low": float(lo), "high": float(hi)}
+        for e, lo, hi in zip(
+            np.atleast_1d(estimates), np.atleast_1d(low), np.atleast_1d(high)
+        )
+    ]
+
+
+def preview_report(
+    sample: PreviewSample,
+    filtered_comments: List[CommentRecord],
+    predictions: List[PredictionRecord],
+    themes: Optional[ThemesList],
+    bootstrap: int = 1000,
+    confidence: float = 0.95,
+    seed: int = 0,
+) -> Dict:
+    """Extrapolate the results of a sample run to the whole thread.
+
+    Every sampled comment stands for population/sample comments of its
+    stratum. The bootstrap resamples comments within each stratum, so the
+    intervals reflect how much the estimates depend on which comments were
+    drawn. Predictions that can't be traced back to a sampled comment (from
+    batches that fell back to the two-stage calls) are left out and counted.
+    """
+    index = {c.id: i for i, c in enumerate(sample.comments)}
+    kept = {c.id for c in filtered_comments}
+    theme_names = theme_by_prediction(themes)
+    columns = list(dict.fromkeys(theme_names.values())) + [NO_THEME]
+    theme_column = {name: i for i, name in enumerate(columns)}
+
+    # per sampled comment: noisy, predictions, likely, maybe, unlikely, themes
+    counts = np.zeros((len(sample.comments), 5 + len(columns)))
+    counts[:, 0] = [c.id not in kept for c in sample.comments]
+    unattributed = 0
+    for p in predictions:
+        row = index.get(p.comment_id)
+        if row is None:
+            unattributed += 1
+            continue
+        counts[row, 1] += 1
+        counts[row, 2 + CATEGORIES.index(probability_category(p.probability))] += 1
+        theme = theme_names.get(p.prediction, NO_THEME)
+        counts[row, 5 + theme_column[theme]] += 1
+
+    rng = np.random.default_rng(seed)
+    totals = np.zeros(counts.shape[1])
+    replicates = np.zeros((bootstrap, counts.shape[1]))
+    stratum_rows = []
+    for stratum, population in sorted(sample.population.items()):
+        rows = np.array(
+            [i for i, s in enumerate(sample.strata) if s == stratum], dtype=int
+        )
+        stratum_rows.append((stratum, population, len(rows)))
+        if not len(rows):
+            continue
+        weight = population / len(rows)
+        totals += weight * counts[rows].sum(axis=0)
+        draws = rng.integers(0, len(rows), size=(bootstrap, len(rows)))
+        replicates += weight * counts[rows][draws].sum(axis=1)
+
+    def shares(values: np.ndarray) -> np.ndarray:
+        with np.errstate(divide="ignore", invalid="ignore"):
+            return values[..., 2:] / values[..., 1:2]
+
+    categories = _interval(shares(totals)[:3], shares(replicates)[:, :3], confidence)
+    theme_shares = _interval(shares(totals)[3:], shares(replicates)[:, 3:], confidence)
+    theme_rows = [
+        {"name": name, **share}
+        for name, share in zip(columns, theme_shares)
+        if name != NO_THEME or counts[:, -1].any()
+    ]
+    return {
+        "population": sample.population_size,
+        "sample": len(sample.comments),
+        "strata": [
+            {
+                "level": LEVEL_BUCKETS[level],
+                "length": LENGTH_BUCKETS[length],
+                "population": population,
+                "sample": size,
+            }
+            for (level, length), population, size in stratum_rows
+        ],
+        "bootstrap": bootstrap,
+        "confidence": confidence,
+        "noise_rate": _interval(
+            totals[0] / sample.population_size,
+            replicates[:, 0] / sample.population_size,
+            confidence,
+        )[0],
+        "predictions": _interval(totals[1], replicates[:, 1], confidence)[0],
+        "probability": dict(zip(CATEGORIES, categories)),
+        "themes": sorted(theme_rows, key=lambda row: -np.nan_to_num(row["estimate"])),
+        "unattributed_predictions": unattributed,
+    }
+
+
+def _format_interval(interval: Dict, percent: bool = True) -> str:
+    if percent:
+        return (
+            f"{interval['estimate']:.1%} "
+            f"({interval['low']:.1%} - {interval['high']:.1%})"
+        )
+    return (
+        f"{interval['estimate']:,.0f} "
+        f"({interval['low']:,.0f} - {interval['high']:,.0f})"
+    )
+
+
+def print_preview(report: Dict):
+    """Print the projections of a preview report with their intervals."""
+    print(
+        f"\nPreview of {report['sample']} of {report['population']} comments, "
+        f"{report['confidence']:.0%} intervals from {report['bootstrap']} "
+        "bootstrap resamples"
+    )
+    for stratum in report["strata"]:
+        print(
+            f"  {stratum['level']:<10} {stratum['length']:<6}"
+            f" {stratum['sample']:>5} of {stratum['population']:>5}"
+        )
+    print(f"Noise rate:  {_format_interval(report['noise_rate'])}")
+    print(f"Predictions: {_format_interval(report['predictions'], percent=False)}")
+    for category, interval in report["probability"].items():
+        print(f"  {category:<9} {_format_interval(interval)}")
+    print("Theme shares:")
+    for theme in report["themes"]:
+        print(f"  {_format_interval(theme):<26} {theme['name']}")
+    if report["unattributed_predictions"]:
+        print(
+            f"{report['unattributed_predictions']} predictions could not be "
+            "traced to a comment and were left out"
+        )
@@ -23,7 +23,7 @@ Respond with a JSON object in the following format:
 where the booleans correspond to the input comments in order and `true` means noisy, `false` is not noisy.
 
 Do not include any explanation or code.
-
+{context}
 Comments to Evaluate:
 {comments}
 """
@@ -40,7 +40,46 @@ You are an expert in extracting and evaluating predictions made by the participa
         }}
     ]
 }}
+{context}
+Comments to Evaluate:
+{comments}
+"""
+
+FILTER_AND_EXTRACT_PROMPT = """
+You are an expert at identifying relevant comments in an online discussion and at extracting and evaluating the predictions they make about the future. For each comment, first decide whether it is "noisy" or "not noisy" based on these criteria:
 
+**Noisy Comments:**
+*   Sarcastic or joking comments.
+*   Meta-comments about the discussion itself or other comments.
+*   Comments that only contain URLs.
+*   Comments that are generic statements or observations unrelated to specific future events.
+*   Short replies or exchanges not directly making a prediction.
+*   Comments expressing opinions or beliefs without predicting a concrete future outcome.
+
+**Not Noisy Comments:**
+*   Comments that make a *specific and testable* prediction about a future event or outcome.
+*   Comments that predict a concrete future state related to real-world things or trends.
+
+For every comment that is not noisy, extract its unique predictions and analyze the likelihood of each prediction coming true. Noisy comments have an empty list of predictions.
+
+Respond with a JSON object in the following format, with exactly one entry per input comment, in the same order as the input:
+{{
+    "comments": [
+        {{
+            "is_noisy": false,
+            "predictions": [
+                {{
+                    "prediction": "verbatim prediction from the comment",
+                    "probability": 0.75,  # Estimated probability between 0 and 1
+                    "justification": "Brief explanation of the probability assessment"
+                }}
+            ]
+        }}
+    ]
+}}
+
+Do not include any explanation or code.
+{context}
 Comments to Evaluate:
 {comments}
 """
@@ -69,3 +108,32 @@ Respond with a JSON object in the following format:
 Predictions and evaluations:
 {predictions_and_evaluations}
 """
+
+MERGE_THEMES_PROMPT = """
+You are an expert at organizing themes into a taxonomy. The following themes were identified independently in different parts of a collection of predictions and describe overlapping topics.
+
+Combine them into a single theme with:
+1. A short descriptive name
+2. A brief summary of what the combined theme encompasses
+
+Respond with a JSON object in the following format:
+{{
+    "theme": "Theme name",
+    "summary": "Brief theme description"
+}}
+
+Themes:
+{themes}
+"""
+
+PARENT_CONTEXT_PROMPT = """
+Context: earlier comments that some of the comments below reply to. Replies are marked with [reply to cN]. Use this context to understand the replies, but do not evaluate or extract predictions from the context comments themselves.
+{context}
+"""
+
+# the theme IDENTIFY_THEMES_PROMPT asks for statements that don't fit a theme;
+# all of them are folded into one theme with this summary
+OTHER_THEME = "Other"
+OTHER_SUMMARY = (
+    "Other miscellaneous predictions that don't fit into the main categories."
+)
@@ -0,0 +1,114 @@
+"""Compact internal records for comments and predictions.
+
+The pipeline passes these slotted dataclasses between its steps instead of
+dicts or pydantic models. Pydantic stays at the boundaries: LLM responses are
+parsed into the schemas in schemas.py and converted here, and caches and
+serialized outputs store the plain dicts from ``to_dict``.
+"""
+
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Union
+
+
+@dataclass(slots=True)
+class CommentRecord:
+    """A comment of the thread; id/parent/level are set for fetched threads."""
+
+    text: str
+    id: Optional[str] = None
+    parent: Optional[str] = None
+    level: Optional[int] = None
+
+    @classmethod
+    def from_raw(cls, comment: Union[Dict, str, "CommentRecord"]):
+        """Build a record from a string, a fetched comment dict or a record;
+        returns None for entries without text."""
+        if isinstance(comment, cls):
+            return comment
+        if isinstance(comment, str):
+            return cls(comment)
+        if isinstance(comment, dict) and "text" in comment:
+            return cls(
+                comment.get("text", ""),
+                comment.get("id"),
+                comment.get("parent"),
+                comment.get("level"),
+            )
+        return None
+
+    def to_dict(self) -> Dict:
+        """Plain dict for JSON files such as batch job manifests."""
+        data = {"text": self.text}
+        for key in ("id", "parent", "level"):
+            value = getattr(self, key)
+            if value is not None:
+                data[key] = value
+        return data
+
+
+@dataclass(slots=True)
+class PredictionRecord:
+    """An evaluated prediction. `sources` lists the predictions it was
+    collapsed from (see deduplicate_predictions); `answered_by` names the
+    fallback model that extracted it when the run's model failed over."""
+
+    prediction: str
+    probability: float
+    justification: str
+    comment_id: Optional[str] = None
+    sources: Optional[List["PredictionRecord"]] = None
+    answered_by: Optional[str] = None
+
+    @classmethod
+    def from_dict(cls, data: Union[Dict, "PredictionRecord"]) -> "PredictionRecord":
+        if isinstance(data, cls):
+            return data
+        sources = data.get("sources")
+        return cls(
+            data["prediction"],
+            float(data["probability"]),
+            data.get("justification", ""),
+            data.get("comment_id"),
+            [cls.from_dict(s) for s in sources] if sources else None,
+            data.get("answered_by"),
+        )
+
+    @classmethod
+    def from_model(
+        cls, prediction, answered_by: Optional[str] = None
+    ) -> "PredictionRecord":
+        """Convert a schemas.Prediction parsed from an LLM response."""
+        return cls(
+            prediction.prediction,
+            prediction.probability,
+            prediction.justification,
+            answered_by=answered_by,
+        )
+
+    def to_dict(self) -> Dict:
+        """Plain dict for caches and serialized output (unset fields omitted)."""
+        data = {
+            "prediction": self.prediction,
+            "probability": self.probability,
+            "justification": self.justification,
+        }
+        if self.comment_id is not None:
+            data["comment_id"] = self.comment_id
+        if self.sources:
+            data["sources"] = [source.to_dict() for source in self.sources]
+        if self.answered_by is not None:
+            data["answered_by"] = self.answered_by
+        return data
+
+
+def predictions_from_cache(
+    cached: Optional[List[Dict]],
+) -> Optional[List[PredictionRecord]]:
+    """Records of a cached prediction list (None stays None)."""
+    if cached is None:
+        return None
+    return [PredictionRecord.from_dict(p) for p in cached]
+
+
+def predictions_to_cache(predictions: List[PredictionRecord]) -> List[Dict]:
+    return [p.to_dict() for p in predictions]
@@ -0,0 +1,386 @@
+"""Normalized SQLite store for analysis results across threads and models.
+
+Every run is exported into flat tables keyed by thread, model and comment id,
+so cross-model and cross-thread questions become indexed queries instead of
+walks over the nested per-model JSON:
+
+    comments       thread_id, comment_id, parent_id, level, text
+    comment_flags  thread_id, model, comment_id, is_noisy
+    clusters       thread_id, model, cluster_id, size
+    themes         theme_id, thread_id, model, cluster_id, name, summary
+    predictions    prediction_id, thread_id, model, comment_id, theme_id,
+                   cluster_id, prediction, probability, justification, bucket,
+                   answered_by (the fallback model that answered, if any)
+
+Usage:
+    python results_store.py import outputs/predictions_data_*.json
+    python results_store.py distribution --model gpt-4o
+    python results_store.py top --limit 5
+    python results_store.py sql "SELECT model, COUNT(*) FROM predictions GROUP BY model"
+"""
+
+import argparse
+import json
+import sqlite3
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Sequence
+
+from build_site import probability_category
+from records import CommentRecord, PredictionRecord
+from schemas import ThemesList
+
+DEFAULT_DB = "outputs/results.db"
+DEFAULT_THREAD_ID = "42490343"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS comments (
+    thread_id TEXT NOT NULL,
+    comment_id TEXT NOT NULL,
+    parent_id TEXT,
+    level INTEGER,
+    text TEXT NOT NULL,
+    PRIMARY KEY (thread_id, comment_id)
+);
+CREATE TABLE IF NOT EXISTS comment_flags (
+    thread_id TEXT NOT NULL,
+    model TEXT NOT NULL,
+    comment_id TEXT NOT NULL,
+    is_noisy INTEGER NOT NULL,
+    PRIMARY KEY (thread_id, model, comment_id)
+);
+CREATE TABLE IF NOT EXISTS clusters (
+    thread_id TEXT NOT NULL,
+    model TEXT NOT NULL,
+    cluster_id TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    PRIMARY KEY (thread_id, model, cluster_id)
+);
+CREATE TABLE IF NOT EXISTS themes (
+    theme_id INTEGER PRIMARY KEY,
+    thread_id TEXT NOT NULL,
+    model TEXT NOT NULL,
+    cluster_id TEXT,
+    name TEXT NOT NULL,
+    summary TEXT
+);
+CREATE TABLE IF NOT EXISTS predictions (
+    prediction_id INTEGER PRIMARY KEY,
+    thread_id TEXT NOT NULL,
+    model TEXT NOT NULL,
+    comment_id TEXT,
+    theme_id INTEGER REFERENCES themes (theme_id),
+    cluster_id TEXT,
+    prediction TEXT NOT NULL,
+    probability REAL NOT NULL,
+    justification TEXT,
+    bucket TEXT NOT NULL,
+    answered_by TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_themes_run ON themes (thread_id, model, name);
+CREATE INDEX IF NOT EXISTS idx_predictions_run ON predictions (thread_id, model);
+CREATE INDEX IF NOT EXISTS idx_predictions_theme ON predictions (theme_id);
+CREATE INDEX IF NOT EXISTS idx_predictions_probability
+    ON predictions (model, probability DESC);
+CREATE INDEX IF NOT EXISTS idx_predictions_comment
+    ON predictions (thread_id, comment_id);
+"""
+
+QUERIES = {
+    # likely/maybe/unlikely counts and mean probability of every theme
+    "distribution": """
+        SELECT p.model, t.name AS theme, COUNT(*) AS total,
+               SUM(p.bucket = 'likely') AS likely,
+               SUM(p.bucket = 'maybe') AS maybe,
+               SUM(p.bucket = 'unlikely') AS unlikely,
+               ROUND(AVG(p.probability), 3) AS mean_probability
+        FROM predictions p JOIN themes t ON t.theme_id = p.theme_id
+        WHERE (:thread_id IS NULL OR p.thread_id = :thread_id)
+          AND (:model IS NULL OR p.model = :model OR p.model LIKE '%/' || :model)
+        GROUP BY p.model, t.name
+        ORDER BY p.model, total DESC
+    """,
+    # highest probability predictions of every model
+    "top": """
+        SELECT model, probability, prediction FROM (
+            SELECT model, probability, prediction,
+                   ROW_NUMBER() OVER (
+                       PARTITION BY model ORDER BY probability DESC
+                   ) AS rank
+            FROM predictions
+            WHERE (:thread_id IS NULL OR thread_id = :thread_id)
+              AND (:model IS NULL OR model = :model OR model LIKE '%/' || :model)
+        )
+        WHERE rank <= :limit
+        ORDER BY model, probability DESC
+    """,
+    # per-model totals across threads
+    "models": """
+        SELECT model, COUNT(DISTINCT thread_id) AS threads,
+               COUNT(*) AS predictions,
+               COUNT(DISTINCT theme_id) AS themes,
+               ROUND(AVG(probability), 3) AS mean_probability,
+               SUM(bucket = 'likely') AS likely,
+               SUM(bucket = 'maybe') AS maybe,
+               SUM(bucket = 'unlikely') AS unlikely,
+               SUM(answered_by IS NOT NULL) AS failed_over
+        FROM predictions
+        WHERE (:thread_id IS NULL OR thread_id = :thread_id)
+          AND (:model IS NULL OR model = :model OR model LIKE '%/' || :model)
+        GROUP BY model
+        ORDER BY model
+    """,
+}
+
+
+class ResultsStore:
+    """SQLite database holding the normalized results of analysis runs."""
+
+    def __init__(self, db_path: str = DEFAULT_DB):
+        Path(db_path).parent.mkdir(parents=True, exist_ok=True)
+        self.conn = sqlite3.connect(db_path)
+        self.conn.executescript(SCHEMA)
+        columns = {
+            row[1] for row in self.conn.execute("PRAGMA table_info(predictions)")
+        }
+        if "answered_by" not in columns:
+            # stores created before failover was recorded
+            self.conn.execute("ALTER TABLE predictions ADD COLUMN answered_by TEXT")
+
+    def close(self):
+        self.conn.close()
+
+    def clear_run(self, thread_id: str, model: str):
+        """Remove the results of a previous export of the same run."""
+        for table in ("comment_flags", "clusters", "themes", "predictions"):
+            self.conn.execute(
+                f"DELETE FROM {table} WHERE thread_id = ? AND model = ?",
+                (thread_id, model),
+            )
+
+    def write_comments(
+        self,
+        thread_id: str,
+        model: str,
+        comments: List[CommentRecord],
+        filtered_comments: Optional[List[CommentRecord]] = None,
+    ):
+        """Store comments and, given the kept ones, the model's noise flags.
+
+        Comments are matched by id (see prepare_comments), so comments with
+        the same text keep their own flags.
+        """
+        rows = []
+        for index, comment in enumerate(comments):
+            comment_id = str(index if comment.id is None else comment.id)
+            rows.append(
+                (thread_id, comment_id, comment.parent, comment.level, comment.text)
+            )
+        self.conn.executemany(
+            "INSERT OR REPLACE INTO comments VALUES (?, ?, ?, ?, ?)", rows
+        )
+        if filtered_comments is not None:
+            kept = {comment.id for comment in filtered_comments}
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO comment_flags VALUES (?, ?, ?, ?)",
+                (
+                    (thread_id, model, row[1], int(comment.id not in kept))
+                    for row, comment in zip(rows, comments)
+                ),
+            )
+
+    def write_themes(
+        self,
+        thread_id: str,
+        model: str,
+        themes: Sequence[Dict],
+        predictions: Optional[Iterable[PredictionRecord]] = None,
+    ):
+        """Store themes, their clusters and predictions.
+
+        Args:
+            themes: Dicts with theme, summary, predictions (dicts) and
+                cluster_id. A merged theme spans several clusters and has no
+                cluster_id; its predictions then carry their own.
+            predictions: All extracted predictions; those that no theme covers
+                are stored without a theme. Defaults to the theme predictions.
+        """
+        theme_ids = {}
+        cluster_ids = {}
+        cluster_sizes = {}
+        rows = []
+        for theme in themes:
+            cursor = self.conn.execute(
+                "INSERT INTO themes (thread_id, model, cluster_id, name, summary)"
+                " VALUES (?, ?, ?, ?, ?)",
+                (
+                    thread_id,
+                    model,
+                    theme.get("cluster_id"),
+                    theme["theme"],
+                    theme.get("summary"),
+                ),
+            )
+            for prediction in theme["predictions"]:
+                cluster_id = prediction.get("cluster_id") or theme.get("cluster_id")
+                # the copies deduplication folded into a prediction share its
+                # theme and cluster
+                for text in _prediction_texts(prediction):
+                    theme_ids.setdefault(text, cursor.lastrowid)
+                    cluster_ids.setdefault(text, cluster_id)
+                if cluster_id is not None:
+                    cluster_sizes[cluster_id] = cluster_sizes.get(cluster_id, 0) + 1
+                if predictions is None:
+                    rows.append(
+                        (
+                            PredictionRecord.from_dict(prediction),
+                            cursor.lastrowid,
+                            cluster_id,
+                        )
+                    )
+
+        if predictions is not None:
+            rows = [
+                (p, theme_ids.get(p.prediction), cluster_ids.get(p.prediction))
+                for p in predictions
+            ]
+
+        self.conn.executemany(
+            "INSERT INTO clusters VALUES (?, ?, ?, ?)",
+            (
+                (thread_id, model, cluster_id, size)
+                for cluster_id, size in cluster_sizes.items()
+            ),
+        )
+        self.conn.executemany(
+            "INSERT INTO predictions (thread_id, model, comment_id, theme_id,"
+            " cluster_id, prediction, probability, justification, bucket,"
+            " answered_by) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (
+                (
+                    thread_id,
+                    model,
+                    prediction.comment_id,
+                    theme_id,
+                    cluster_id,
+                    prediction.prediction,
+                    prediction.probability,
+                    prediction.justification,
+                    probability_category(prediction.probability),
+                    prediction.answered_by,
+                )
+                for prediction, theme_id, cluster_id in rows
+            ),
+        )
+
+    def query(self, sql: str, params: Optional[Dict] = None) -> sqlite3.Cursor:
+        return self.conn.execute(sql, params or {})
+
+
+def _prediction_texts(prediction: Dict) -> List[str]:
+    """Text of a theme prediction and of the copies in its `sources`."""
+    return [prediction["prediction"]] + [
+        source["prediction"] for source in prediction.get("sources") or []
+    ]
+
+
+def export_run(
+    store: ResultsStore,
+    thread_id: str,
+    model_name: str,
+    comments: List[CommentRecord],
+    filtered_comments: List[CommentRecord],
+    predictions: List[PredictionRecord],
+    themes: ThemesList,
+):
+    """Replace the stored results of one (thread, model) run.
+
+    `comments` are the prepared comment records (see prepare_comments).
+    """
+    store.clear_run(thread_id, model_name)
+    store.write_comments(thread_id, model_name, comments, filtered_comments)
+    store.write_themes(
+        thread_id,
+        model_name,
+        # theme predictions are already remapped to dicts by identify_themes
+        [
+            {
+                "theme": theme.theme,
+                "summary": theme.summary,
+                "predictions": theme.predictions,
+                "cluster_id": theme.cluster_id,
+            }
+            for theme in (themes.themes if themes else [])
+        ],
+        predictions,
+    )
+    store.conn.commit()
+
+
+def import_output(store: ResultsStore, path: str, thread_id: str) -> str:
+    """Load a serialized predictions_data_*.json file; returns its model name."""
+    with open(path, "r") as f:
+        data = json.load(f)
+    model_name = data["model"]
+    store.clear_run(thread_id, model_name)
+    store.write_themes(thread_id, model_name, data["themes"])
+    store.conn.commit()
+    return model_name
+
+
+def print_rows(cursor: sqlite3.Cursor):
+    """Print query results as an aligned table."""
+    headers = [column[0] for column in cursor.description]
+    rows = [["" if v is None else str(v) for v in row] for row in cursor.fetchall()]
+    widths = [
+        min(80, max(len(h), *(len(r[i]) for r in rows))) if rows else len(h)
+        for i, h in enumerate(headers)
+    ]
+    print("  ".join(h.ljust(w) for h, w in zip(headers, widths)))
+    for row in rows:
+        print("  ".join(v[:w].ljust(w) for v, w in zip(row, widths)))
+    print(f"({len(rows)} rows)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Query the normalized results store")
+    parser.add_argument("--db", type=str, default=DEFAULT_DB)
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    import_parser = subparsers.add_parser(
+        "import", help="Load serialized predictions_data_*.json files"
+    )
+    import_parser.add_argument("files", nargs="+")
+    import_parser.add_argument("--thread-id", type=str, default=DEFAULT_THREAD_ID)
+
+    for name in QUERIES:
+        query_parser = subparsers.add_parser(name)
+        query_parser.add_argument("--thread-id", type=str, default=None)
+        query_parser.add_argument("--model", type=str, default=None)
+        if name == "top":
+            query_parser.add_argument("--limit", type=int, default=10)
+
+    sql_parser = subparsers.add_parser("sql", help="Run an arbitrary SQL query")
+    sql_parser.add_argument("sql", type=str)
+    args = parser.parse_args()
+
+    store = ResultsStore(args.db)
+    try:
+        if args.command == "import":
+            for path in args.files:
+                model_name = import_output(store, path, args.thread_id)
+                print(f"Imported {path} as {model_name} (thread {args.thread_id})")
+        elif args.command == "sql":
+            print_rows(store.query(args.sql))
+        else:
+            params = {
+                "thread_id": args.thread_id,
+                "model": args.model,
+                "limit": getattr(args, "limit", None),
+            }
+            print_rows(store.query(QUERIES[args.command], params))
+    finally:
+        store.close()
+
+
+if __name__ == "__main__":
+    main()
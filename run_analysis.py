@@ -1,26 +1,56 @@
 import os
+import json
 import argparse
+from typing import Optional
 from dotenv import load_dotenv
-from models import GeminiModel, OpenAIModel, AnthropicModel, OllamaModel, GroqModel
+from models import (
+    GeminiModel,
+    OpenAIModel,
+    AnthropicModel,
+    OllamaModel,
+    GroqModel,
+    LiteLLMModel,
+    FailoverModel,
+)
 from analyse_predictions import (
     fetch_hacker_news_comments,
+    prepare_comments,
+    make_comment_batches,
     is_comment_noisy,
     extract_predictions_with_retry,
+    attribute_predictions,
+    filter_and_extract,
     identify_themes,
     serialize_data,
 )
 from schemas import CommentClassification, PredictionEvaluation, ThemesList
 from cache_manager import CacheManager
+from embeddings import configure_encoder
+from build_site import build_site
+from results_store import ResultsStore, export_run
+from planner import plan_run, print_plan
+from preview import preview_report, print_preview, stratified_sample
+
+# seconds a model of a failover chain gets before the next one is tried
+DEFAULT_DEADLINE = 120.0
 
 
-def get_model_by_name(model_name: str):
+def get_model_by_name(model_name: str, api_base: str = None):
     """Get model instance by name."""
     models = {
         "gemini": lambda: GeminiModel(),
         "openai": lambda: OpenAIModel(),
         "anthropic": lambda: AnthropicModel(),
-        #'ollama': lambda: OllamaModel("llama2:13b"),
+        "ollama": lambda: OllamaModel("llama2:13b"),
         "groq": lambda: GroqModel("llama3-70b-8192"),
+        # any OpenAI-compatible server, e.g. stub_server.py for offline load tests
+        "local": lambda: LiteLLMModel(
+            os.getenv("LOCAL_MODEL_NAME", "stub"),
+            provider="openai",
+            api_key=os.getenv("LOCAL_API_KEY", "local"),
+            api_base=api_base
+            or os.getenv("LOCAL_API_BASE", "http://127.0.0.1:8765/v1"),
+        ),
     }
     if model_name not in models:
         raise ValueError(
@@ -29,77 +59,209 @@ def get_model_by_name(model_name: str):
     return models[model_name]()
 
 
-def run_analysis_for_model(
-    model, comments, cache_manager: CacheManager, batch_size=5, force_rerun=False
+def get_failover_model(
+    model_name: str,
+    fallbacks=(),
+    api_base: str = None,
+    deadline: float = DEFAULT_DEADLINE,
+    hedge_quantile: float = 0.95,
 ):
-    """Run the analysis pipeline for a specific model."""
+    """Wrap a model and its fallback chain (names accepted by
+    get_model_by_name) with per-call deadlines and hedged requests."""
+    return FailoverModel(
+        [get_model_by_name(name, api_base) for name in [model_name, *fallbacks]],
+        deadline=deadline,
+        hedge_quantile=hedge_quantile,
+    )
 
-    if force_rerun:
-        cache_manager.clear_cache(model.model_name)
 
+def get_analysis_model(
+    model_name: str,
+    fallbacks=(),
+    api_base: str = None,
+    deadline: Optional[float] = None,
+    hedge_quantile: Optional[float] = None,
+):
+    """The model a run uses: wrapped by get_failover_model only when
+    fallbacks, a deadline or hedging are asked for. A deadline of None means
+    DEFAULT_DEADLINE once wrapped; 0 means none."""
+    if not (fallbacks or deadline is not None or hedge_quantile):
+        return get_model_by_name(model_name, api_base)
+    return get_failover_model(
+        model_name,
+        fallbacks,
+        api_base=api_base,
+        deadline=DEFAULT_DEADLINE if deadline is None else deadline or None,
+        hedge_quantile=hedge_quantile,
+    )
+
+
+def filter_and_extract_two_stage(
+    model,
+    comment_objs,
+    cache_manager: CacheManager,
+    batch_size,
+    stream,
+    batching,
+    lookup=None,
+):
+    """Filter noisy comments, then extract predictions from the rest."""
     # Step 1: Filter out noisy comments
     print("\nStep 1: Filtering comments...")
     filtered_comments = []
-    current_batch = []
-
-    # Prepare batches of comment dicts
-    for comment in comments:
-        # Ensure comments are a dict with a "text" key
-        if isinstance(comment, str):
-            comment = {"text": comment}
-
-        # Create standardized comment object for all steps
-        comment_obj = {"text": comment.get("text", "")}
-
-        if isinstance(comment, dict) and "text" in comment:
-            current_batch.append(comment_obj)
-
-            if len(current_batch) >= batch_size:
-                # Process the batch
-                noisy_flags = is_comment_noisy(
-                    current_batch, model, cache_manager, batch_size=batch_size
-                )
-
-                # Add non-noisy comments to filtered list
-                for orig_comment, is_noisy in zip(current_batch, noisy_flags):
-                    if not is_noisy:
-                        filtered_comments.append(orig_comment)
 
-                current_batch = []
-
-    # Process any remaining comments
-    if current_batch:
+    for current_batch, context in make_comment_batches(
+        comment_objs, batch_size, batching, lookup
+    ):
         noisy_flags = is_comment_noisy(
-            current_batch, model, cache_manager, batch_size=batch_size
+            current_batch,
+            model,
+            cache_manager,
+            batch_size=batch_size,
+            context=context,
         )
 
+        # Add non-noisy comments to filtered list
         for orig_comment, is_noisy in zip(current_batch, noisy_flags):
             if not is_noisy:
                 filtered_comments.append(orig_comment)
 
-    print(f"Filtered {len(comments) - len(filtered_comments)} noisy comments")
+    print(f"Filtered {len(comment_objs) - len(filtered_comments)} noisy comments")
     print(f"Remaining comments: {len(filtered_comments)}")
 
     # Step 2: Extract predictions
     print("\nStep 2: Extracting predictions...")
     all_predictions = []
 
-    # Process filtered comments in batches
-    for i in range(0, len(filtered_comments), batch_size):
-        batch = filtered_comments[i : i + batch_size]
-        print(
-            f"Processing batch {i//batch_size + 1}/{(len(filtered_comments) + batch_size - 1)//batch_size}"
+    # Process filtered comments in batches; parents filtered out as noisy can
+    # still serve as context for their replies
+    batches = make_comment_batches(
+        filtered_comments, batch_size, batching, lookup=lookup or comment_objs
+    )
+    for i, (batch, context) in enumerate(batches):
+        print(f"Processing batch {i + 1}/{len(batches)}")
+        predictions = extract_predictions_with_retry(
+            batch, model, cache_manager, stream=stream, context=context
         )
-        predictions = extract_predictions_with_retry(batch, model, cache_manager)
         if predictions:
-            all_predictions.extend(predictions)
+            all_predictions.extend(attribute_predictions(predictions, batch))
+
+    print(f"Extracted {len(all_predictions)} predictions")
+    return filtered_comments, all_predictions
+
+
+def filter_and_extract_fused(
+    model, comment_objs, cache_manager: CacheManager, batch_size, batching, lookup=None
+):
+    """Filter comments and extract predictions in one call per batch, falling
+    back to the two-stage calls for batches whose answer can't be aligned.
+    `lookup` resolves parents outside `comment_objs` (e.g. a sample)."""
+    print("\nStep 1+2: Filtering comments and extracting predictions...")
+    filtered_comments = []
+    all_predictions = []
+
+    batches = make_comment_batches(comment_objs, batch_size, batching, lookup)
+    for i, (batch, context) in enumerate(batches):
+        print(f"Processing batch {i + 1}/{len(batches)}")
+        result = filter_and_extract(batch, model, cache_manager, context=context)
+        if result:
+            noisy_flags, comment_predictions = result
+            # the fused answer is per comment, so the source comment is known
+            predictions = []
+            for c, preds in zip(batch, comment_predictions):
+                for p in preds:
+                    p.comment_id = c.id
+                    predictions.append(p)
+        else:
+            noisy_flags = is_comment_noisy(
+                batch, model, cache_manager, batch_size=batch_size, context=context
+            )
+            kept = [c for c, is_noisy in zip(batch, noisy_flags) if not is_noisy]
+            if context is not None:
+                kept_parents = {c.parent for c in kept}
+                context = [c for c in context if c.id in kept_parents]
+            predictions = (
+                attribute_predictions(
+                    extract_predictions_with_retry(
+                        kept, model, cache_manager, context=context
+                    ),
+                    kept,
+                )
+                if kept
+                else []
+            )
+
+        filtered_comments.extend(
+            c for c, is_noisy in zip(batch, noisy_flags) if not is_noisy
+        )
+        all_predictions.extend(predictions)
 
+    print(f"Filtered {len(comment_objs) - len(filtered_comments)} noisy comments")
     print(f"Extracted {len(all_predictions)} predictions")
+    return filtered_comments, all_predictions
+
+
+def run_analysis_for_model(
+    model,
+    comments,
+    cache_manager: CacheManager,
+    batch_size=5,
+    force_rerun=False,
+    stream=False,
+    batching="page",
+    fused=False,
+    dedup_threshold=0.92,
+    incremental_clustering=False,
+    merge_threshold=0.8,
+    lookup=None,
+    thread_id=None,
+):
+    """Run the analysis pipeline for a specific model.
+
+    `batching` is "page" (comments in page order) or "thread" (reply subtrees
+    kept together, with parent comments sent once per batch as context).
+    With `fused`, filtering and extraction share one LLM call per batch.
+    `dedup_threshold` is the cosine similarity at which predictions are
+    collapsed before theming (None keeps every copy). With
+    `incremental_clustering`, new predictions join the persisted clusters and
+    HDBSCAN is only refit when outliers or growth pass a threshold; the
+    clusters are persisted per model and `thread_id`.
+    `merge_threshold` is the theme similarity at which the per-chunk themes
+    are merged into the final taxonomy (None keeps them all).
+    `lookup` lists all comments of the thread when `comments` is a sample, so
+    parents outside the sample still serve as context.
+    """
+
+    if force_rerun:
+        # a failover chain also reads the entries its fallbacks answered
+        for model_name in model.cache_names:
+            cache_manager.clear_cache(model_name)
+
+    comment_objs = prepare_comments(comments)
+    if lookup is not None:
+        lookup = prepare_comments(lookup)
+    if fused:
+        filtered_comments, all_predictions = filter_and_extract_fused(
+            model, comment_objs, cache_manager, batch_size, batching, lookup
+        )
+    else:
+        filtered_comments, all_predictions = filter_and_extract_two_stage(
+            model, comment_objs, cache_manager, batch_size, stream, batching, lookup
+        )
 
     # Step 3: Identify themes
     print("\nStep 3: Identifying themes...")
     themes = identify_themes(
-        all_predictions, all_predictions, model, cache_manager, batch_size=batch_size
+        all_predictions,
+        all_predictions,
+        model,
+        cache_manager,
+        batch_size=batch_size,
+        stream=stream,
+        dedup_threshold=dedup_threshold,
+        incremental=incremental_clustering,
+        merge_threshold=merge_threshold,
+        thread_id=thread_id,
     )
 
     print("Themese identified:")
@@ -108,6 +270,38 @@ def run_analysis_for_model(
     return filtered_comments, all_predictions, themes
 
 
+def run_preview_for_model(
+    model,
+    comments,
+    cache_manager: CacheManager,
+    fraction=0.1,
+    seed=0,
+    bootstrap=1000,
+    **kwargs,
+):
+    """Run the pipeline on a stratified sample of the comments and project
+    the results to the whole thread (see preview.py).
+
+    The sample runs fused, so every comment's results are cached under its
+    own key and a later full `fused` run only sends the remaining comments.
+    Other keyword arguments are passed to run_analysis_for_model.
+    """
+    comment_objs = prepare_comments(comments)
+    sample = stratified_sample(comment_objs, fraction, seed)
+    print(f"Previewing {len(sample.comments)} of {len(comment_objs)} comments")
+    filtered_comments, predictions, themes = run_analysis_for_model(
+        model,
+        sample.comments,
+        cache_manager,
+        fused=True,
+        lookup=comment_objs,
+        **kwargs,
+    )
+    return preview_report(
+        sample, filtered_comments, predictions, themes, bootstrap, seed=seed
+    )
+
+
 def main():
     parser = argparse.ArgumentParser(
         description="Run prediction analysis on HN comments"
@@ -116,9 +310,37 @@ def main():
         "--model",
         type=str,
         default="gemini",
-        choices=["gemini", "openai", "anthropic", "groq"],
+        choices=["gemini", "openai", "anthropic", "ollama", "groq", "local"],
         help="Model to use for analysis",
     )
+    parser.add_argument(
+        "--api-base",
+        type=str,
+        default=None,
+        help="Base URL of the OpenAI-compatible server used by --model local",
+    )
+    parser.add_argument(
+        "--fallback-models",
+        type=str,
+        nargs="+",
+        default=[],
+        choices=["gemini", "openai", "anthropic", "ollama", "groq", "local"],
+        help="Models to fail over to, in order, when --model errors or stalls",
+    )
+    parser.add_argument(
+        "--deadline",
+        type=float,
+        default=None,
+        help="Seconds a model gets to answer a call before failing over "
+        f"(0: none; {DEFAULT_DEADLINE:.0f} with --fallback-models)",
+    )
+    parser.add_argument(
+        "--hedge-quantile",
+        type=float,
+        default=None,
+        help="Send a duplicate request for calls slower than this latency "
+        "quantile of the model (e.g. 0.95)",
+    )
     parser.add_argument(
         "--batch-size",
         type=int,
@@ -130,19 +352,199 @@ def main():
         action="store_true",
         help="Force rerun analysis, ignoring cache",
     )
+    parser.add_argument(
+        "--stream",
+        action="store_true",
+        help="Stream extraction and theme responses and parse them incrementally",
+    )
+    parser.add_argument(
+        "--batching",
+        type=str,
+        default="page",
+        choices=["page", "thread"],
+        help="Batch comments in page order or by reply subtree with parent context",
+    )
+    parser.add_argument(
+        "--fused",
+        action="store_true",
+        help="Filter comments and extract predictions in a single call per batch",
+    )
+    parser.add_argument(
+        "--dedup-threshold",
+        type=float,
+        default=0.92,
+        help="Cosine similarity at which near-duplicate predictions are collapsed",
+    )
+    parser.add_argument(
+        "--no-dedup",
+        action="store_true",
+        help="Send every extracted copy of a prediction to clustering and theming",
+    )
+    parser.add_argument(
+        "--incremental-clustering",
+        action="store_true",
+        help="Assign new predictions to the persisted clusters instead of refitting",
+    )
+    parser.add_argument(
+        "--merge-threshold",
+        type=float,
+        default=0.8,
+        help="Similarity of theme name+summary embeddings at which themes are merged",
+    )
+    parser.add_argument(
+        "--no-theme-merge",
+        action="store_true",
+        help="Keep the per-cluster themes instead of merging similar ones",
+    )
+    parser.add_argument(
+        "--embedding-backend",
+        type=str,
+        default="torch",
+        choices=["torch", "onnx"],
+        help="Run MiniLM with torch or as the int8 quantized ONNX export",
+    )
+    parser.add_argument(
+        "--embedding-processes",
+        type=int,
+        default=1,
+        help="CPU worker processes used to encode large batches of predictions",
+    )
+    parser.add_argument(
+        "--embedding-store-dtype",
+        type=str,
+        default="float16",
+        choices=["float32", "float16", "int8"],
+        help="Precision of the embeddings stored in cache/embeddings",
+    )
+    parser.add_argument(
+        "--plan",
+        action="store_true",
+        help="Print the projected calls, tokens, cost and time instead of running",
+    )
+    parser.add_argument(
+        "--concurrency",
+        type=int,
+        default=1,
+        help="Calls in flight assumed by --plan",
+    )
+    parser.add_argument(
+        "--rpm", type=int, default=None, help="Provider requests per minute (--plan)"
+    )
+    parser.add_argument(
+        "--tpm", type=int, default=None, help="Provider tokens per minute (--plan)"
+    )
+    parser.add_argument(
+        "--comments-file",
+        type=str,
+        default=None,
+        help="JSON list of comments to analyse instead of fetching the thread",
+    )
+    parser.add_argument(
+        "--preview",
+        action="store_true",
+        help="Analyse a stratified sample and project the results to the thread",
+    )
+    parser.add_argument(
+        "--preview-fraction",
+        type=float,
+        default=0.1,
+        help="Share of every stratum of comments analysed by --preview",
+    )
+    parser.add_argument(
+        "--preview-seed", type=int, default=0, help="Random seed of --preview"
+    )
+    parser.add_argument(
+        "--bootstrap",
+        type=int,
+        default=1000,
+        help="Bootstrap resamples for the confidence intervals of --preview",
+    )
+    parser.add_argument(
+        "--results-db",
+        type=str,
+        default=None,
+        help="Also export the results to this SQLite store (see results_store.py)",
+    )
     args = parser.parse_args()
 
-    # Initialize the model
-    model = get_model_by_name(args.model)
+    model = get_analysis_model(
+        args.model,
+        args.fallback_models,
+        api_base=args.api_base,
+        deadline=args.deadline,
+        hedge_quantile=args.hedge_quantile,
+    )
+    try:
+        run_main(args, model)
+    finally:
+        model.close()
+
+
+def run_main(args, model):
+    """Everything main does once the model is set up."""
 
     # Initialize cache manager
     cache_manager = CacheManager()
+    configure_encoder(
+        backend=args.embedding_backend,
+        processes=args.embedding_processes,
+        store_dir=str(cache_manager.cache_dir / "embeddings"),
+        store_dtype=args.embedding_store_dtype,
+    )
 
     # Get comments from HN
-    print("Fetching comments from Hacker News...")
-    comments = fetch_hacker_news_comments("42490343")
+    thread_id = "42490343"
+    if args.comments_file:
+        with open(args.comments_file, "r") as f:
+            comments = json.load(f)
+    else:
+        print("Fetching comments from Hacker News...")
+        comments = fetch_hacker_news_comments(thread_id)
     print(f"Found {len(comments)} comments")
 
+    if args.plan:
+        print_plan(
+            plan_run(
+                model,
+                comments,
+                cache_manager,
+                batch_size=args.batch_size,
+                batching=args.batching,
+                fused=args.fused,
+                dedup_threshold=None if args.no_dedup else args.dedup_threshold,
+                concurrency=args.concurrency,
+                rpm=args.rpm,
+                tpm=args.tpm,
+            )
+        )
+        return
+
+    if args.preview:
+        report = run_preview_for_model(
+            model,
+            comments,
+            cache_manager,
+            fraction=args.preview_fraction,
+            seed=args.preview_seed,
+            bootstrap=args.bootstrap,
+            batch_size=args.batch_size,
+            force_rerun=args.force_rerun,
+            stream=args.stream,
+            batching=args.batching,
+            dedup_threshold=None if args.no_dedup else args.dedup_threshold,
+            incremental_clustering=args.incremental_clustering,
+            merge_threshold=None if args.no_theme_merge else args.merge_threshold,
+            thread_id=thread_id,
+        )
+        print_preview(report)
+        output_file_model_name = model.model_name.split("/")[-1]
+        preview_file = f"outputs/preview_{output_file_model_name}.json"
+        os.makedirs("outputs", exist_ok=True)
+        with open(preview_file, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"\nPreview written to {preview_file}; run with --fused to complete it")
+        return
+
     print(f"Running analysis for {len(comments)} comments")
     # Run analysis
     filtered_comments, predictions, themes = run_analysis_for_model(
@@ -151,6 +553,13 @@ def main():
         cache_manager=cache_manager,
         batch_size=args.batch_size,
         force_rerun=args.force_rerun,
+        stream=args.stream,
+        batching=args.batching,
+        fused=args.fused,
+        dedup_threshold=None if args.no_dedup else args.dedup_threshold,
+        incremental_clustering=args.incremental_clustering,
+        merge_threshold=None if args.no_theme_merge else args.merge_threshold,
+        thread_id=thread_id,
     )
 
     # Serialize results
@@ -163,6 +572,21 @@ def main():
         f"outputs/predictions_data_{output_file_model_name}.json",
         model,
     )
+    print(f"Viewer manifest written to {build_site('outputs')}")
+
+    if args.results_db:
+        store = ResultsStore(args.results_db)
+        export_run(
+            store,
+            thread_id,
+            model.model_name,
+            prepare_comments(comments),
+            filtered_comments,
+            predictions,
+            themes,
+        )
+        store.close()
+        print(f"Results exported to {args.results_db}")
 
     print("\nAnalysis complete!")
     print(f"Processed {len(comments)} comments")
@@ -19,11 +19,27 @@ class PredictionEvaluation(BaseModel):
     """Represents the evaluation of predictions from a set of comments."""
     predictions: List[Prediction] = Field(description="List of evaluated predictions")
 
+class CommentAnalysis(BaseModel):
+    """Represents the classification of a comment together with its evaluated predictions."""
+    is_noisy: bool = Field(description="`true` if the comment is noisy, `false` otherwise")
+    predictions: List[Prediction] = Field(description="List of evaluated predictions, empty for noisy comments")
+
+class CommentAnalysisList(BaseModel):
+    """Represents the single-pass classification and evaluation of a list of comments."""
+    comments: List[CommentAnalysis] = Field(description="One analysis per input comment, in corresponding order to the input.")
+
 class Theme(BaseModel):
     """Represents a theme identified in the predictions."""
     theme: str = Field(description="Name of the theme")
     summary: str = Field(description="Brief description of what the theme encompasses")
     predictions: List[str] = Field(description="List of predictions that fall under this theme")
+    cluster_id: Optional[str] = Field(default=None, description="Id of the prediction cluster the theme was identified in (set by the pipeline, not the model)")
+    cluster_ids: Optional[List[str]] = Field(default=None, description="Ids of all prediction clusters a merged theme covers (set by the pipeline, not the model)")
+
+class ThemeSummary(BaseModel):
+    """Represents the name and summary of a theme merged from several themes."""
+    theme: str = Field(description="Name of the merged theme")
+    summary: str = Field(description="Brief description of what the merged theme encompasses")
 
 class ThemesList(BaseModel):
     """Represents a collection of identified themes."""
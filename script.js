@@ -1,6 +1,14 @@
 let loaded = false;
-let modelsData = {};  // Store all models' data
+let manifest = null;  // Models, themes and precomputed stats from the build step
+const shardCache = {};  // Theme shards already fetched, keyed by path
+const segmentCache = {};  // Search index segments already fetched, keyed by model id
 let $tabContent;  // Global reference to tab content
+let searchSeq = 0;  // Id of the latest search, older responses are dropped
+
+const SITE_DIR = 'outputs/site';
+const MAX_SEARCH_RESULTS = 100;
+const STOPWORDS = new Set(('a an and are as at be been but by for from has have in into is it its of on ' +
+  'or that the their there this to was were will with').split(' '));
 
 // Function to load theme predictions
 function loadThemePredictions(theme, $targetContent) {
@@ -105,8 +113,64 @@ function loadThemePredictions(theme, $targetContent) {
   $targetContent.append($themeContainer);
 }
 
+// Function to fetch a theme shard (once) and expand its compact rows
+function loadThemeShard(themeEntry) {
+  if (!shardCache[themeEntry.shard]) {
+    shardCache[themeEntry.shard] = fetch(`${SITE_DIR}/${themeEntry.shard}`)
+      .then(response => {
+        if (!response.ok) {
+          throw new Error(`HTTP error! status: ${response.status}`);
+        }
+        return response.json();
+      })
+      .then(shard => ({
+        theme: shard.theme,
+        summary: shard.summary,
+        predictions: shard.predictions.map(([prediction, probability, justification]) => ({
+          prediction, probability, justification
+        }))
+      }))
+      .catch(error => {
+        delete shardCache[themeEntry.shard];
+        throw error;
+      });
+  }
+  return shardCache[themeEntry.shard];
+}
+
+// Function to show an error message in the given container
+function showError($target, message) {
+  $target.html(`
+    <div class="notification is-danger">
+      <span class="icon-text">
+        <span class="icon"><i class="fas fa-exclamation-triangle"></i></span>
+        <span>${message}</span>
+      </span>
+    </div>
+  `);
+}
+
+// Function to lazily load and display a theme
+function showTheme(themeEntry, $targetContent) {
+  $targetContent.html(`
+    <div class="has-text-centered p-6">
+      <span class="icon is-large">
+        <i class="fas fa-spinner fa-pulse fa-2x"></i>
+      </span>
+      <p class="mt-2">Loading predictions...</p>
+    </div>
+  `);
+
+  loadThemeShard(themeEntry)
+    .then(theme => loadThemePredictions(theme, $targetContent))
+    .catch(error => {
+      console.error('Error loading theme shard:', error);
+      showError($targetContent, `Error loading predictions: ${error.message}`);
+    });
+}
+
 // Function to setup the theme UI
-function setupThemeUI(sortedThemes, model) {
+function setupThemeUI(themes) {
   $tabContent.empty();
 
   const $tabContentContainer = $('<div class="columns is-variable is-1 is-gapless" style="min-height: 500px"></div>').appendTo($tabContent);
@@ -125,300 +189,322 @@ function setupThemeUI(sortedThemes, model) {
 
   const $themeMenu = $('<ul class="menu-list"></ul>').appendTo($sidebar);
 
-  // Create the theme navigation
-  sortedThemes.forEach(theme => {
-    let predictionCount = 0;
-    if (theme.predictions && Array.isArray(theme.predictions)) {
-      predictionCount = theme.predictions.length;
-    }
+  // Create the theme navigation from the manifest counts
+  themes.forEach(theme => {
     const $themeItem = $('<li class="theme-list-item"></li>').append(
       '<a class="theme-link" href="#">' + theme.theme +
-      ' <span class="tag is-light is-small ml-2">' + predictionCount + ' Predictions</span></a>'
+      ' <span class="tag is-light is-small ml-2">' + theme.count + ' Predictions</span></a>'
     ).on('click', function (event) {
       event.preventDefault();
       $themeMenu.find('li').removeClass('is-active');
       $(this).addClass('is-active');
 
       $mainContent.animate({ scrollTop: 0 }, 200, () => {
-        loadThemePredictions(theme, $mainContent);
+        showTheme(theme, $mainContent);
       });
     });
 
     $themeMenu.append($themeItem);
   });
 
-  if (sortedThemes.length > 0) {
-    loadThemePredictions(sortedThemes[0], $mainContent);
+  if (themes.length > 0) {
+    showTheme(themes[0], $mainContent);
     $themeMenu.find('li').first().addClass('is-active');
   }
 }
 
-// Function to load data for a specific model
-function loadData(file, $tab, tabIndex) {
-  // Show loading state
-  $tabContent.html(`
-    <div class="has-text-centered p-6">
-      <span class="icon is-large">
-        <i class="fas fa-spinner fa-pulse fa-2x"></i>
-      </span>
-      <p class="mt-2">Loading predictions...</p>
-    </div>
-  `);
-
-  fetch(file)
-    .then(response => {
-      if (!response.ok) {
-        throw new Error(`HTTP error! status: ${response.status}`);
-      }
-      return response.text();
-    })
-    .then(text => {
-      try {
-        const data = JSON.parse(text);
-        // Store the model data
-        modelsData[data.model] = data;
-        return data;
-      } catch (e) {
-        console.error("Error parsing JSON:", e);
-        throw e;
-      }
-    })
-    .then(data => processModelData(data, $tab))
-    .catch(error => {
-      console.error('Error in data loading process:', error);
-      console.error('Error stack:', error.stack);
-      $tabContent.html(`
-        <div class="notification is-danger">
-          <span class="icon-text">
-            <span class="icon"><i class="fas fa-exclamation-triangle"></i></span>
-            <span>Error loading predictions: ${error.message}</span>
-          </span>
-        </div>
-      `);
-    });
-}
-
-// Function to process model data after loading
-function processModelData(data, $tab) {
-  if (!data) {
-    console.error("No data available");
-    $tabContent.html('<div class="notification is-danger">Error loading data</div>');
-    return;
-  }
-
-  if (!data.themes) {
-    console.error("No themes found in data");
-    $tabContent.html('<div class="notification is-danger">Invalid data format: missing categorized_predictions</div>');
-    return;
-  }
-
-  // Select the clicked tab
+// Function to show a model; themes are already merged and sorted by the build step
+function loadData(modelEntry, $tab) {
+  searchSeq++;  // a pending search must not replace the tab
   $('.tabs li').removeClass('is-active');
   $tab.addClass('is-active');
-  $tabContent.empty();
+  setupThemeUI(modelEntry.themes);
+}
 
-  const themes = data.themes;
-  const model = data.model || formatModelName(file);
+// Function to format model name for display
+function formatModelName(modelName) {
+  return modelName.split('_').map(part =>
+    part.charAt(0).toUpperCase() + part.slice(1)
+  ).join(' ');
+}
 
-  // Combine all "Other" themes into one
-  const otherThemes = themes.filter(theme => theme.theme === "Other");
-  const nonOtherThemes = themes.filter(theme => theme.theme !== "Other");
+// Function to render a probability histogram from precomputed bins
+function renderHistogram(histogram) {
+  const max = Math.max(1, ...histogram);
+  const bars = histogram.map((count, bin) => `
+    <div class="column has-text-centered" title="${bin * 10}-${bin * 10 + 10}%: ${count}">
+      <div style="height: 60px; display: flex; align-items: flex-end">
+        <div style="width: 100%; height: ${(count / max * 100)}%; background-color: ${bin >= 7 ? '#48c78e' : bin >= 3 ? '#485fc7' : '#f14668'}"></div>
+      </div>
+      <small>${bin * 10}</small>
+    </div>
+  `).join('');
+  return `<div class="columns is-mobile is-gapless">${bars}</div>`;
+}
 
-  if (otherThemes.length > 0) {
-    const combinedOther = {
-      theme: "Other",
-      summary: "Other miscellaneous predictions that don't fit into the main categories.",
-      predictions: otherThemes.reduce((acc, theme) => acc.concat(theme.predictions), [])
-    };
-    nonOtherThemes.push(combinedOther);
-  }
+function loadStatistics($statsTab) {
+  searchSeq++;  // a pending search must not replace the tab
+  $('.tabs li').removeClass('is-active');
+  $statsTab.addClass('is-active');
+
+  const statsTemplate = document.getElementById('statistics-template');
+  const $stats = $(statsTemplate.content.cloneNode(true));
+  const $modelsStats = $stats.find('.models-stats');
+
+  // Create rows for 2x2 grid
+  let currentRow;
+  manifest.models.forEach((data, index) => {
+    if (index % 2 === 0) {
+      currentRow = $('<div class="columns is-desktop"></div>');
+      $modelsStats.append(currentRow);
+    }
 
-  const sortedThemes = [...nonOtherThemes].sort((a, b) => {
-    if (a.theme === "Other") return 1;
-    if (b.theme === "Other") return -1;
-    const countA = a.predictions ? a.predictions.length : 0;
-    const countB = b.predictions ? b.predictions.length : 0;
-    return countB - countA;
+    const total = data.count;
+    const $modelStats = $(`
+      <div class="column is-half">
+        <div class="box mb-4">
+          <h3 class="title is-5">${formatModelName(data.model)}</h3>
+          <div class="content">
+            <p><strong>Total Predictions:</strong> ${total}</p>
+            <p><strong>Number of Themes:</strong> ${data.theme_count}</p>
+            <div class="mb-2"><strong>Probability Distribution:</strong></div>
+            <div class="probability-bars">
+              <div class="columns is-gapless mb-1">
+                <div class="column is-2">Likely</div>
+                <div class="column">
+                  <div class="probability-bar" style="background-color: #48c78e; width: ${(data.likely / total * 100)}%">
+                    ${data.likely} (${Math.round(data.likely / total * 100)}%)
+                  </div>
+                </div>
+              </div>
+              <div class="columns is-gapless mb-1">
+                <div class="column is-2">Maybe</div>
+                <div class="column">
+                  <div class="probability-bar" style="background-color: #485fc7; width: ${(data.maybe / total * 100)}%">
+                    ${data.maybe} (${Math.round(data.maybe / total * 100)}%)
+                  </div>
+                </div>
+              </div>
+              <div class="columns is-gapless">
+                <div class="column is-2">Unlikely</div>
+                <div class="column">
+                  <div class="probability-bar" style="background-color: #f14668; width: ${(data.unlikely / total * 100)}%">
+                    ${data.unlikely} (${Math.round(data.unlikely / total * 100)}%)
+                  </div>
+                </div>
+              </div>
+            </div>
+            <div class="mt-4 mb-2"><strong>Probability Histogram (%):</strong></div>
+            ${renderHistogram(data.histogram)}
+          </div>
+        </div>
+      </div>
+    `);
+    currentRow.append($modelStats);
   });
 
-  setupThemeUI(sortedThemes, model);
+  $tabContent.empty().append($stats);
 }
 
-$(window).on('load', () => {
-  if (loaded) {
-    return;
-  }
-  loaded = true;
-
-  const $tabContainer = $('.tabs .tabs-ul');
-  $tabContent = $('#tab-content');
-
-  // Function to format model name for display
-  function formatModelName(modelName) {
-    return modelName.split('_').map(part =>
-      part.charAt(0).toUpperCase() + part.slice(1)
-    ).join(' ');
-  }
-
-  // Function to fetch all files from the output directory and filter for .json files
-  function fetchFilesFromDirectory() {
-    return [
-      "outputs/predictions_data_gemini-1.5-pro.json",
-      "outputs/predictions_data_claude-3.5-sonnet-20241022.json",
-      "outputs/predictions_data_gpt-4-turbo-preview.json",
-      "outputs/predictions_data_gpt-4o.json",
-    ];
-  }
+// Tokenize like search_index.tokenize so queries match the index
+function tokenize(text) {
+  return (text.toLowerCase().match(/[a-z0-9]+/g) || [])
+    .filter(token => token.length > 1 && !STOPWORDS.has(token));
+}
 
-  // Function to fetch data and create tab
-  function createTabFromFile(file, index) {
-    fetch(file)
+// Function to fetch a model's search index segment (once)
+function loadSegment(modelEntry) {
+  if (!segmentCache[modelEntry.id]) {
+    segmentCache[modelEntry.id] = fetch(`${SITE_DIR}/${modelEntry.search}`)
       .then(response => {
         if (!response.ok) {
           throw new Error(`HTTP error! status: ${response.status}`);
         }
-        return response.text();
+        return response.json();
       })
-      .then(text => {
-        try {
-          const data = JSON.parse(text);
-          const modelName = data.model;
-
-
-          const $tab = $('<li>').append(
-            $('<a>').html(`
-              <span class="icon is-small"><i class="fas fa-robot"></i></span>
-              <span>${formatModelName(modelName)}</span>
-            `)
-          ).on('click', () => loadData(file, $tab, index));
-
-          $tabContainer.append($tab);
-          return $tab;
-        } catch (e) {
-          console.error(`Error parsing JSON for file: ${file}`, e);
-        }
+      .then(segment => {
+        // Sorted keys allow a binary search for the prefix-matched last token
+        segment.keys = Object.keys(segment.postings).sort();
+        return segment;
       })
       .catch(error => {
-        console.error(`Error fetching file: ${file}`, error);
+        delete segmentCache[modelEntry.id];
+        throw error;
       });
   }
+  return segmentCache[modelEntry.id];
+}
 
-  // Get files from output directory
-  const filesFromOutput = fetchFilesFromDirectory();
+// Doc ids of all tokens starting with the prefix
+function prefixPostings(segment, prefix) {
+  const keys = segment.keys;
+  let low = 0;
+  let high = keys.length;
+  while (low < high) {
+    const mid = (low + high) >> 1;
+    if (keys[mid] < prefix) low = mid + 1; else high = mid;
+  }
+  const ids = new Set();
+  for (let i = low; i < keys.length && keys[i].startsWith(prefix); i++) {
+    segment.postings[keys[i]].forEach(id => ids.add(id));
+  }
+  return ids;
+}
 
-  // Preload all model data
-  const preloadPromises = filesFromOutput.map(file => {
-    return fetch(file)
-      .then(response => response.json())
-      .then(data => {
-        modelsData[data.model] = data;
-        return data;
-      })
-      .catch(error => {
-        console.error(`Error preloading data for ${file}:`, error);
-      });
+// Return [theme index, row index, bucket index] docs matching all tokens
+function searchSegment(segment, tokens, bucket) {
+  let matches = null;
+  tokens.forEach((token, position) => {
+    if (matches && matches.size === 0) return;
+    const ids = position === tokens.length - 1 ?
+      prefixPostings(segment, token) : new Set(segment.postings[token] || []);
+    matches = matches === null ? ids : new Set([...matches].filter(id => ids.has(id)));
   });
+  return [...(matches || [])].sort((a, b) => a - b)
+    .map(id => segment.docs[id])
+    .filter(doc => !bucket || segment.buckets[doc[2]] === bucket);
+}
 
-  // Ensure we have files to load
-  Promise.all(preloadPromises).then(() => {
-    if (filesFromOutput.length > 0) {
-      filesFromOutput.forEach((file, index) => {
-        createTabFromFile(file, index);
-      });
-
-      // Load the first tab's data
-      const firstFile = filesFromOutput[0];
-      fetch(firstFile)
-        .then(response => response.json())
-        .then(data => {
-          const firstTab = $('.tabs li').first();
-          loadData(firstFile, firstTab, 0);
-        })
-        .catch(error => {
-          console.error('Error loading first tab:', error);
-        });
-    } else {
-      console.error("No JSON files found in the outputs directory");
-      $('.tabs-ul').append('<li class="is-danger">No prediction files found</li>');
-    }
-
-    // Add statistics tab
-    const $statsTab = $('<li>').append(
-      $('<a>').html(`
-        <span class="icon is-small"><i class="fas fa-chart-bar"></i></span>
-        <span>Statistics</span>
-      `)
-    ).on('click', () => loadStatistics());
-
-    $tabContainer.append($statsTab);
-
-    function loadStatistics() {
-      $('.tabs li').removeClass('is-active');
-      $statsTab.addClass('is-active');
-
-      const statsTemplate = document.getElementById('statistics-template');
-      const $stats = $(statsTemplate.content.cloneNode(true));
-      const $modelsStats = $stats.find('.models-stats');
-
-      // Create rows for 2x2 grid
-      let currentRow;
-      Object.entries(modelsData).forEach(([modelName, data], index) => {
-        if (index % 2 === 0) {
-          currentRow = $('<div class="columns is-desktop"></div>');
-          $modelsStats.append(currentRow);
-        }
+// Function to run a search over the selected models and show the hits
+function runSearch() {
+  const seq = ++searchSeq;
+  const isStale = () => seq !== searchSeq;
+  const tokens = tokenize($('#search-input').val());
+  const bucket = $('#search-bucket').val();
+  const modelId = $('#search-model').val();
+  if (tokens.length === 0) {
+    const $active = $('.tabs li.is-active');
+    ($active.length ? $active : $('.tabs li').first()).trigger('click');
+    return;
+  }
 
-        const predictions = data.themes.flatMap(theme => theme.predictions);
-        const themes = data.themes.filter(theme => theme.theme !== "Other").length;
-
-        // Calculate probability distributions
-        const likelyCount = predictions.filter(p => p.probability >= 0.7).length;
-        const maybeCount = predictions.filter(p => p.probability >= 0.3 && p.probability < 0.7).length;
-        const unlikelyCount = predictions.filter(p => p.probability < 0.3).length;
-        const total = predictions.length;
-
-        const $modelStats = $(`
-          <div class="column is-half">
-            <div class="box mb-4">
-              <h3 class="title is-5">${formatModelName(modelName)}</h3>
-              <div class="content">
-                <p><strong>Total Predictions:</strong> ${total}</p>
-                <p><strong>Number of Themes:</strong> ${themes}</p>
-                <div class="mb-2"><strong>Probability Distribution:</strong></div>
-                <div class="probability-bars">
-                  <div class="columns is-gapless mb-1">
-                    <div class="column is-2">Likely</div>
-                    <div class="column">
-                      <div class="probability-bar" style="background-color: #48c78e; width: ${(likelyCount / total * 100)}%">
-                        ${likelyCount} (${Math.round(likelyCount / total * 100)}%)
-                      </div>
-                    </div>
-                  </div>
-                  <div class="columns is-gapless mb-1">
-                    <div class="column is-2">Maybe</div>
-                    <div class="column">
-                      <div class="probability-bar" style="background-color: #485fc7; width: ${(maybeCount / total * 100)}%">
-                        ${maybeCount} (${Math.round(maybeCount / total * 100)}%)
-                      </div>
-                    </div>
-                  </div>
-                  <div class="columns is-gapless">
-                    <div class="column is-2">Unlikely</div>
-                    <div class="column">
-                      <div class="probability-bar" style="background-color: #f14668; width: ${(unlikelyCount / total * 100)}%">
-                        ${unlikelyCount} (${Math.round(unlikelyCount / total * 100)}%)
-                      </div>
-                    </div>
-                  </div>
+  const models = manifest.models.filter(model => !modelId || model.id === modelId);
+  Promise.all(models.map(model => loadSegment(model).then(segment => ({
+    model,
+    docs: searchSegment(segment, tokens, bucket)
+  }))))
+    .then(results => {
+      if (isStale()) return null;
+      const total = results.reduce((sum, result) => sum + result.docs.length, 0);
+      const hits = [];
+      results.forEach(({ model, docs }) => {
+        docs.forEach(doc => hits.push({ model, doc }));
+      });
+      const shown = hits.slice(0, MAX_SEARCH_RESULTS);
+
+      // Only the shards that contain a shown hit are fetched
+      return Promise.all(shown.map(({ model, doc }) =>
+        loadThemeShard(model.themes[doc[0]]).then(theme => ({
+          model,
+          theme,
+          prediction: theme.predictions[doc[1]]
+        }))
+      )).then(rows => ({ rows, total }));
+    })
+    .then(found => {
+      // a newer search has started since, so its results win
+      if (!found || isStale()) return;
+      const { rows, total } = found;
+      const $results = $('<div class="container"></div>');
+      $results.append(`
+        <h2 class="title is-5 mb-4">${total} matching predictions${total > rows.length ? ` (showing ${rows.length})` : ''}</h2>
+      `);
+      rows.forEach(({ model, theme, prediction }) => {
+        const probability = parseFloat(prediction.probability);
+        const confidenceClass = probability >= 0.7 ? 'is-success' :
+          probability >= 0.3 ? 'is-info' : 'is-danger';
+        $results.append(`
+          <div class="prediction-box mb-4 ${confidenceClass}">
+            <div class="prediction-content">
+              <div class="prediction-header">
+                <div class="prediction-text">
+                  <span class="has-text-weight-medium">
+                    <i class="prediction-icon fas fa-user"></i> ${prediction.prediction}
+                  </span>
+                </div>
+                <div class="prediction-probability ${confidenceClass}">
+                  <span class="icon"><i class="fas fa-chart-line"></i></span>
+                  <span>${(probability * 100).toFixed(0)}%</span>
                 </div>
               </div>
+              <div class="prediction-justification ${confidenceClass}">
+                <span class="tag is-light mr-2">${formatModelName(model.model)}</span>
+                <span class="tag is-light mr-2">${theme.theme}</span>
+                <span><i class="fas fa-robot"></i> ${prediction.justification}</span>
+              </div>
             </div>
           </div>
         `);
-        currentRow.append($modelStats);
       });
+      $tabContent.empty().append($results);
+    })
+    .catch(error => {
+      if (isStale()) return;
+      console.error('Error searching predictions:', error);
+      showError($tabContent, `Error searching predictions: ${error.message}`);
+    });
+}
 
-      $tabContent.empty().append($stats);
-    }
-  });
-});
\ No newline at end of file
+$(window).on('load', () => {
+  if (loaded) {
+    return;
+  }
+  loaded = true;
+
+  const $tabContainer = $('.tabs .tabs-ul');
+  $tabContent = $('#tab-content');
+
+  // First paint only needs the manifest; theme shards load on demand
+  fetch(`${SITE_DIR}/manifest.json`)
+    .then(response => {
+      if (!response.ok) {
+        throw new Error(`HTTP error! status: ${response.status}`);
+      }
+      return response.json();
+    })
+    .then(data => {
+      manifest = data;
+
+      if (manifest.models.length === 0) {
+        console.error("No models found in the manifest");
+        $tabContainer.append('<li class="is-danger">No prediction files found</li>');
+        return;
+      }
+
+      manifest.models.forEach(modelEntry => {
+        const $tab = $('<li>').append(
+          $('<a>').html(`
+            <span class="icon is-small"><i class="fas fa-robot"></i></span>
+            <span>${formatModelName(modelEntry.model)}</span>
+          `)
+        ).on('click', () => loadData(modelEntry, $tab));
+        $tabContainer.append($tab);
+      });
+
+      // Add statistics tab
+      const $statsTab = $('<li>').append(
+        $('<a>').html(`
+          <span class="icon is-small"><i class="fas fa-chart-bar"></i></span>
+          <span>Statistics</span>
+        `)
+      ).on('click', () => loadStatistics($statsTab));
+      $tabContainer.append($statsTab);
+
+      // Search segments are only fetched once the user starts searching
+      manifest.models.forEach(modelEntry => {
+        $('#search-model').append($('<option>').val(modelEntry.id).text(formatModelName(modelEntry.model)));
+      });
+      let searchTimer;
+      $('#search-input').on('input', () => {
+        clearTimeout(searchTimer);
+        searchTimer = setTimeout(runSearch, 150);
+      });
+      $('#search-bucket, #search-model').on('change', runSearch);
+
+      loadData(manifest.models[0], $tabContainer.find('li').first());
+    })
+    .catch(error => {
+      console.error('Error loading manifest:', error);
+      showError($tabContent, `Error loading predictions: ${error.message}`);
+    });
+});
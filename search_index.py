@@ -0,0 +1,138 @@
+"""Compact inverted index over the viewer's predictions.
+
+The index is split into one segment per model under ``outputs/site/search/``
+so a model can be re-indexed without touching the others. A segment holds:
+
+    docs      [theme index, row index, bucket index] per prediction; the
+              theme index points into the model's theme list in the manifest
+              and the row into that theme's shard
+    postings  token -> sorted doc ids
+
+Facets (probability bucket, model) are resolved from ``docs`` and the segment
+itself, so the viewer can search without downloading any theme shard.
+"""
+
+import argparse
+import json
+import re
+from collections import defaultdict
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple
+
+BUCKETS = ["likely", "maybe", "unlikely"]
+_TOKEN = re.compile(r"[a-z0-9]+")
+STOPWORDS = frozenset(
+    "a an and are as at be been but by for from has have in into is it its of on "
+    "or that the their there this to was were will with".split()
+)
+
+
+def tokenize(text: str) -> List[str]:
+    """Lowercase word tokens without stopwords and single characters."""
+    return [
+        token
+        for token in _TOKEN.findall(text.lower())
+        if len(token) > 1 and token not in STOPWORDS
+    ]
+
+
+def build_segment(
+    model_id: str, rows: Iterable[Tuple[int, int, str, str, str]]
+) -> Dict:
+    """Index one model's predictions.
+
+    Args:
+        model_id: Id of the model in the manifest
+        rows: (theme index, row index, theme name, prediction text, bucket)
+    """
+    docs = []
+    postings = defaultdict(list)
+    for theme_index, row_index, theme_name, text, bucket in rows:
+        doc_id = len(docs)
+        docs.append([theme_index, row_index, BUCKETS.index(bucket)])
+        for token in set(tokenize(f"{text} {theme_name}")):
+            postings[token].append(doc_id)
+    return {
+        "model": model_id,
+        "buckets": BUCKETS,
+        "docs": docs,
+        "postings": dict(sorted(postings.items())),
+    }
+
+
+def segment_path(model_id: str) -> str:
+    """Path of a model's segment relative to the site directory."""
+    return f"search/{model_id}.json"
+
+
+def update_search_index(
+    site_dir: Path, model_id: str, rows: Iterable[Tuple[int, int, str, str, str]]
+) -> str:
+    """(Re)write the segment of one model and return its relative path."""
+    path = segment_path(model_id)
+    (site_dir / "search").mkdir(parents=True, exist_ok=True)
+    with open(site_dir / path, "w") as f:
+        json.dump(build_segment(model_id, rows), f, separators=(",", ":"))
+    return path
+
+
+def remove_stale_segments(site_dir: Path, model_ids: Iterable[str]):
+    """Delete segments of models that are no longer in the manifest."""
+    keep = {Path(segment_path(model_id)).name for model_id in model_ids}
+    for path in (site_dir / "search").glob("*.json"):
+        if path.name not in keep:
+            path.unlink()
+
+
+def search(segment: Dict, query: str, bucket: Optional[str] = None) -> List[List[int]]:
+    """Return the docs of a segment matching every query token.
+
+    The last token matches as a prefix so results update while typing.
+    """
+    tokens = tokenize(query)
+    if not tokens:
+        return []
+    postings = segment["postings"]
+    matches = None
+    for position, token in enumerate(tokens):
+        if position == len(tokens) - 1:
+            ids = {
+                i for key, ids in postings.items() if key.startswith(token) for i in ids
+            }
+        else:
+            ids = set(postings.get(token, []))
+        matches = ids if matches is None else matches & ids
+        if not matches:
+            return []
+    docs = [segment["docs"][i] for i in sorted(matches)]
+    if bucket:
+        docs = [doc for doc in docs if segment["buckets"][doc[2]] == bucket]
+    return docs
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Query the viewer's search index")
+    parser.add_argument("query", type=str)
+    parser.add_argument("--site-dir", type=str, default="outputs/site")
+    parser.add_argument("--bucket", choices=BUCKETS, default=None)
+    parser.add_argument("--model", type=str, default=None, help="Model id")
+    args = parser.parse_args()
+
+    site_dir = Path(args.site_dir)
+    with open(site_dir / "manifest.json", "r") as f:
+        manifest = json.load(f)
+    for model in manifest["models"]:
+        if args.model and model["id"] != args.model:
+            continue
+        with open(site_dir / model["search"], "r") as f:
+            docs = search(json.load(f), args.query, args.bucket)
+        print(f"{model['id']}: {len(docs)} matches")
+        for theme_index, row_index, bucket_index in docs[:10]:
+            theme = model["themes"][theme_index]
+            with open(site_dir / theme["shard"], "r") as f:
+                prediction, probability, _ = json.load(f)["predictions"][row_index]
+            print(f"  [{BUCKETS[bucket_index]} {probability}] {prediction}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,404 @@
+"""Local OpenAI-compatible stand-in server for load testing the model layer.
+
+Replays recorded responses (or synthesizes schema-valid ones) for the prompts in
+prompts.py, with tunable latency, stalls and 429 behaviour, so the retry, hedging and
+failover paths can be exercised end to end without network access:
+
+    python stub_server.py --port 8765 --latency 0.5 --rate-limit-rate 0.1
+    python run_analysis.py --model local --api-base http://127.0.0.1:8765/v1
+
+Recordings are JSONL, one response per line. A line is used when its
+``prompt_sha256`` equals the sha256 of the prompt, or when its ``match``
+substring occurs in the prompt. Lines without either act as catch-alls:
+
+    {"match": "Comments to Evaluate", "content": "{\\"is_noisy\\": [false]}"}
+"""
+
+import argparse
+import hashlib
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional
+
+
+def load_recordings(path: Optional[str]) -> List[Dict]:
+    """Load recorded responses from a JSONL file."""
+    if not path:
+        return []
+    recordings = []
+    with open(path, "r") as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                recordings.append(json.loads(line))
+    return recordings
+
+
+def _section_lines(prompt: str, marker: str) -> List[str]:
+    """Return the non-empty lines following a section marker of a prompt."""
+    _, _, tail = prompt.partition(marker)
+    return [line.strip() for line in tail.splitlines() if line.strip()]
+
+
+def _stable_fraction(text: str) -> float:
+    """Deterministic pseudo-random value in [0, 1) derived from the text."""
+    return int(hashlib.md5(text.encode()).hexdigest()[:8], 16) / 0xFFFFFFFF
+
+
+def synthesize_response(prompt: str) -> str:
+    """Build a schema-valid response for one of the pipeline prompts."""
+    if '"comments": [' in prompt:
+        comments = _section_lines(prompt, "Comments to Evaluate:")
+        return json.dumps(
+            {
+                "comments": [
+                    {
+                        "is_noisy": _stable_fraction(c) < 0.3,
+                        "predictions": (
+                            []
+                            if _stable_fraction(c) < 0.3
+                            else [
+                                {
+                                    "prediction": c.split(". ")[0][:200],
+                                    "probability": round(_stable_fraction(c), 2),
+                                    "justification": "Synthetic evaluation",
+                                }
+                            ]
+                        ),
+                    }
+                    for c in comments
+                ]
+            }
+        )
+    if '"is_noisy"' in prompt:
+        comments = _section_lines(prompt, "Comments to Evaluate:")
+        return json.dumps({"is_noisy": [_stable_fraction(c) < 0.3 for c in comments]})
+    if "Combine them into a single theme" in prompt:
+        names = [line.split(":")[0] for line in _section_lines(prompt, "Themes:")]
+        return json.dumps(
+            {
+                "theme": " & ".join(sorted(set(names))),
+                "summary": f"Synthetic merge of {len(names)} themes",
+            }
+        )
+    if '"themes"' in prompt:
+        statements = _section_lines(prompt, "Predictions and evaluations:")
+        themes = {}
+        for statement in statements:
+            name = f"Theme {int(_stable_fraction(statement) * 3) + 1}"
+            themes.setdefault(name, []).append(statement)
+        return json.dumps(
+            {
+                "themes": [
+                    {
+                        "theme": name,
+                        "summary": f"Synthetic theme with {len(items)} statements",
+                        "predictions": items,
+                    }
+                    for name, items in themes.items()
+                ]
+            }
+        )
+    if '"predictions"' in prompt:
+        comments = _section_lines(prompt, "Comments to Evaluate:")
+        return json.dumps(
+            {
+                "predictions": [
+                    {
+                        "prediction": comment.split(". ")[0][:200],
+                        "probability": round(_stable_fraction(comment), 2),
+                        "justification": "Synthetic evaluation",
+                    }
+                    for comment in comments
+                ]
+            }
+        )
+    return "{}"
+
+
+class StubState:
+    """Shared configuration and counters of a running stand-in server."""
+
+    def __init__(
+        self,
+        recordings: List[Dict],
+        latency: float = 0.0,
+        jitter: float = 0.0,
+        rate_limit_rate: float = 0.0,
+        rpm: int = 0,
+        retry_after: float = 1.0,
+        seed: Optional[int] = None,
+        chunk_size: int = 16,
+        chunk_latency: float = 0.0,
+        truncate_rate: float = 0.0,
+        stall_rate: float = 0.0,
+        stall_time: float = 30.0,
+    ):
+        self.recordings = recordings
+        self.latency = latency
+        self.jitter = jitter
+        self.rate_limit_rate = rate_limit_rate
+        self.rpm = rpm
+        self.retry_after = retry_after
+        self.chunk_size = chunk_size
+        self.chunk_latency = chunk_latency
+        self.truncate_rate = truncate_rate
+        self.stall_rate = stall_rate
+        self.stall_time = stall_time
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.request_times: List[float] = []
+        self.stats = {"requests": 0, "rate_limited": 0, "replayed": 0}
+
+    def should_rate_limit(self) -> bool:
+        """Decide whether the current request gets a 429."""
+        with self.lock:
+            self.stats["requests"] += 1
+            now = time.monotonic()
+            limited = self.random.random() < self.rate_limit_rate
+            if self.rpm:
+                self.request_times = [t for t in self.request_times if now - t < 60]
+                limited = limited or len(self.request_times) >= self.rpm
+            if limited:
+                self.stats["rate_limited"] += 1
+            else:
+                self.request_times.append(now)
+            return limited
+
+    def delay(self) -> float:
+        with self.lock:
+            jitter = self.random.uniform(-self.jitter, self.jitter)
+            if self.random.random() < self.stall_rate:
+                return self.stall_time
+        return max(0.0, self.latency + jitter)
+
+    def response_for(self, prompt: str) -> str:
+        """Return the recorded response for a prompt, or synthesize one."""
+        digest = hashlib.sha256(prompt.encode()).hexdigest()
+        for recording in self.recordings:
+            if recording.get("prompt_sha256") == digest or (
+                "match" in recording and recording["match"] in prompt
+            ):
+                break
+        else:
+            recording = next(
+                (
+                    r
+                    for r in self.recordings
+                    if "match" not in r and "prompt_sha256" not in r
+                ),
+                None,
+            )
+        if recording is None:
+            return synthesize_response(prompt)
+        with self.lock:
+            self.stats["replayed"] += 1
+        return recording["content"]
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    state: StubState = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def handle_one_request(self):
+        try:
+            super().handle_one_request()
+        except (BrokenPipeError, ConnectionResetError):
+            # the client stopped waiting, e.g. for a stalled request
+            self.close_connection = True
+
+    def _send_json(self, status: int, payload: dict, headers: Dict = None):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_stream(self, request: dict, content: str):
+        """Send the content as server-sent events, truncated when configured."""
+        if self.state.truncate_rate and self.state.random.random() < (
+            self.state.truncate_rate
+        ):
+            content = content[: len(content) // 2]
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.end_headers()
+        base = {
+            "id": f"chatcmpl-stub-{self.state.stats['requests']}",
+            "object": "chat.completion.chunk",
+            "created": int(time.time()),
+            "model": request.get("model", "stub"),
+        }
+        size = max(1, self.state.chunk_size)
+        for start in range(0, len(content), size):
+            event = dict(
+                base,
+                choices=[
+                    {
+                        "index": 0,
+                        "delta": {"content": content[start : start + size]},
+                        "finish_reason": None,
+                    }
+                ],
+            )
+            self.wfile.write(f"data: {json.dumps(event)}\n\n".encode())
+            self.wfile.flush()
+            if self.state.chunk_latency:
+                time.sleep(self.state.chunk_latency)
+        final = dict(base, choices=[{"index": 0, "delta": {}, "finish_reason": "stop"}])
+        self.wfile.write(f"data: {json.dumps(final)}\n\ndata: [DONE]\n\n".encode())
+        self.wfile.flush()
+
+    def do_GET(self):
+        if self.path.rstrip("/").endswith("/models"):
+            self._send_json(200, {"object": "list", "data": [{"id": "stub"}]})
+        elif self.path.rstrip("/").endswith("/stats"):
+            self._send_json(200, self.state.stats)
+        else:
+            self._send_json(404, {"error": {"message": "not found"}})
+
+    def do_POST(self):
+        if not self.path.rstrip("/").endswith("/chat/completions"):
+            self._send_json(404, {"error": {"message": "not found"}})
+            return
+
+        length = int(self.headers.get("Content-Length", 0))
+        request = json.loads(self.rfile.read(length) or b"{}")
+        prompt = "\n".join(m.get("content") or "" for m in request.get("messages", []))
+
+        time.sleep(self.state.delay())
+        if self.state.should_rate_limit():
+            self._send_json(
+                429,
+                {
+                    "error": {
+                        "message": "Rate limit exceeded (stub)",
+                        "type": "rate_limit_error",
+                    }
+                },
+                headers={"Retry-After": str(self.state.retry_after)},
+            )
+            return
+
+        content = self.state.response_for(prompt)
+        if request.get("stream"):
+            self._send_stream(request, content)
+            return
+        self._send_json(
+            200,
+            {
+                "id": f"chatcmpl-stub-{self.state.stats['requests']}",
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": request.get("model", "stub"),
+                "choices": [
+                    {
+                        "index": 0,
+                        "message": {"role": "assistant", "content": content},
+                        "finish_reason": "stop",
+                    }
+                ],
+                "usage": {
+                    "prompt_tokens": len(prompt) // 4,
+                    "completion_tokens": len(content) // 4,
+                    "total_tokens": (len(prompt) + len(content)) // 4,
+                },
+            },
+        )
+
+
+def make_server(
+    state: StubState, host: str = "127.0.0.1", port: int = 8765
+) -> ThreadingHTTPServer:
+    """Create (but do not start) a stand-in server bound to host:port."""
+    handler = type("BoundStubHandler", (StubHandler,), {"state": state})
+    return ThreadingHTTPServer((host, port), handler)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Local OpenAI-compatible stand-in server"
+    )
+    parser.add_argument("--host", type=str, default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument(
+        "--recordings", type=str, help="JSONL file with recorded responses"
+    )
+    parser.add_argument(
+        "--latency", type=float, default=0.0, help="Mean response latency (s)"
+    )
+    parser.add_argument(
+        "--jitter", type=float, default=0.0, help="Uniform latency jitter (s)"
+    )
+    parser.add_argument(
+        "--rate-limit-rate",
+        type=float,
+        default=0.0,
+        help="Fraction of requests answered with 429",
+    )
+    parser.add_argument(
+        "--rpm", type=int, default=0, help="Requests per minute before 429s"
+    )
+    parser.add_argument(
+        "--retry-after", type=float, default=1.0, help="Retry-After sent with 429s"
+    )
+    parser.add_argument("--seed", type=int, help="Seed for latency and 429 draws")
+    parser.add_argument(
+        "--chunk-size", type=int, default=16, help="Characters per streamed chunk"
+    )
+    parser.add_argument(
+        "--chunk-latency", type=float, default=0.0, help="Delay between chunks (s)"
+    )
+    parser.add_argument(
+        "--truncate-rate",
+        type=float,
+        default=0.0,
+        help="Fraction of streamed responses cut off halfway",
+    )
+    parser.add_argument(
+        "--stall-rate",
+        type=float,
+        default=0.0,
+        help="Fraction of requests that stall for --stall-time",
+    )
+    parser.add_argument(
+        "--stall-time", type=float, default=30.0, help="Duration of a stall (s)"
+    )
+    args = parser.parse_args()
+
+    state = StubState(
+        load_recordings(args.recordings),
+        latency=args.latency,
+        jitter=args.jitter,
+        rate_limit_rate=args.rate_limit_rate,
+        rpm=args.rpm,
+        retry_after=args.retry_after,
+        seed=args.seed,
+        chunk_size=args.chunk_size,
+        chunk_latency=args.chunk_latency,
+        truncate_rate=args.truncate_rate,
+        stall_rate=args.stall_rate,
+        stall_time=args.stall_time,
+    )
+    server = make_server(state, args.host, args.port)
+    print(f"Stub server listening on http://{args.host}:{args.port}/v1")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        print(f"Served {state.stats}")
+
+
+if __name__ == "__main__":
+    main()
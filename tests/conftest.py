@@ -0,0 +1,40 @@
+import sys
+from pathlib import Path
+
+import pytest
+
+# the modules live at the repository root, next to this directory
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from cache_manager import CacheManager  # noqa: E402
+from models.base_model import BaseAIModel  # noqa: E402
+
+
+class FakeModel(BaseAIModel):
+    """Answers every prompt with `answer(prompt, response_format)` and records
+    the prompts it was sent. `fallbacks` are extra cache names, as a
+    FailoverModel reads its fallbacks' entries."""
+
+    def __init__(self, answer=None, model_name: str = "fake", fallbacks=()):
+        super().__init__(model_name)
+        self.answer = answer
+        self.fallbacks = list(fallbacks)
+        self.prompts = []
+
+    @property
+    def cache_names(self):
+        return [self.model_name] + self.fallbacks
+
+    def generate_text(self, prompt, response_format=None):
+        self.prompts.append(prompt)
+        return self.answer(prompt, response_format) if self.answer else None
+
+
+@pytest.fixture
+def cache_manager(tmp_path):
+    return CacheManager(tmp_path / "cache")
+
+
+@pytest.fixture
+def fake_model():
+    return FakeModel
@@ -0,0 +1,119 @@
+from analyse_predictions import (
+    comment_cache_key,
+    comment_sub_batch,
+    load_batch_flags,
+    load_batch_predictions,
+    load_comment_flags,
+    single_comment_keys,
+)
+from records import CommentRecord, PredictionRecord, predictions_to_cache
+
+PARENT = CommentRecord("The parent", "p", None, 0)
+BATCH = [
+    CommentRecord("First reply", "a", "p", 1),
+    CommentRecord("Reply to the first", "b", "a", 2),
+    CommentRecord("Second reply", "c", "p", 1),
+]
+
+
+def _prediction(text):
+    return PredictionRecord(text, 0.5, "because")
+
+
+def _cache_per_comment(cache_manager, model, step, values, context=[PARENT]):
+    for key, value in zip(single_comment_keys(BATCH, context), values):
+        if value is not None:
+            cache_manager.save_cache(model.model_name, step, key, value)
+
+
+def test_single_comment_keys_include_parents_inside_and_outside_the_batch():
+    keys = single_comment_keys(BATCH, [PARENT])
+    assert keys[0] == comment_cache_key([BATCH[0]], [PARENT])
+    assert keys[1] == comment_cache_key([BATCH[1]], [BATCH[0]])
+    assert keys[2] == comment_cache_key([BATCH[2]], [PARENT])
+    # without thread context every key is the comment on its own
+    assert single_comment_keys(BATCH) == [[c] for c in BATCH]
+
+
+def test_comment_sub_batch_keeps_parents_as_context():
+    sub_batch, sub_context = comment_sub_batch(BATCH, [PARENT], [1, 2])
+    assert sub_batch == BATCH[1:]
+    assert sub_context == [BATCH[0], PARENT]
+    assert (
+        single_comment_keys(sub_batch, sub_context)
+        == single_comment_keys(BATCH, [PARENT])[1:]
+    )
+
+
+def test_load_batch_predictions_reassembles_per_comment_entries(
+    cache_manager, fake_model
+):
+    model = fake_model()
+    _cache_per_comment(
+        cache_manager,
+        model,
+        "predictions",
+        [predictions_to_cache([_prediction("one"), _prediction("two")]), [], None],
+    )
+    assert load_batch_predictions(BATCH, [PARENT], model, cache_manager) is None
+
+    _cache_per_comment(
+        cache_manager,
+        model,
+        "predictions",
+        [None, None, predictions_to_cache([_prediction("three")])],
+    )
+    predictions = load_batch_predictions(BATCH, [PARENT], model, cache_manager)
+    assert [(p.prediction, p.comment_id) for p in predictions] == [
+        ("one", "a"),
+        ("two", "a"),
+        ("three", "c"),
+    ]
+    # the reassembled batch is cached under its own key
+    cached = cache_manager.load_cache(
+        model.cache_names, "predictions", comment_cache_key(BATCH, [PARENT])
+    )
+    assert [p["comment_id"] for p in cached] == ["a", "a", "c"]
+    assert model.prompts == []
+
+
+def test_load_batch_predictions_credits_fallback_entries(cache_manager, fake_model):
+    primary = fake_model(model_name="primary", fallbacks=["backup"])
+    _cache_per_comment(cache_manager, primary, "predictions", [[], [], None])
+    cache_manager.save_cache(
+        "backup",
+        "predictions",
+        single_comment_keys(BATCH, [PARENT])[2],
+        predictions_to_cache([_prediction("late")]),
+    )
+    predictions = load_batch_predictions(BATCH, [PARENT], primary, cache_manager)
+    assert [(p.prediction, p.answered_by) for p in predictions] == [("late", "backup")]
+    # answers of another model never land in the primary's batch entry
+    key = comment_cache_key(BATCH, [PARENT])
+    assert cache_manager.load_cache("primary", "predictions", key) is None
+
+
+def test_load_comment_flags_uses_cached_sub_batch(cache_manager, fake_model):
+    model = fake_model()
+    _cache_per_comment(cache_manager, model, "noisy_comments", [[True], None, None])
+    assert (
+        load_comment_flags(
+            BATCH, [PARENT], model, cache_manager, classify_missing=False
+        )
+        is None
+    )
+    assert load_batch_flags(BATCH, [PARENT], model, cache_manager) is None
+
+    sub_batch, sub_context = comment_sub_batch(BATCH, [PARENT], [1, 2])
+    cache_manager.save_cache(
+        model.model_name,
+        "noisy_comments",
+        comment_cache_key(sub_batch, sub_context),
+        [False, True],
+    )
+    assert load_batch_flags(BATCH, [PARENT], model, cache_manager) == [
+        True,
+        False,
+        True,
+    ]
+    assert model.prompts == []
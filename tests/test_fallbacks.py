@@ -0,0 +1,71 @@
+import json
+
+from fallbacks import IncrementalItemParser, parse_response, repair_json
+from schemas import CommentClassification, PredictionEvaluation
+
+ITEM = '{"prediction": "X happens", "probability": 0.7, "justification": "because"}'
+
+
+def test_repair_json_fixes_common_issues():
+    text = 'Sure! ```json\n{predictions: [{\'prediction\': "it\'s "big"", probability: .5, justification: None,},]}\n```'
+    repaired, truncated = repair_json(text)
+    assert not truncated
+    assert json.loads(repaired) == {
+        "predictions": [
+            {"prediction": 'it\'s "big"', "probability": 0.5, "justification": None}
+        ]
+    }
+
+
+def test_repair_json_keeps_complete_items_of_truncated_output():
+    repaired, truncated = repair_json(f'{{"predictions": [{ITEM}, {{"prediction": "cut')
+    assert truncated
+    assert json.loads(repaired) == {"predictions": [json.loads(ITEM)]}
+
+
+def test_repair_json_starts_at_given_bracket():
+    text = f'See [1]: {{"predictions": [{ITEM}]}}'
+    assert json.loads(repair_json(text)[0]) == [1]
+    assert json.loads(repair_json(text, text.index("{"))[0])["predictions"]
+
+
+def test_parse_response_skips_brackets_in_prose():
+    response = parse_response(
+        f'Here is [the] output: {{"predictions": [{ITEM}]}}', PredictionEvaluation
+    )
+    assert [p.prediction for p in response.predictions] == ["X happens"]
+
+    flags = parse_response(
+        'Flags [for 2 comments]: {"is_noisy": [true, false]}', CommentClassification
+    )
+    assert flags.is_noisy == [True, False]
+
+
+def test_parse_response_drops_invalid_items():
+    text = f'{{"predictions": [{ITEM}, {{"prediction": "no probability"}}]}}'
+    response = parse_response(text, PredictionEvaluation)
+    assert len(response.predictions) == 1
+
+
+def test_parse_response_without_json():
+    assert parse_response("no json here", PredictionEvaluation) is None
+    assert parse_response("", PredictionEvaluation) is None
+
+
+def test_incremental_parser_emits_items_as_they_complete():
+    text = f'Here is [the] output: {{"predictions": [{ITEM}, {ITEM}, {ITEM[:30]}'
+    parser = IncrementalItemParser(PredictionEvaluation)
+    split = text.index("}") + 1
+    assert len(parser.feed(text[:split])) == 1
+    assert len(parser.feed(text[split:])) == 1
+    assert parser.finish() == []
+    assert parser.emitted == 2
+
+
+def test_incremental_parser_finish_recovers_malformed_stream():
+    parser = IncrementalItemParser(PredictionEvaluation)
+    items = parser.feed("{'predictions': [{'prediction': 'Y', ")
+    items += parser.feed("'probability': 0.2, 'justification': 'j'}]}")
+    assert items == []
+    assert [p.prediction for p in parser.finish()] == ["Y"]
+    assert parser.complete
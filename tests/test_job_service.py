@@ -0,0 +1,83 @@
+import pytest
+
+from job_service import JobQueue
+
+
+@pytest.fixture
+def queue(tmp_path):
+    queue = JobQueue(str(tmp_path / "jobs.db"), max_attempts=2)
+    yield queue
+    queue.close()
+
+
+def _unit_status(queue, job_id):
+    return queue.job_status(job_id)["steps"]["fetch"]
+
+
+def test_claimed_unit_is_not_handed_out_twice(queue):
+    job_id = queue.submit("123", "local")
+    unit = queue.claim("w1")
+    assert unit["job_id"] == job_id and unit["step"] == "fetch"
+    assert unit["payload"] == {"thread_id": "123"}
+    assert queue.claim("w2") is None
+    assert queue.job_status(job_id)["status"] == "running"
+    assert queue.heartbeat(unit["unit_id"], "w1")
+    assert not queue.heartbeat(unit["unit_id"], "w2")
+
+
+def test_expired_lease_is_taken_over(queue):
+    job_id = queue.submit("123", "local")
+    unit = queue.claim("w1", lease=-1)
+    taken = queue.claim("w2")
+    assert taken["unit_id"] == unit["unit_id"]
+    # the first worker lost the unit, so its late calls are refused
+    assert not queue.heartbeat(unit["unit_id"], "w1")
+    assert not queue.complete(unit["unit_id"], "w1", [])
+    assert not queue.fail(unit["unit_id"], "w1", "late")
+    assert any(
+        "lease of w1 expired" in event["message"] for event in queue.events(job_id)
+    )
+
+
+def test_lease_expiry_fails_job_after_max_attempts(queue):
+    job_id = queue.submit("123", "local")
+    queue.claim("w1", lease=-1)
+    queue.claim("w2", lease=-1)
+    assert queue.claim("w3") is None
+    status = queue.job_status(job_id)
+    assert status["status"] == "failed"
+    assert "lease expired" in status["error"]
+    assert _unit_status(queue, job_id) == {"failed": 1}
+
+
+def test_failed_unit_is_requeued_until_max_attempts(queue):
+    job_id = queue.submit("123", "local")
+    unit = queue.claim("w1")
+    assert queue.fail(unit["unit_id"], "w1", "timeout")
+    assert _unit_status(queue, job_id) == {"pending": 1}
+
+    retry = queue.claim("w2")
+    assert retry["unit_id"] == unit["unit_id"]
+    assert queue.fail(retry["unit_id"], "w2", "timeout again")
+    status = queue.job_status(job_id)
+    assert status["status"] == "failed"
+    assert "after 2 attempts: timeout again" in status["error"]
+    assert queue.claim("w3") is None
+
+
+def test_completed_step_plans_the_next(queue):
+    job_id = queue.submit("123", "local", options={"batch_size": 2})
+    unit = queue.claim("w1")
+    comments = [{"text": f"comment {i}", "id": str(i)} for i in range(3)]
+    assert queue.complete(unit["unit_id"], "w1", comments)
+    # a completed unit can't be completed again
+    assert not queue.complete(unit["unit_id"], "w1", comments)
+
+    units = [queue.claim("w1"), queue.claim("w2")]
+    assert [u["step"] for u in units] == ["filter", "filter"]
+    assert [len(u["payload"]["batch"]) for u in units] == [2, 1]
+    assert queue.claim("w3") is None
+    assert queue.job_status(job_id)["steps"] == {
+        "fetch": {"done": 1},
+        "filter": {"claimed": 2},
+    }
@@ -0,0 +1,86 @@
+import numpy as np
+import pytest
+
+import analyse_predictions
+from analyse_predictions import reduce_themes
+from prompts import OTHER_SUMMARY, OTHER_THEME
+from schemas import Theme, ThemeSummary
+
+# theme name -> direction of its "name: summary" embedding
+DIRECTIONS = {
+    "AI jobs": [1.0, 0.0, 0.0],
+    "AI employment": [0.98, 0.2, 0.0],
+    "Automation of work": [0.9, 0.43, 0.0],
+    "Climate": [0.0, 0.0, 1.0],
+}
+
+
+@pytest.fixture(autouse=True)
+def fake_embeddings(monkeypatch):
+    def embed_texts(texts, compact=False):
+        rows = np.array([DIRECTIONS[text.split(":")[0]] for text in texts])
+        return (rows / np.linalg.norm(rows, axis=1, keepdims=True)).astype(np.float32)
+
+    monkeypatch.setattr(analyse_predictions, "embed_texts", embed_texts)
+
+
+def _theme(name, predictions, cluster_id):
+    return Theme(
+        theme=name, summary="summary", predictions=predictions, cluster_id=cluster_id
+    )
+
+
+def _merged(prompt, response_format):
+    assert response_format is ThemeSummary
+    return ThemeSummary(theme="Merged", summary="merged summary")
+
+
+def test_similar_themes_merge_and_others_fold(cache_manager, fake_model):
+    model = fake_model(_merged)
+    themes = [
+        _theme("AI jobs", ["p1", "p2"], "0"),
+        _theme("Other", ["p3"], "0"),
+        _theme("AI employment", ["p2", "p4"], "-1"),
+        _theme("Climate", ["p5"], "1"),
+        _theme(" other ", ["p3", "p6"], "1"),
+    ]
+    reduced = reduce_themes(themes, model, cache_manager, merge_threshold=0.95)
+
+    assert [t.theme for t in reduced] == ["Merged", "Climate", OTHER_THEME]
+    merged, climate, other = reduced
+    assert merged.predictions == ["p1", "p2", "p4"]
+    # noise cluster (-1) themes merge like any other
+    assert merged.cluster_ids == ["0", "-1"] and merged.cluster_id is None
+    assert climate.predictions == ["p5"]
+    assert other.summary == OTHER_SUMMARY
+    assert other.predictions == ["p3", "p6"]
+    assert len(model.prompts) == 1
+
+    # the merged name is cached, so a rerun sends nothing
+    reduce_themes(themes, model, cache_manager, merge_threshold=0.95)
+    assert len(model.prompts) == 1
+
+
+def test_complete_linkage_does_not_chain(cache_manager, fake_model):
+    # "AI jobs" ~ "AI employment" ~ "Automation of work", but the ends are
+    # below the threshold, so only one neighbour joins each group
+    themes = [
+        _theme("AI jobs", ["p1"], "0"),
+        _theme("AI employment", ["p2"], "1"),
+        _theme("Automation of work", ["p3"], "2"),
+    ]
+    reduced = reduce_themes(themes, fake_model(_merged), cache_manager, 0.95)
+    assert len(reduced) == 2
+    assert sorted(len(t.predictions) for t in reduced) == [1, 2]
+
+
+def test_failed_merge_keeps_largest_theme_name(cache_manager, fake_model, monkeypatch):
+    monkeypatch.setattr("models.base_model.time.sleep", lambda seconds: None)
+    themes = [
+        _theme("AI jobs", ["p1"], "0"),
+        _theme("AI employment", ["p2", "p3"], "1"),
+    ]
+    reduced = reduce_themes(themes, fake_model(), cache_manager, 0.95)
+    assert [(t.theme, t.predictions) for t in reduced] == [
+        ("AI employment", ["p1", "p2", "p3"])
+    ]
@@ -0,0 +1,165 @@
+"""Vectorized similarity helpers shared by the embedding based stages.
+
+All similarity searches run as blocked matrix multiplies over L2-normalized
+float32 rows, so memory stays bounded at ``block_size x n`` and no Python loop
+runs per pair. Compact rows (the float16 or int8 rows of an EmbeddingStore)
+are accepted too; they are normalized to float32 one block at a time.
+"""
+
+from typing import List, Optional, Tuple
+
+import numpy as np
+from scipy.cluster.hierarchy import fcluster, linkage
+from scipy.sparse import coo_matrix
+from scipy.sparse.csgraph import connected_components
+
+
+def normalize_rows(vectors) -> np.ndarray:
+    """Return the rows scaled to unit length, as float32."""
+    vectors = np.asarray(vectors, dtype=np.float32)
+    if vectors.ndim == 1:
+        vectors = vectors[None, :]
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+def _unit_rows(rows: np.ndarray) -> np.ndarray:
+    return rows if rows.dtype == np.float32 else normalize_rows(rows)
+
+
+def _column_blocks(b: np.ndarray, start: int, block_size: int):
+    """Yield (offset, unit rows) of b from `start` on: all at once for float32
+    rows, in blocks for compact rows so only a block is ever converted."""
+    if b.dtype == np.float32:
+        yield start, b[start:]
+        return
+    step = block_size * 8
+    for offset in range(start, len(b), step):
+        yield offset, normalize_rows(b[offset : offset + step])
+
+
+def similar_pairs(
+    a: np.ndarray,
+    b: Optional[np.ndarray] = None,
+    threshold: float = 0.9,
+    block_size: int = 1024,
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Find all row pairs with cosine similarity >= threshold.
+
+    Rows must be normalized. Without ``b`` the rows of ``a`` are compared with
+    each other and every pair is returned once (i < j).
+
+    Returns:
+        Row indices into a, row indices into b (or a) and the similarities.
+    """
+    self_pairs = b is None
+    b = a if self_pairs else b
+    rows, cols, sims = [], [], []
+    for start in range(0, len(a), block_size):
+        left = _unit_rows(a[start : start + block_size])
+        # for self pairs only columns >= start can hold pairs with i < j
+        for offset, right in _column_blocks(b, start if self_pairs else 0, block_size):
+            block = left @ right.T
+            if self_pairs and offset == start:
+                square = block[:, : len(block)]
+                square[np.tril_indices(len(block))] = -np.inf
+            i, j = np.nonzero(block >= threshold)
+            rows.append(i + start)
+            cols.append(j + offset)
+            sims.append(block[i, j])
+    if not rows:
+        empty = np.empty(0, dtype=np.int64)
+        return empty, empty, np.empty(0, dtype=np.float32)
+    return np.concatenate(rows), np.concatenate(cols), np.concatenate(sims)
+
+
+def best_matches(
+    a: np.ndarray,
+    b: np.ndarray,
+    groups: np.ndarray,
+    exclude_groups: Optional[np.ndarray] = None,
+    block_size: int = 1024,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Find, for every row of a, its most similar row of b within each group.
+
+    Args:
+        groups: Group id (0..g-1) of every row of b, e.g. the model it came from
+        exclude_groups: Group id of every row of a whose own group is skipped
+
+    Returns:
+        (len(a), g) arrays of best row indices into b (-1 if none) and their
+        similarities (-inf if none).
+    """
+    group_count = int(groups.max()) + 1 if len(groups) else 0
+    best_index = np.full((len(a), group_count), -1, dtype=np.int64)
+    best_sim = np.full((len(a), group_count), -np.inf, dtype=np.float32)
+    # sort b by group so every group is a contiguous column slice of a block
+    order = np.argsort(groups, kind="stable")
+    b = _unit_rows(b[order])
+    bounds = np.searchsorted(groups[order], np.arange(group_count + 1))
+    for start in range(0, len(a), block_size):
+        block = _unit_rows(a[start : start + block_size]) @ b.T
+        stop = start + len(block)
+        for g in range(group_count):
+            lo, hi = bounds[g], bounds[g + 1]
+            if lo == hi:
+                continue
+            arg = block[:, lo:hi].argmax(axis=1)
+            best_index[start:stop, g] = order[lo + arg]
+            best_sim[start:stop, g] = block[np.arange(len(block)), lo + arg]
+        if exclude_groups is not None:
+            own = exclude_groups[start:stop]
+            best_index[np.arange(start, stop), own] = -1
+            best_sim[np.arange(start, stop), own] = -np.inf
+    return best_index, best_sim
+
+
+def component_labels(n: int, rows: np.ndarray, cols: np.ndarray) -> np.ndarray:
+    """Label the connected components of the graph with the given edges."""
+    graph = coo_matrix((np.ones(len(rows), dtype=np.int8), (rows, cols)), shape=(n, n))
+    _, labels = connected_components(graph, directed=False)
+    return labels
+
+
+def leader_labels(
+    n: int, rows: np.ndarray, cols: np.ndarray, order: Optional[List[int]] = None
+) -> np.ndarray:
+    """Label groups formed around leaders instead of connected components.
+
+    Rows are visited in ``order`` (default: index order); each row not yet
+    grouped leads a new group and takes its ungrouped neighbours, so every
+    member is linked to its leader and groups can't chain.
+    """
+    graph = coo_matrix(
+        (np.ones(len(rows), dtype=np.int8), (rows, cols)), shape=(n, n)
+    ).tocsr()
+    graph = (graph + graph.T).tocsr()
+    labels = np.full(n, -1, dtype=np.int64)
+    group = 0
+    for leader in range(n) if order is None else order:
+        if labels[leader] >= 0:
+            continue
+        neighbours = graph.indices[graph.indptr[leader] : graph.indptr[leader + 1]]
+        labels[leader] = group
+        labels[neighbours[labels[neighbours] < 0]] = group
+        group += 1
+    return labels
+
+
+def complete_linkage_labels(vectors: np.ndarray, threshold: float) -> np.ndarray:
+    """Label groups in which every pair of rows reaches cosine similarity
+    ``threshold`` (complete linkage). Builds the full distance matrix, so
+    it is meant for a few thousand rows at most."""
+    if len(vectors) < 2:
+        return np.zeros(len(vectors), dtype=np.int64)
+    tree = linkage(vectors, method="complete", metric="cosine")
+    return fcluster(tree, t=1 - threshold, criterion="distance") - 1
+
+
+def group_members(labels: np.ndarray) -> List[np.ndarray]:
+    """Split row indices by label, keeping labels in first-seen order."""
+    order = np.argsort(labels, kind="stable")
+    boundaries = np.flatnonzero(np.diff(labels[order])) + 1
+    groups = np.split(order, boundaries)
+    return sorted(groups, key=lambda members: members[0])